@@ -4,10 +4,21 @@ from datetime import datetime
 from datetime import timezone, timedelta
 import subprocess
 import time
-import zipfile
-import glob
+import zlib
+import shlex
+import threading
+import socket
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 import common
+import col_archive
+import col_manifest
+import col_meter
+import col_lineindex
+import col_reader
+import col_search
+import ssh_pool
 
 
 JSON_LOGFILE = "/app/config/col_logfile.json"
@@ -15,205 +26,278 @@ JSON_COMMAND = "/app/config/col_command.json"
 OUTPUT_LOGDIR = "/app/output/log"
 OUTPUT_ZIPDIR = "/app/output/zip"
 
+REMOTE_USER = "nutanix"
+# connect_ssh と同じ鍵を SCP フォールバックでも使用する
+KEY_FILE = os.getenv("SSH_KEY_PATH", "/app/config/.ssh/loghoi-key")
+# 1つのSSHトランスポート上で同時に開くSFTPチャネル数（sshd MaxSessions=10 未満に抑える）
+DOWNLOAD_CONCURRENCY = int(os.getenv("COLLECT_DOWNLOAD_CONCURRENCY", "8"))
+# コマンド同時実行数と1コマンドあたりのタイムアウト（秒、col_command.json の "timeout" で個別指定可）
+COMMAND_CONCURRENCY = int(os.getenv("COLLECT_COMMAND_CONCURRENCY", "4"))
+COMMAND_TIMEOUT = int(os.getenv("COLLECT_COMMAND_TIMEOUT", "300"))
+# クラスター一括収集時に同時に処理するCVM数
+CLUSTER_CONCURRENCY = int(os.getenv("COLLECT_CLUSTER_CONCURRENCY", "4"))
+# 転送モード: sftp（既定）/ gzip（CVM側で gzip -c してから転送し、バックエンドで展開）
+TRANSFER_MODES = ("sftp", "gzip")
+TRANSFER_MODE = os.getenv("COLLECT_TRANSFER_MODE", "sftp")
+REMOTE_GZIP_LEVEL = int(os.getenv("COLLECT_REMOTE_GZIP_LEVEL", "1"))
+# gzipモードの1ワーカーが同時に使うチャネル数（gzip の exec チャネル + フォールバック/差分用のSFTPチャネル）
+GZIP_CHANNELS_PER_WORKER = 2
+# SSH cat フォールバック用にワーカー分とは別に確保するチャネル数（足りない間はリース側で空きを待つ）
+CAT_FALLBACK_CHANNELS = 1
+# 転送チャネルの無通信タイムアウト（秒）
+TRANSFER_IDLE_TIMEOUT = 60
+# 差分収集: 前回バンドルのファイルを基準に、リモートで追記された範囲のみ取得する
+INCREMENTAL_DEFAULT = os.getenv("COLLECT_INCREMENTAL", "false").lower() == "true"
+
 os.makedirs(OUTPUT_LOGDIR, exist_ok=True)
 os.makedirs(OUTPUT_ZIPDIR, exist_ok=True)
 
+
+class CollectionAborted(Exception):
+    """収集の中断要求（progress_callback から送出すると、残りの取得/コマンドを打ち切りバンドルを破棄する）"""
+
+
 class CollectLogGateway():
-    def collect_logs(self, cvm, progress_callback=None):
+    def collect_logs(self, cvm, progress_callback=None, max_workers=None, archive_format=None, compress_level=None,
+                     incremental=None, transfer_mode=None):
         # make log/download directory
-        _jst_time = datetime.now().astimezone(timezone(timedelta(hours=+9)))
-        folder_name = datetime.strftime(_jst_time, "loghoi_%Y%m%d_%H%M%S")
-        log_folder = os.path.join(OUTPUT_LOGDIR, folder_name)
-        os.makedirs(log_folder, exist_ok=True)
+        folder_name, log_folder = self._make_log_folder()
         print(f"[collectlog] start cvm={cvm} folder={folder_name}")
 
         # load json file
-        try:
-            f = open(JSON_LOGFILE, "r")
-            _setting_json = json.load(f)
-            logfile_list = _setting_json["LOGFILE_LIST"]
-            f.close()
-
-            f = open(JSON_COMMAND, "r")
-            _setting_json = json.load(f)
-            command_list = _setting_json["COMMAND_LIST"]
-            f.close()
-
-            # settings loaded
-        except:
-            print("[collectlog][error] missing json file (col_logfile.json / col_command.json)")
+        settings = self._load_settings()
+        if settings is None:
             return {"message": "missing json file"}
+        logfile_list, command_list = settings
 
+        # 完了したファイルから順次バンドルへ追加する（後段の一括ZIP作成を行わない）
+        archive = col_archive.open_archive(os.path.join(OUTPUT_ZIPDIR, folder_name), archive_format, compress_level)
+        zip_filename = os.path.basename(archive.path)
+        try:
+            success_files, failed_files, transfer = self._collect_node(
+                cvm, log_folder, logfile_list, command_list,
+                progress_callback=progress_callback,
+                max_workers=max_workers,
+                archive=archive,
+                incremental=incremental,
+                transfer_mode=transfer_mode,
+            )
+            # 進捗コールバックが中断を求めた場合（ジョブの再投入等）は確定済みのバンドルも残さない
+            self._finalize_archive(archive, log_folder, progress_callback=progress_callback)
+            self._print_done()
+            print(f"[collectlog] done cvm={cvm} folder={folder_name} saved={success_files} failed={failed_files} zip={zip_filename}")
+
+            # 進捗コールバック: 完全完了
+            if progress_callback:
+                progress_callback({
+                    "stage": "done",
+                    "current": 100,
+                    "total": 100,
+                    "message": "ログ収集が完了しました"
+                })
+        except Exception:
+            archive.abort()
+            raise
 
-        # Download LOGFILEs
-        print("[collectlog] download logfiles (SFTP -> SCP -> SSH cat)")
-        remote_host = cvm
-        remote_user = "nutanix"
-        key_file = "/app/config/.ssh/ntnx-lockdown"
+        return {"message": "finished collect log", "zip_name": zip_filename, "transfer": transfer}
 
-        success_files = 0
-        failed_files = 0
-        total_files = len(logfile_list)
-        
-        # 進捗コールバック: ログファイルダウンロード開始
-        if progress_callback:
+    def collect_cluster_logs(self, cvms, progress_callback=None, max_workers=None, max_parallel=None,
+                             archive_format=None, compress_level=None, incremental=None, transfer_mode=None):
+        """クラスター内の全CVMから並列にログ収集し、CVMごとのサブフォルダを1つのZIPにまとめる"""
+        folder_name, log_folder = self._make_log_folder()
+        print(f"[collectlog] start cluster cvms={cvms} folder={folder_name}")
+
+        settings = self._load_settings()
+        if settings is None:
+            return {"message": "missing json file"}
+        logfile_list, command_list = settings
+
+        # ノード単位の進捗（ファイル数 + コマンド数）を集約して全体進捗を算出する
+        units_per_node = len(logfile_list) + len(command_list)
+        total_units = units_per_node * len(cvms)
+        lock = threading.Lock()
+        nodes = {cvm: {"stage": "pending", "current": 0, "total": units_per_node, "message": "待機中"} for cvm in cvms}
+
+        def _emit(message):
+            if not progress_callback:
+                return
+            done_units = sum(n["current"] for n in nodes.values())
             progress_callback({
-                "stage": "logfiles",
-                "current": 0,
-                "total": total_files,
-                "message": "ログファイルのダウンロードを開始しています..."
+                "stage": "cluster",
+                "current": done_units,
+                "total": total_units,
+                "message": message,
+                "transfer": _cluster_transfer(),
+                "nodes": {cvm: dict(n) for cvm, n in nodes.items()},
             })
-        
-        for i, item in enumerate(logfile_list):
-            remote_path = item["src_path"]
-            local_path = log_folder
-            base = os.path.basename(remote_path)
-            local_file = os.path.join(local_path, base)
 
-            # sftp -> scp -> ssh cat
-
-            # 1) SFTPでのダウンロード（推奨）
-            try:
-                ssh_client = common.connect_ssh(remote_host)
-                if ssh_client:
-                    try:
-                        sftp = ssh_client.open_sftp()
-                        sftp.get(remote_path, local_file)
-                        sftp.close()
-                        ssh_client.close()
-                        success_files += 1
-                        # 進捗更新
-                        if progress_callback:
-                            progress_callback({
-                                "stage": "logfiles",
-                                "current": i + 1,
-                                "total": total_files,
-                                "message": f"ログファイルをダウンロード中... ({i + 1}/{total_files})"
-                            })
-                        continue
-                    except Exception as se:
-                        pass
-                        try:
-                            ssh_client.close()
-                        except:
-                            pass
-            except Exception as ce:
-                pass
+        def _cluster_transfer():
+            # CVMごとの転送量を合算（ETA は最も遅いCVMに合わせる）
+            transfers = [n["transfer"] for n in nodes.values() if n.get("transfer")]
+            if not transfers:
+                return None
+            etas = [t["eta_seconds"] for t in transfers if t.get("eta_seconds") is not None]
+            return {
+                "bytes_done": sum(t["bytes_done"] for t in transfers),
+                "bytes_total": sum(t["bytes_total"] for t in transfers),
+                "rate_bps": round(sum(t["rate_bps"] for t in transfers), 1),
+                "eta_seconds": max(etas) if etas else None,
+            }
 
-            # 2) scpでのダウンロード（従来）
-            command = [
-                "scp", "-O",
-                "-o", "StrictHostKeyChecking=no",
-                "-i", key_file,
-                f"{remote_user}@{remote_host}:{remote_path}",
-                local_path
-            ]
+        def _node_callback(cvm):
+            def _callback(info):
+                stage = info.get("stage")
+                offset = len(logfile_list) if stage == "commands" else 0
+                with lock:
+                    transfer = info.get("transfer") or nodes[cvm].get("transfer")
+                    nodes[cvm] = {
+                        "stage": stage,
+                        "current": offset + info.get("current", 0),
+                        "total": units_per_node,
+                        "message": info.get("message", ""),
+                    }
+                    if transfer:
+                        nodes[cvm]["transfer"] = transfer
+                    finished = sum(1 for n in nodes.values() if n["stage"] == "done")
+                    _emit(f"クラスターからログを収集中... ({finished}/{len(cvms)} CVM完了)")
+            return _callback
+
+        archive = col_archive.open_archive(os.path.join(OUTPUT_ZIPDIR, folder_name), archive_format, compress_level)
+        zip_filename = os.path.basename(archive.path)
+
+        def _collect(cvm):
+            node_folder = os.path.join(log_folder, cvm)
+            os.makedirs(node_folder, exist_ok=True)
+            callback = _node_callback(cvm)
             try:
-                result = subprocess.run(
-                    command,
-                    check=True,
-                    capture_output=True,
-                    text=True,
-                    timeout=60,
+                result = self._collect_node(
+                    cvm, node_folder, logfile_list, command_list,
+                    progress_callback=callback,
+                    max_workers=max_workers,
+                    archive=archive,
+                    arc_prefix=cvm,
+                    incremental=incremental,
+                    transfer_mode=transfer_mode,
                 )
-                success_files += 1
-                # 進捗更新
-                if progress_callback:
-                    progress_callback({
-                        "stage": "logfiles",
-                        "current": i + 1,
-                        "total": total_files,
-                        "message": f"ログファイルをダウンロード中... ({i + 1}/{total_files})"
-                    })
-                continue
-            except subprocess.CalledProcessError as e:
-                pass
-            except subprocess.TimeoutExpired:
-                pass
-
-            # 3) フォールバック: SSHでcatしてローカルへ保存
-            try:
-                ssh_fallback = common.connect_ssh(remote_host)
-                if ssh_fallback:
-                    stdin, stdout, stderr = ssh_fallback.exec_command(f"cat {remote_path}")
-                    content = stdout.read()
-                    err = stderr.read()
-                    if err and err.strip():
-                        failed_files += 1
-                    else:
-                        with open(local_file, 'wb') as lf:
-                            lf.write(content)
-                        success_files += 1
-                        # 進捗更新
-                        if progress_callback:
-                            progress_callback({
-                                "stage": "logfiles",
-                                "current": i + 1,
-                                "total": total_files,
-                                "message": f"ログファイルをダウンロード中... ({i + 1}/{total_files})"
-                            })
-                        ssh_fallback.close()
-                        continue
-            except Exception as fe:
-                failed_files += 1
-            # 続行（他ファイルは可能な限り収集）
-            continue
-
-
-        # Get Command result
-        print(">>>>>>>> Command Execute <<<<<<<<<")
-        ssh = common.connect_ssh(cvm)
-        total_commands = len(command_list)
-        
-        # 進捗コールバック: コマンド実行開始
-        if progress_callback:
-            progress_callback({
-                "stage": "commands",
-                "current": 0,
-                "total": total_commands,
-                "message": "コマンドを実行しています..."
-            })
-        
-        for cmd_idx, command_item in enumerate(command_list):
-            print("command: ", command_item)
-
-            try:
-                stdin, stdout, stderr = ssh.exec_command(command_item["command"])
-                while not stdout.channel.exit_status_ready():
-                    time.sleep(1)
-                output = stdout.read()
-
-                # create log file name
-                now = datetime.now().strftime("%Y%m%d_%H%M%S")
-                log_filename = f"{log_folder}/{command_item['name']}_{now}.txt"
-
-                # save logfile
-                with open(log_filename, "w") as f:
-                    f.write(output.decode("utf-8").rstrip())
-                
-                # 進捗更新
-                if progress_callback:
-                    progress_callback({
-                        "stage": "commands",
-                        "current": cmd_idx + 1,
-                        "total": total_commands,
-                        "message": f"コマンドを実行中... ({cmd_idx + 1}/{total_commands})"
-                    })
+                callback({"stage": "done", "current": units_per_node, "message": "完了"})
+                return result
+            except CollectionAborted:
+                raise
             except Exception as e:
-                print("command error skipped: ", command_item)
-                # 進捗更新（エラー時も）
-                if progress_callback:
-                    progress_callback({
-                        "stage": "commands",
-                        "current": cmd_idx + 1,
-                        "total": total_commands,
-                        "message": f"コマンドを実行中... ({cmd_idx + 1}/{total_commands})"
-                    })
-                continue
-        ssh.close()
+                print(f"[collectlog][error] cvm={cvm}: {e}")
+                with lock:
+                    nodes[cvm].update({"stage": "failed", "current": units_per_node, "message": str(e)})
+                return 0, len(logfile_list), None
 
-        # Archive Zip（完了後に所有者をホストUID/GIDへ合わせる）
-        # 進捗コールバック: ZIP作成開始
+        workers = max(1, min(int(max_parallel or CLUSTER_CONCURRENCY), len(cvms) or 1))
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="col-node") as executor:
+                try:
+                    results = dict(zip(cvms, executor.map(_collect, cvms)))
+                except CollectionAborted:
+                    # 未着手のCVMは開始しない（実行中のCVMも次の進捗通知で中断される）
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+            self._finalize_archive(archive, log_folder, progress_callback=progress_callback)
+            self._print_done()
+            for cvm, (success_files, failed_files, _) in results.items():
+                print(f"[collectlog] done cvm={cvm} folder={folder_name}/{cvm} saved={success_files} failed={failed_files}")
+            print(f"[collectlog] done cluster folder={folder_name} zip={zip_filename}")
+
+            if progress_callback:
+                progress_callback({
+                    "stage": "done",
+                    "current": 100,
+                    "total": 100,
+                    "message": "ログ収集が完了しました",
+                    "nodes": {cvm: dict(n) for cvm, n in nodes.items()},
+                })
+        except Exception:
+            archive.abort()
+            raise
+
+        return {
+            "message": "finished collect log",
+            "zip_name": zip_filename,
+            "nodes": {
+                cvm: {"saved": r[0], "failed": r[1], "stage": nodes[cvm]["stage"], "transfer": r[2]}
+                for cvm, r in results.items()
+            },
+        }
+
+    def _make_log_folder(self):
+        _jst_time = datetime.now().astimezone(timezone(timedelta(hours=+9)))
+        base_name = datetime.strftime(_jst_time, "loghoi_%Y%m%d_%H%M%S")
+        # 同一秒に複数ジョブが開始しても同じフォルダ/バンドルを共有しないよう連番を付ける
+        folder_name = base_name
+        suffix = 1
+        while True:
+            log_folder = os.path.join(OUTPUT_LOGDIR, folder_name)
+            try:
+                os.makedirs(log_folder)
+                return folder_name, log_folder
+            except FileExistsError:
+                suffix += 1
+                folder_name = f"{base_name}_{suffix}"
+
+    def _load_settings(self):
+        """col_logfile.json / col_command.json を読み込み (LOGFILE_LIST, COMMAND_LIST) を返す"""
+        try:
+            with open(JSON_LOGFILE, "r") as f:
+                logfile_list = json.load(f)["LOGFILE_LIST"]
+            with open(JSON_COMMAND, "r") as f:
+                command_list = json.load(f)["COMMAND_LIST"]
+        except Exception:
+            print("[collectlog][error] missing json file (col_logfile.json / col_command.json)")
+            return None
+        return logfile_list, command_list
+
+    def _collect_node(self, cvm, log_folder, logfile_list, command_list, progress_callback=None, max_workers=None,
+                      archive=None, arc_prefix="", incremental=None, transfer_mode=None):
+        """1台のCVMからログファイルとコマンド結果を log_folder に収集し (成功数, 失敗数, 転送量の集計) を返す
+
+        archive を渡すと、取得が完了したファイルから順に arc_prefix 配下へ追加する。
+        """
+        # Download LOGFILEs（1本のSSHトランスポート上でSFTPチャネルを並列実行）
+        transfer_mode = transfer_mode or TRANSFER_MODE
+        print(f"[collectlog] download logfiles cvm={cvm} mode={transfer_mode} (SFTP -> SCP -> SSH cat)")
+        # ダウンロード/コマンドの並列数分のチャネルを1本のトランスポートに確保する
+        # gzipモードは1ワーカーが最大2チャネルを使うため、ワーカー数をチャネル上限の半分までに抑える
+        # cat フォールバックはワーカーのSFTPチャネルを開いたまま別チャネルを使うため、その分も確保する
+        # （gzipモードは gzip チャネルを閉じてからフォールバックするので1ワーカー2チャネルに収まる）
+        workers = int(max_workers or DOWNLOAD_CONCURRENCY)
+        per_worker = GZIP_CHANNELS_PER_WORKER if transfer_mode == "gzip" else 1
+        extra = CAT_FALLBACK_CHANNELS if per_worker == 1 else 0
+        workers = max(1, min(workers, (ssh_pool.MAX_CHANNELS - extra) // per_worker))
+        channels = max(workers * per_worker + extra, COMMAND_CONCURRENCY)
+        ssh_client = common.connect_ssh(cvm, channels=channels)
+        try:
+            success_files, failed_files, transfer = self._download_logfiles(
+                ssh_client, cvm, logfile_list, log_folder,
+                progress_callback=progress_callback,
+                max_workers=workers,
+                archive=archive,
+                arc_prefix=arc_prefix,
+                incremental=INCREMENTAL_DEFAULT if incremental is None else incremental,
+                transfer_mode=transfer_mode,
+            )
+
+            # Get Command result（同じSSHトランスポート上でコマンドを並列実行）
+            print(f">>>>>>>> Command Execute ({cvm}) <<<<<<<<<")
+            self._run_commands(
+                ssh_client, command_list, log_folder,
+                progress_callback=progress_callback,
+                archive=archive,
+                arc_prefix=arc_prefix,
+            )
+        finally:
+            if ssh_client:
+                ssh_client.close()
+        return success_files, failed_files, transfer
+
+    def _finalize_archive(self, archive, log_folder, progress_callback=None):
+        """ストリーミング追加中のZIPを確定し、ZIPファイル名を返す"""
+        # 進捗コールバック: ZIP確定開始（残りの圧縮待ちのみ）
         if progress_callback:
             progress_callback({
                 "stage": "zip",
@@ -221,18 +305,8 @@ class CollectLogGateway():
                 "total": 100,
                 "message": "ZIPファイルを作成しています..."
             })
-        
-        # archive
-        zip_filename = f"{folder_name}.zip"
-        zip_path = os.path.join(OUTPUT_ZIPDIR, zip_filename)
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-            # ディレクトリ内のファイルを列挙
-            for filename in os.listdir(log_folder):
-                filepath = os.path.join(log_folder, filename)
-                # ファイルのみを対象とする（ディレクトリはスキップとする）
-                if os.path.isfile(filepath):
-                    # ZIPに追加。arcnameでZIP内のファイル名を指定
-                    zf.write(filepath, arcname=filename)
+
+        zip_path = archive.close()
         
         # 進捗コールバック: ZIP作成完了
         if progress_callback:
@@ -247,16 +321,29 @@ class CollectLogGateway():
         try:
             host_uid = int(os.getenv('HOST_UID', '1000'))
             host_gid = int(os.getenv('HOST_GID', '1000'))
-            for filename in os.listdir(log_folder):
-                filepath = os.path.join(log_folder, filename)
-                if os.path.isfile(filepath):
-                    os.chown(filepath, host_uid, host_gid)
-            os.chown(log_folder, host_uid, host_gid)
+            for dirpath, dirnames, filenames in os.walk(log_folder):
+                os.chown(dirpath, host_uid, host_gid)
+                for filename in filenames:
+                    os.chown(os.path.join(dirpath, filename), host_uid, host_gid)
             os.chown(zip_path, host_uid, host_gid)
         except Exception:
             pass
 
-
+        return os.path.basename(zip_path)
+
+    def _walk_log_folder(self, log_folder):
+        """log_folder 配下のファイルを (フルパス, 相対パス) で列挙（行インデックス等の隠しファイルは除外）"""
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(log_folder):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.startswith("."):
+                    continue
+                filepath = os.path.join(dirpath, filename)
+                entries.append((filepath, os.path.relpath(filepath, log_folder)))
+        return entries
+
+    def _print_done(self):
         # Finish Hoi Hoi (always show)
         try:
             print(">>>>>>>> 　　＿＿＿＿＿＿＿ ")
@@ -268,87 +355,468 @@ class CollectLogGateway():
         except Exception:
             # ASCII表示に失敗しても処理は継続する
             pass
-        print(f"[collectlog] done cvm={cvm} folder={folder_name} saved={success_files} failed={failed_files} zip={zip_filename}")
-        
-        # 進捗コールバック: 完全完了
+    
+    def _download_logfiles(self, ssh_client, cvm, logfile_list, log_folder, progress_callback=None, max_workers=None,
+                           archive=None, arc_prefix="", incremental=False, transfer_mode="sftp"):
+        """ログファイルを並列ダウンロードし (成功数, 失敗数, 転送量の集計) を返す
+
+        SSHトランスポートはCVMごとに1本だけ張り、その上にワーカー数分の
+        SFTPチャネルを多重化する。失敗したファイルのみ SCP -> SSH cat に
+        フォールバックする。
+        incremental=True の場合は前回収集時のマニフェストを参照し、
+        追記分のみ取得して前回ファイルと結合する（ローテーション等を検出したら全量取得）。
+        transfer_mode="gzip" の場合、全量取得はCVM側で圧縮したストリームを優先する。
+        """
+        total_files = len(logfile_list)
+        workers = max(1, min(int(max_workers or DOWNLOAD_CONCURRENCY), total_files or 1))
+        print(f"[collectlog] download workers={workers} files={total_files}")
+
+        # 進捗コールバック: ログファイルダウンロード開始
         if progress_callback:
             progress_callback({
-                "stage": "done",
-                "current": 100,
-                "total": 100,
-                "message": "ログ収集が完了しました"
+                "stage": "logfiles",
+                "current": 0,
+                "total": total_files,
+                "message": "ログファイルのダウンロードを開始しています..."
             })
-        
-        return {"message": "finished collect log"}
-    
+
+        lock = threading.Lock()
+        counts = {"done": 0, "success": 0, "failed": 0, "transferred": 0, "reused": 0, "gzip_fallback": 0}
+        # gzipモードの全量取得では stat も gzip と同じ exec チャネルで行い、SFTPチャネルは必要時のみ開く
+        exec_stat = transfer_mode == "gzip" and not incremental
+
+        def _report(transfer):
+            # 転送中のバイト数/スループット/ETA（ファイル完了を待たずに一定間隔で通知）
+            if progress_callback:
+                done = counts["done"]
+                progress_callback({
+                    "stage": "logfiles",
+                    "current": done,
+                    "total": total_files,
+                    "message": f"ログファイルをダウンロード中... ({done}/{total_files})",
+                    "transfer": transfer,
+                })
+
+        meter = col_meter.TransferMeter(total_files, on_report=_report)
+        manifest = col_manifest.NodeManifest(self._manifest_path(cvm))
+        local = threading.local()
+        sftp_channels = []
+
+        def _get_sftp():
+            # ワーカースレッドごとに1チャネルを開き、以降は使い回す
+            sftp = getattr(local, "sftp", None)
+            if sftp is None:
+                sftp = ssh_client.open_sftp()
+                local.sftp = sftp
+                with lock:
+                    sftp_channels.append(sftp)
+            return sftp
+
+        def _fetch(item):
+            remote_path = item["src_path"]
+            local_file = os.path.join(log_folder, os.path.basename(remote_path))
+            # 取得前の stat をマニフェストへ記録する（取得中の追記は次回の差分で拾う）
+            remote_stat = self._stat_remote(_get_sftp, remote_path) if ssh_client and not exec_stat else None
+            entry = manifest.get(remote_path) if incremental and remote_stat else None
+            name = os.path.basename(remote_path)
+            remote_size = remote_stat.st_size if remote_stat else 0
+            delta = None
+            if entry:
+                meter.start_file(name, remote_size, base=min(entry["size"], remote_size))
+                try:
+                    delta = col_manifest.fetch_delta(_get_sftp(), remote_path, remote_stat, local_file, entry,
+                                                     callback=meter.callback(name))
+                except CollectionAborted:
+                    raise
+                except Exception as e:
+                    print(f"[collectlog][warn] incremental fetch failed, fallback to full: {remote_path} ({e})")
+            transferred = delta
+            if delta is None:
+                meter.start_file(name, remote_size)
+                fetched = {}
+
+                def _on_stat(stat):
+                    fetched["stat"] = stat
+                    meter.start_file(name, stat.st_size)
+
+                transferred = self._fetch_logfile(ssh_client, _get_sftp, cvm, remote_path, local_file, log_folder,
+                                                  transfer_mode=transfer_mode, callback=meter.callback(name),
+                                                  on_stat=_on_stat if exec_stat else None, fallback=fetched)
+                remote_stat = remote_stat or fetched.get("stat")
+                if fetched.get("gzip_fallback"):
+                    with lock:
+                        counts["gzip_fallback"] += 1
+            ok = transferred is not None
+            if ok:
+                if remote_stat:
+                    try:
+                        manifest.record(remote_path, local_file, int(remote_stat.st_mtime))
+                    except OSError as e:
+                        print(f"[collectlog][warn] manifest record failed: {remote_path} ({e})")
+                if archive:
+                    archive.add(local_file, os.path.join(arc_prefix, os.path.basename(local_file)))
+                self._build_line_index(local_file)
+            local_size = os.path.getsize(local_file) if ok else 0
+            meter.finish_file(name, ok, size=local_size, wire_bytes=transferred)
+            with lock:
+                counts["done"] += 1
+                counts["success" if ok else "failed"] += 1
+                counts["transferred"] += transferred or 0
+                if delta is not None:
+                    counts["reused"] += local_size - delta
+                done = counts["done"]
+                # 進捗更新（完了順にカウント）
+                if progress_callback:
+                    progress_callback({
+                        "stage": "logfiles",
+                        "current": done,
+                        "total": total_files,
+                        "message": f"ログファイルをダウンロード中... ({done}/{total_files})",
+                        "transfer": meter.snapshot(),
+                    })
+            return ok
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="col-sftp") as executor:
+                futures = [executor.submit(_fetch, item) for item in logfile_list]
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except CollectionAborted:
+                        # 未着手のファイルは取得しない（実行中のワーカーも次の進捗通知で中断される）
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        raise
+                    except Exception as e:
+                        print(f"[collectlog][error] download worker: {e}")
+        finally:
+            for sftp in sftp_channels:
+                try:
+                    sftp.close()
+                except Exception:
+                    pass
+
+        try:
+            manifest.save()
+        except OSError as e:
+            print(f"[collectlog][warn] manifest save failed: cvm={cvm} ({e})")
+        transfer = meter.summary(workers=workers)
+        print(f"[collectlog] download bytes cvm={cvm} transferred={counts['transferred']} reused={counts['reused']} incremental={incremental} mode={transfer_mode}")
+        if counts["gzip_fallback"]:
+            print(f"[collectlog][warn] gzip transfer fell back to sftp cvm={cvm} files={counts['gzip_fallback']}/{total_files}")
+        transfer["gzip_fallback"] = counts["gzip_fallback"]
+        print(f"[collectlog] download rate cvm={cvm} seconds={transfer['seconds']} rate_bps={transfer['rate_bps']} workers={workers}")
+        return counts["success"], counts["failed"], transfer
+
+    def _build_line_index(self, local_file):
+        """取得完了時に行オフセットインデックスを作成（表示側のページ送りを高速化）"""
+        try:
+            col_lineindex.build_index(local_file)
+        except Exception as e:
+            print(f"[collectlog][warn] line index build failed: {local_file} ({e})")
+
+    def _manifest_path(self, cvm):
+        """差分収集用マニフェストの保存先（CVMごと）"""
+        return os.path.join(OUTPUT_LOGDIR, ".manifest", f"{cvm}.json")
+
+    def _stat_remote(self, get_sftp, remote_path):
+        try:
+            return get_sftp().stat(remote_path)
+        except Exception:
+            return None
+
+    def _fetch_logfile(self, ssh_client, get_sftp, cvm, remote_path, local_file, log_folder, transfer_mode="sftp",
+                       callback=None, on_stat=None, fallback=None):
+        """1ファイルを (gzip ->) sftp -> scp -> ssh cat の順で取得し、転送バイト数を返す（失敗時 None）
+
+        callback(取得済みバイト, 合計) は gzip / sftp 取得中に呼ばれる（scp / cat は完了時のみ集計）。
+        on_stat を渡すと gzip 転送前に同じチャネルで stat し、結果（st_size / st_mtime）を渡す。
+        gzip から SFTP 以降へフォールバックした場合は fallback["gzip_fallback"] を True にする。
+        """
+        # 0) CVM側で圧縮して転送（gzipモード時のみ）
+        if ssh_client and transfer_mode == "gzip":
+            try:
+                return self._fetch_compressed(ssh_client, remote_path, local_file, callback=callback, on_stat=on_stat)
+            except CollectionAborted:
+                raise
+            except Exception as e:
+                print(f"[collectlog][warn] gzip transfer failed, fallback to sftp: {remote_path} ({e})")
+                if fallback is not None:
+                    fallback["gzip_fallback"] = True
+                if on_stat is not None:
+                    stat = self._stat_remote(get_sftp, remote_path)
+                    if stat is not None:
+                        on_stat(stat)
+
+        # 1) SFTPでのダウンロード（推奨）
+        if ssh_client:
+            try:
+                get_sftp().get(remote_path, local_file, callback=callback)
+                return os.path.getsize(local_file)
+            except CollectionAborted:
+                raise
+            except Exception:
+                pass
+
+        # 2) scpでのダウンロード（従来）
+        command = [
+            "scp", "-O",
+            "-o", "StrictHostKeyChecking=no",
+            "-i", KEY_FILE,
+            f"{REMOTE_USER}@{cvm}:{shlex.quote(remote_path)}",
+            log_folder
+        ]
+        try:
+            subprocess.run(
+                command,
+                check=True,
+                capture_output=True,
+                text=True,
+                timeout=60,
+            )
+            return os.path.getsize(local_file)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError):
+            pass
+
+        # 3) フォールバック: SSHでcatしてローカルへ保存（既存トランスポート上の別チャネル）
+        if ssh_client:
+            try:
+                stdin, stdout, stderr = ssh_client.exec_command(f"cat {shlex.quote(remote_path)}")
+                try:
+                    content = stdout.read()
+                    err = stderr.read()
+                finally:
+                    # 予約チャネルをすぐ空けるため、読み終えたら閉じる
+                    stdout.channel.close()
+                if not (err and err.strip()):
+                    with open(local_file, 'wb') as lf:
+                        lf.write(content)
+                    return len(content)
+            except Exception:
+                pass
+
+        # 取得失敗時は途中まで書かれた空ファイルを残さない
+        try:
+            os.remove(local_file)
+        except OSError:
+            pass
+        return None
+
+    def _fetch_compressed(self, ssh_client, remote_path, local_file, callback=None, on_stat=None):
+        """CVM側の gzip -c 出力を1チャネルで受信し、展開しながら local_file へ書き出す
+
+        戻り値は転送した（圧縮後の）バイト数。gzip の異常終了やストリーム不完全時は例外。
+        callback には展開後のバイト数（元ファイル換算の進捗）を渡す。
+        on_stat を渡すと、gzip の前に同じチャネルで `stat -c '%s %Y'` を実行し、その結果を渡す
+        （stat のためにSFTPチャネルを開かない）。
+        """
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        transferred = 0
+        written = 0
+        quoted = shlex.quote(remote_path)
+        command = f"gzip -c -{REMOTE_GZIP_LEVEL} {quoted}"
+        if on_stat is not None:
+            command = f"stat -c '%s %Y' {quoted} && {command}"
+        header = b"" if on_stat is not None else None
+        channel = ssh_client.open_session()
+        try:
+            channel.settimeout(TRANSFER_IDLE_TIMEOUT)
+            channel.exec_command(command)
+            with open(local_file, "wb") as f:
+                while True:
+                    while channel.recv_stderr_ready():
+                        channel.recv_stderr(32768)
+                    data = channel.recv(32768)
+                    if not data:
+                        break
+                    if header is not None:
+                        # 先頭行は stat の出力（"サイズ 更新時刻"）、以降が gzip ストリーム
+                        header += data
+                        if b"\n" not in header:
+                            continue
+                        line, data = header.split(b"\n", 1)
+                        header = None
+                        size, mtime = line.decode().split()
+                        on_stat(SimpleNamespace(st_size=int(size), st_mtime=int(mtime)))
+                        if not data:
+                            continue
+                    transferred += len(data)
+                    chunk = decompressor.decompress(data)
+                    f.write(chunk)
+                    written += len(chunk)
+                    if callback:
+                        callback(written, None)
+                f.write(decompressor.flush())
+            if not channel.status_event.wait(TRANSFER_IDLE_TIMEOUT):
+                raise RuntimeError("gzip did not exit")
+            status = channel.recv_exit_status()
+            if status != 0:
+                raise RuntimeError(f"gzip exit status {status}")
+            if not decompressor.eof:
+                raise RuntimeError("truncated gzip stream")
+        finally:
+            channel.close()
+        return transferred
+
+    def _run_commands(self, ssh_client, command_list, log_folder, progress_callback=None, max_workers=None,
+                      archive=None, arc_prefix=""):
+        """COMMAND_LIST を多重化チャネルで並列実行し (成功数, 失敗数) を返す"""
+        total_commands = len(command_list)
+        workers = max(1, min(int(max_workers or COMMAND_CONCURRENCY), total_commands or 1))
+
+        # 進捗コールバック: コマンド実行開始
+        if progress_callback:
+            progress_callback({
+                "stage": "commands",
+                "current": 0,
+                "total": total_commands,
+                "message": "コマンドを実行しています..."
+            })
+
+        lock = threading.Lock()
+        counts = {"done": 0, "success": 0, "failed": 0}
+
+        def _run(command_item):
+            print("command: ", command_item)
+            ok = False
+            # create log file name
+            now = datetime.now().strftime("%Y%m%d_%H%M%S")
+            log_filename = f"{log_folder}/{command_item['name']}_{now}.txt"
+            try:
+                if not ssh_client:
+                    raise RuntimeError("ssh connection is not available")
+                ok = self._exec_command_to_file(ssh_client, command_item, log_filename)
+            except Exception as e:
+                print(f"command error skipped: {command_item} ({e})")
+            # タイムアウト時もそこまでの出力はZIPへ含める
+            if archive and os.path.isfile(log_filename):
+                archive.add(log_filename, os.path.join(arc_prefix, os.path.basename(log_filename)))
+            if os.path.isfile(log_filename):
+                self._build_line_index(log_filename)
+            with lock:
+                counts["done"] += 1
+                counts["success" if ok else "failed"] += 1
+                done = counts["done"]
+                # 進捗更新（エラー時も）
+                if progress_callback:
+                    progress_callback({
+                        "stage": "commands",
+                        "current": done,
+                        "total": total_commands,
+                        "message": f"コマンドを実行中... ({done}/{total_commands})"
+                    })
+            return ok
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="col-cmd") as executor:
+            try:
+                list(executor.map(_run, command_list))
+            except CollectionAborted:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+        return counts["success"], counts["failed"]
+
+    def _exec_command_to_file(self, ssh_client, command_item, log_filename):
+        """1コマンドを専用チャネルで実行し、stdoutを log_filename へ逐次書き出す"""
+        timeout = float(command_item.get("timeout") or COMMAND_TIMEOUT)
+        deadline = time.monotonic() + timeout
+
+        channel = ssh_client.open_session()
+        try:
+            channel.exec_command(command_item["command"])
+            with open(log_filename, "wb") as f:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        print(f"command timeout ({timeout}s): {command_item['name']}")
+                        return False
+                    # stderrを読み捨ててウィンドウ詰まりを防ぐ
+                    while channel.recv_stderr_ready():
+                        channel.recv_stderr(32768)
+                    channel.settimeout(min(remaining, 1.0))
+                    try:
+                        data = channel.recv(32768)
+                    except socket.timeout:
+                        continue
+                    if not data:
+                        break
+                    f.write(data)
+
+            # stdout EOF 後は終了ステータス通知をイベントで待つ（ポーリングしない）
+            if not channel.status_event.wait(max(0.0, deadline - time.monotonic())):
+                print(f"command timeout ({timeout}s): {command_item['name']}")
+                return False
+            return True
+        finally:
+            channel.close()
+
     # Zip list 取得
     def get_ziplist(self):
-        zip_files = glob.glob(os.path.join(OUTPUT_ZIPDIR, "*.zip"))
-        zip_list = [os.path.basename(z) for z in zip_files]
+        # zip / tar.zst / tar.lz4 いずれの形式のバンドルも対象（作成中の .part は除外）
+        zip_list = [z for z in os.listdir(OUTPUT_ZIPDIR) if col_archive.is_bundle(z)]
         #zip_list.reverse()
         return zip_list
     
     # Zip 内のログ一覧
     def get_logs_in_zip(self, zip_name):
-        filename_without_ext, _ = os.path.splitext(zip_name)
+        filename_without_ext = col_archive.bundle_stem(zip_name)
         logs_path = os.path.join(OUTPUT_LOGDIR, filename_without_ext)
-        logs_list = os.listdir(logs_path)
+        # クラスター収集ではCVMごとのサブフォルダを "<cvm>/<file>" で返す
+        logs_list = [arcname for _, arcname in self._walk_log_folder(logs_path)]
         return logs_list
 
     def get_logcontent(self, log_file, zip_name, start: int | None = None, length: int | None = None):
-        filename_without_ext, _ = os.path.splitext(zip_name)
+        filename_without_ext = col_archive.bundle_stem(zip_name)
         log_path = os.path.join(OUTPUT_LOGDIR, filename_without_ext, log_file)
         # debug path
 
         try:
-            # 範囲指定なし: 既存互換（全文）
+            truncated = False
+            # 範囲指定なし: 既存互換（全文）。大きなファイルは先頭ページのみ返す
             if start is None and length is None:
-                with open(log_path, 'r') as file:
-                    content = file.read()
-                # 空のファイルかチェック
-                if not content.strip():
-                    return {'empty': True, 'message': 'ファイル内ログ無し'}
-                return content
-
-            # 範囲指定あり: バイトオフセットで読み取り
+                file_size = os.path.getsize(log_path)
+                if file_size <= col_reader.FULL_READ_MAX_BYTES:
+                    content, _ = col_reader.read_range(log_path, 0, file_size)
+                    # 空のファイルかチェック
+                    if not content.strip():
+                        return {'empty': True, 'message': 'ファイル内ログ無し'}
+                    return content
+                start, length = 0, col_reader.AUTO_PAGE_BYTES
+                truncated = True
+
+            # 範囲指定あり: バイトオフセットで読み取り（mmapからスライス）
             safe_start = max(0, int(start or 0))
             safe_length = int(length) if length is not None else 10000  # デフォルト上限
-            if safe_length < 0:
-                safe_length = 0
+            safe_length = min(max(0, safe_length), col_reader.FULL_READ_MAX_BYTES)
 
-            with open(log_path, 'rb') as bf:
-                bf.seek(safe_start)
-                chunk = bf.read(safe_length)
             # デコード（不正バイトは置換）
-            text = chunk.decode('utf-8', errors='replace')
+            text, read_bytes = col_reader.read_range(log_path, safe_start, safe_length)
             if text == '':
                 return {'empty': True, 'message': '指定範囲にデータ無し'}
-            return {
+            data = {
                 'range': {
                     'start': safe_start,
-                    'length': len(chunk)
+                    'length': read_bytes
                 },
                 'content': text
             }
+            if truncated:
+                data['truncated'] = True
+                data['file_size'] = os.path.getsize(log_path)
+            return data
         except Exception as e:
             return {'error': str(e)}
 
     def get_logcontent_paginated(self, log_file, zip_name, start_line: int = 0, end_line: int = 1000):
         """ログファイルを行ベースでページネーション読み込み"""
-        filename_without_ext, _ = os.path.splitext(zip_name)
+        filename_without_ext = col_archive.bundle_stem(zip_name)
         log_path = os.path.join(OUTPUT_LOGDIR, filename_without_ext, log_file)
         
         try:
             if not os.path.exists(log_path):
                 return {'error': 'File not found'}
             
-            lines = []
-            with open(log_path, 'r', encoding='utf-8', errors='replace') as file:
-                for i, line in enumerate(file):
-                    if i >= end_line:
-                        break
-                    if i >= start_line:
-                        lines.append(line.rstrip('\n\r'))
+            # 行オフセットインデックスで start_line 直前のブロックへ移動し、mmapから読む
+            lines = col_reader.read_lines(log_path, start_line, end_line)
             
             return {
                 'lines': lines,
@@ -363,22 +831,21 @@ class CollectLogGateway():
 
     def get_logfile_line_count(self, log_file, zip_name):
         """ログファイルの総行数を取得"""
-        filename_without_ext, _ = os.path.splitext(zip_name)
+        filename_without_ext = col_archive.bundle_stem(zip_name)
         log_path = os.path.join(OUTPUT_LOGDIR, filename_without_ext, log_file)
         
         try:
             if not os.path.exists(log_path):
                 return 0
             
-            with open(log_path, 'r', encoding='utf-8', errors='replace') as file:
-                return sum(1 for _ in file)
+            return col_lineindex.load_index(log_path)["lines"]
         except Exception as e:
             print(f"Error counting lines: {e}")
             return 0
 
     def get_logfile_size(self, log_file, zip_name):
         """ログファイルのサイズを取得"""
-        filename_without_ext, _ = os.path.splitext(zip_name)
+        filename_without_ext = col_archive.bundle_stem(zip_name)
         log_path = os.path.join(OUTPUT_LOGDIR, filename_without_ext, log_file)
         # debug path
 
@@ -396,6 +863,107 @@ class CollectLogGateway():
             return {'error': str(e)}
         
 
+    def search_logs(self, query, zip_name=None, regex=False, ignore_case=False, context=0, max_results=1000,
+                    use_index=True):
+        """バンドル内（zip_name 未指定時は全バンドル）のログを検索し、結果を1件ずつ yield する
+
+        ファイル単位でプロセスプールへ投入し、完了したファイルから順に
+        {"type": "match", ...} を返す。最後に {"type": "summary", ...} を返す。
+        COLLECT_SEARCH_TIMEOUT を超えた時点で残りのファイルを取り消し、summary の timed_out を True にする。
+        """
+        pattern, flags = col_search.compile_query(query, regex, ignore_case)
+        context = max(0, min(int(context or 0), col_search.MAX_CONTEXT))
+        started = time.monotonic()
+        deadline = time.time() + col_search.SEARCH_TIMEOUT
+        bundles = [zip_name] if zip_name else sorted(self.get_ziplist(), reverse=True)
+
+        targets = []
+        skipped = 0
+        for bundle in bundles:
+            bundle_folder = os.path.join(OUTPUT_LOGDIR, col_archive.bundle_stem(bundle))
+            entries = self._walk_log_folder(bundle_folder)
+            # リテラル検索のみ trigram インデックスで候補ファイルを絞り込む
+            if use_index and not regex:
+                entries, pruned = col_search.prune(bundle_folder, entries, query)
+                skipped += pruned
+            targets.extend((bundle, path, relpath) for path, relpath in entries)
+
+        pool = col_search.get_pool()
+        pending = {
+            pool.submit(col_search.search_file, path, pattern, flags, context, max_results, deadline): (bundle, relpath)
+            for bundle, path, relpath in targets
+        }
+        total = 0
+        truncated = False
+        timed_out = False
+        stuck = False
+        try:
+            while pending and not truncated and not timed_out:
+                # 各ワーカーは deadline で自ら打ち切る。猶予を過ぎても返らない場合はプロセスごと止める
+                remaining = deadline + col_search.TERMINATE_GRACE - time.time()
+                if remaining <= 0:
+                    timed_out = stuck = True
+                    break
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    bundle, relpath = pending.pop(future)
+                    try:
+                        matches, file_truncated = future.result()
+                    except col_search.SearchTimeout as e:
+                        timed_out = True
+                        yield {"type": "error", "bundle": bundle, "file": relpath, "error": str(e)}
+                        break
+                    except Exception as e:
+                        yield {"type": "error", "bundle": bundle, "file": relpath, "error": str(e)}
+                        continue
+                    for match in matches:
+                        if total >= max_results:
+                            truncated = True
+                            break
+                        total += 1
+                        yield dict(match, type="match", bundle=bundle, file=relpath)
+                    truncated = truncated or (file_truncated and total >= max_results)
+                    if truncated:
+                        break
+        finally:
+            # 上限到達・時間切れ・クライアント切断時は未着手のファイルを取り消す
+            for future in pending:
+                future.cancel()
+            if stuck:
+                print(f"[collectlog][warn] search workers did not stop after {col_search.SEARCH_TIMEOUT}s, terminating")
+                col_search.reset_pool()
+
+        yield {
+            "type": "summary",
+            "matches": total,
+            "files_searched": len(targets) - len(pending),
+            "files_skipped": skipped,
+            "truncated": truncated,
+            "timed_out": timed_out,
+            "elapsed_ms": int((time.monotonic() - started) * 1000),
+        }
+
+    def build_search_index(self, zip_name):
+        """バンドルの trigram インデックスを作成（以降のリテラル検索でファイルを絞り込む）"""
+        if zip_name not in self.get_ziplist():
+            return {'error': 'Bundle not found'}
+        bundle_folder = os.path.join(OUTPUT_LOGDIR, col_archive.bundle_stem(zip_name))
+        if not os.path.isdir(bundle_folder):
+            return {'error': 'Bundle not found'}
+        return col_search.build_index(bundle_folder, self._walk_log_folder(bundle_folder))
+
+    def remove_bundle(self, zip_name):
+        """作成済みバンドルを削除（収集ジョブが所有を失った場合に使う）"""
+        if zip_name not in self.get_ziplist():
+            return False
+        try:
+            os.remove(os.path.join(OUTPUT_ZIPDIR, zip_name))
+        except OSError as e:
+            print(f"[collectlog][warn] bundle remove failed: {zip_name} ({e})")
+            return False
+        print(f"[collectlog] bundle removed: {zip_name}")
+        return True
+
     # zipファイルのダウンロード
     def download_zip(self, zip_name):
         zip_path = os.path.join(OUTPUT_ZIPDIR, zip_name)
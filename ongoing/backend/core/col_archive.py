@@ -0,0 +1,376 @@
+import os
+import zlib
+import tarfile
+import zipfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Optional: tar.zst / tar.lz4 バンドル用（未インストール時は zip / store のみ利用可能）
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+# バンドル形式 -> 拡張子
+ARCHIVE_EXTENSIONS = {
+    "zip": ".zip",
+    "store": ".zip",
+    "tar.zst": ".tar.zst",
+    "tar.lz4": ".tar.lz4",
+}
+
+MEDIA_TYPES = {
+    ".zip": "application/zip",
+    ".tar.zst": "application/zstd",
+    ".tar.lz4": "application/x-lz4",
+}
+
+DEFAULT_FORMAT = os.getenv("COLLECT_ARCHIVE_FORMAT", "zip")
+# 未指定時は各形式の既定レベル（deflate=6, zstd=3, lz4=0）
+DEFAULT_LEVEL = os.getenv("COLLECT_COMPRESS_LEVEL")
+# このサイズ以上のメンバーはチャンク分割して複数コアで並列圧縮する
+PARALLEL_MIN_BYTES = int(os.getenv("COLLECT_PARALLEL_COMPRESS_MIN_MB", "64")) * 1024 * 1024
+CHUNK_BYTES = int(os.getenv("COLLECT_COMPRESS_CHUNK_MB", "4")) * 1024 * 1024
+COMPRESS_WORKERS = int(os.getenv("COLLECT_COMPRESS_WORKERS", str(os.cpu_count() or 2)))
+
+# 形式ごとの圧縮レベルの範囲（store は圧縮しないためレベルを使わない）
+COMPRESS_LEVEL_RANGES = {
+    "zip": (0, 9),
+    "tar.zst": (1, 22),
+    "tar.lz4": (0, 16),
+}
+
+# 大きなメンバーの並列 deflate は zipfile の非公開属性を使う（動作確認は Dockerfile.k8s で固定している
+# Python 3.11 系）。属性が揃っていない版では通常の zf.write にフォールバックする
+_ZIPFILE_INTERNALS = ("_writecheck", "_didModify", "start_dir", "NameToInfo", "filelist", "fp")
+
+
+class ArchiveError(Exception):
+    """バンドルへ追加できなかったファイルがある（不完全なバンドルは公開しない）"""
+
+
+def available_formats():
+    """現在の環境で利用可能なバンドル形式"""
+    formats = ["zip", "store"]
+    if zstandard is not None:
+        formats.append("tar.zst")
+    if lz4_frame is not None:
+        formats.append("tar.lz4")
+    return formats
+
+
+def bundle_stem(bundle_name):
+    """バンドル名から拡張子を除いたフォルダ名（loghoi_YYYYMMDD_HHMMSS）を返す"""
+    for ext in sorted(set(ARCHIVE_EXTENSIONS.values()), key=len, reverse=True):
+        if bundle_name.endswith(ext):
+            return bundle_name[:-len(ext)]
+    return os.path.splitext(bundle_name)[0]
+
+
+def is_bundle(filename):
+    return any(filename.endswith(ext) for ext in set(ARCHIVE_EXTENSIONS.values()))
+
+
+def media_type(bundle_name):
+    for ext, mtype in MEDIA_TYPES.items():
+        if bundle_name.endswith(ext):
+            return mtype
+    return "application/octet-stream"
+
+
+def validate_level(archive_format=None, compress_level=None):
+    """形式に対して圧縮レベルが範囲内か検証し、使用するレベルを返す（範囲外は ValueError）"""
+    fmt = archive_format or DEFAULT_FORMAT
+    level = compress_level if compress_level is not None else DEFAULT_LEVEL
+    if level is None:
+        return None
+    try:
+        level = int(level)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid compress_level: {level}")
+    level_range = COMPRESS_LEVEL_RANGES.get(fmt)
+    if level_range is None:
+        return level
+    low, high = level_range
+    if not low <= level <= high:
+        raise ValueError(f"compress_level {level} is out of range for {fmt} ({low}-{high})")
+    return level
+
+
+def open_archive(base_path, archive_format=None, compress_level=None):
+    """形式に応じたストリーミングアーカイバを生成（base_path は拡張子なし）"""
+    fmt = archive_format or DEFAULT_FORMAT
+    if fmt not in ARCHIVE_EXTENSIONS:
+        raise ValueError(f"unsupported archive format: {fmt}")
+    if fmt not in available_formats():
+        raise ValueError(f"archive format {fmt} is not available (missing optional dependency)")
+    level = validate_level(fmt, compress_level)
+    path = base_path + ARCHIVE_EXTENSIONS[fmt]
+    if fmt == "zip":
+        return StreamingZipArchive(path, zipfile.ZIP_DEFLATED, 6 if level is None else level)
+    if fmt == "store":
+        return StreamingZipArchive(path, zipfile.ZIP_STORED)
+    if fmt == "tar.zst":
+        return StreamingTarArchive(path, "zstd", 3 if level is None else level)
+    return StreamingTarArchive(path, "lz4", 0 if level is None else level)
+
+
+class _OrderedParallelCompressor():
+    """チャンクを複数スレッドで圧縮し、投入順に書き出す
+
+    zlib / zstd / lz4 はいずれも圧縮中にGILを解放するため、スレッドで複数コアを使える。
+    同時に保持するチャンク数はワーカー数の2倍までに制限する。
+    """
+
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, write):
+        self._write = write
+        self._pending = deque()
+        self._limit = max(2, COMPRESS_WORKERS * 2)
+
+    @classmethod
+    def _get_pool(cls):
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = ThreadPoolExecutor(max_workers=max(1, COMPRESS_WORKERS), thread_name_prefix="col-compress")
+            return cls._pool
+
+    def submit(self, fn, *args):
+        self._pending.append(self._get_pool().submit(fn, *args))
+        while len(self._pending) >= self._limit:
+            self._write(self._pending.popleft().result())
+
+    def drain(self):
+        while self._pending:
+            self._write(self._pending.popleft().result())
+
+
+class _StreamingArchive():
+    """収集中に完了したファイルを順次バンドルへ追加するアーカイバ（共通部）
+
+    ダウンロード/コマンド出力が1件完了するたびに add() で投入すると、
+    圧縮と書き込みはワーカースレッドで実行される（呼び出し側はブロックしない）。
+    アーカイブは同時書き込みできないため書き込みワーカーは1本に固定し、
+    大きなメンバーはチャンク単位で圧縮プールへ分散する。
+    書き込み中は ``<bundle>.part`` に出力し、close() 時に本来の名前へリネームする。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._part_path = f"{path}.part"
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="col-archive")
+        self._lock = threading.Lock()
+        self._closed = False
+        self._published = False
+        self.added = 0
+        self.errors = 0
+        self.failed = []
+
+    # 後方互換
+    @property
+    def zip_path(self):
+        return self.path
+
+    def add(self, filepath, arcname):
+        """ファイルをアーカイブ追加キューへ投入"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("archive already closed")
+            self._executor.submit(self._safe_write, filepath, arcname)
+
+    def _safe_write(self, filepath, arcname):
+        try:
+            self._write(filepath, arcname)
+            self.added += 1
+        except Exception as e:
+            self.errors += 1
+            self.failed.append(arcname)
+            print(f"[collectlog][error] archive add failed: {arcname} ({e})")
+
+    def close(self):
+        """投入済みファイルの書き込み完了を待ってアーカイブを確定し、パスを返す
+
+        追加に失敗したファイルがあればアーカイブを破棄して ArchiveError を送出する。
+        """
+        with self._lock:
+            if self._closed:
+                return self.path
+            self._closed = True
+        self._executor.shutdown(wait=True)
+        if self.errors:
+            self._discard()
+            shown = ", ".join(self.failed[:5]) + (" ..." if len(self.failed) > 5 else "")
+            raise ArchiveError(f"{self.errors} file(s) could not be added to {os.path.basename(self.path)}: {shown}")
+        self._finish()
+        os.replace(self._part_path, self.path)
+        self._published = True
+        return self.path
+
+    def abort(self):
+        """書きかけのアーカイブを破棄（close() で確定済みならそのバンドルも削除する）"""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self._published:
+            self._published = False
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            return
+        self._discard()
+
+    def _discard(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+        try:
+            os.remove(self._part_path)
+        except OSError:
+            pass
+
+    def _write(self, filepath, arcname):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+
+class StreamingZipArchive(_StreamingArchive):
+    """ZIP（deflate / store）形式のストリーミングアーカイバ"""
+
+    def __init__(self, zip_path, compression=zipfile.ZIP_DEFLATED, compresslevel=None):
+        super().__init__(zip_path)
+        self._compression = compression
+        self._compresslevel = compresslevel
+        self._zf = zipfile.ZipFile(self._part_path, 'w', compression, compresslevel=compresslevel)
+        self._parallel = compression == zipfile.ZIP_DEFLATED and hasattr(zipfile.ZipInfo, "FileHeader") \
+            and all(hasattr(self._zf, name) for name in _ZIPFILE_INTERNALS)
+
+    def _write(self, filepath, arcname):
+        if self._parallel and os.path.getsize(filepath) >= PARALLEL_MIN_BYTES:
+            self._write_parallel_deflate(filepath, arcname)
+        else:
+            self._zf.write(filepath, arcname=arcname)
+
+    def _write_parallel_deflate(self, filepath, arcname):
+        """大きなメンバーを pigz 方式（チャンク毎の raw deflate を連結）で並列圧縮して書き込む
+
+        各チャンクは Z_SYNC_FLUSH でバイト境界に揃え、最終チャンクのみ Z_FINISH で閉じる。
+        ローカルヘッダーは仮書きし、CRC/サイズ確定後に zipfile と同じ手順で書き戻す。
+        zipfile の非公開属性に依存するため、Python を更新する際は動作を確認すること（_ZIPFILE_INTERNALS 参照）。
+        """
+        zf = self._zf
+        level = 6 if self._compresslevel is None else self._compresslevel
+        zinfo = zipfile.ZipInfo.from_file(filepath, arcname)
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo._compresslevel = level
+        zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        fp = zf.fp
+        zinfo.header_offset = fp.tell()
+        zinfo.CRC = 0
+        zinfo.compress_size = 0
+        fp.write(zinfo.FileHeader(zip64))
+
+        state = {"compress_size": 0}
+
+        def _out(data):
+            fp.write(data)
+            state["compress_size"] += len(data)
+
+        def _deflate(chunk, last):
+            c = zlib.compressobj(level, zlib.DEFLATED, -15)
+            return c.compress(chunk) + c.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+        compressor = _OrderedParallelCompressor(_out)
+        crc = 0
+        file_size = 0
+        with open(filepath, 'rb') as src:
+            chunk = src.read(CHUNK_BYTES)
+            while chunk:
+                following = src.read(CHUNK_BYTES)
+                crc = zlib.crc32(chunk, crc)
+                file_size += len(chunk)
+                compressor.submit(_deflate, chunk, not following)
+                chunk = following
+        compressor.drain()
+        if file_size == 0:
+            _out(zlib.compressobj(level, zlib.DEFLATED, -15).flush())
+
+        zinfo.CRC = crc
+        zinfo.file_size = file_size
+        zinfo.compress_size = state["compress_size"]
+        if not zip64 and max(zinfo.file_size, zinfo.compress_size) > zipfile.ZIP64_LIMIT:
+            raise RuntimeError(f"{arcname} grew beyond the zip64 limit while archiving")
+
+        end = fp.tell()
+        fp.seek(zinfo.header_offset)
+        fp.write(zinfo.FileHeader(zip64))
+        fp.seek(end)
+        zf.start_dir = end
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+
+    def _finish(self):
+        self._zf.close()
+
+
+class _ParallelFrameWriter():
+    """tarストリームをチャンク単位の独立フレームに圧縮して書き出すファイルライクオブジェクト
+
+    zstd / lz4 はいずれも連結フレームを1つのストリームとして展開できるため、
+    チャンクを並列圧縮して順番に連結すれば `zstd -d` / `lz4 -d` でそのまま展開できる。
+    """
+
+    def __init__(self, fileobj, codec, level):
+        self._fileobj = fileobj
+        self._buffer = bytearray()
+        self._compressor = _OrderedParallelCompressor(fileobj.write)
+        if codec == "zstd":
+            self._compress = lambda data: zstandard.ZstdCompressor(level=level).compress(data)
+        else:
+            self._compress = lambda data: lz4_frame.compress(data, compression_level=level)
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= CHUNK_BYTES:
+            chunk = bytes(self._buffer[:CHUNK_BYTES])
+            del self._buffer[:CHUNK_BYTES]
+            self._compressor.submit(self._compress, chunk)
+        return len(data)
+
+    def close(self):
+        if self._buffer:
+            self._compressor.submit(self._compress, bytes(self._buffer))
+            self._buffer = bytearray()
+        self._compressor.drain()
+        self._fileobj.close()
+
+
+class StreamingTarArchive(_StreamingArchive):
+    """tar.zst / tar.lz4 形式のストリーミングアーカイバ"""
+
+    def __init__(self, path, codec, level):
+        super().__init__(path)
+        self._writer = _ParallelFrameWriter(open(self._part_path, 'wb'), codec, level)
+        self._tar = tarfile.open(fileobj=self._writer, mode='w|', format=tarfile.PAX_FORMAT)
+
+    def _write(self, filepath, arcname):
+        self._tar.add(filepath, arcname=arcname, recursive=False)
+
+    def _finish(self):
+        self._tar.close()
+        self._writer.close()
@@ -0,0 +1,109 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from itertools import accumulate
+
+
+# 何行ごとにバイトオフセットを記録するか
+INDEX_STEP = int(os.getenv("COLLECT_LINE_INDEX_STEP", "1000"))
+READ_CHUNK = 8 * 1024 * 1024
+INDEX_VERSION = 1
+# 読み込み済みインデックスのメモリキャッシュ件数
+_CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def index_path(log_path):
+    """インデックスの保存先（ログファイルと同じフォルダの隠しファイル）"""
+    dirname, basename = os.path.split(log_path)
+    return os.path.join(dirname, f".{basename}.lineidx")
+
+
+def _stat_key(log_path):
+    st = os.stat(log_path)
+    return st.st_size, st.st_mtime_ns
+
+
+def build_index(log_path, step=None):
+    """ログファイルを1回走査して疎な行オフセットインデックスを作成・保存する
+
+    offsets[k] は (k * step) 行目（0始まり）の先頭バイト位置。
+    行の区切りは b"\\n"（行数は末尾に改行のない最終行も1行として数える）。
+    """
+    step = step or INDEX_STEP
+    size, mtime_ns = _stat_key(log_path)
+    offsets = [0]
+    newlines = 0
+    base = 0
+    last_byte = b""
+    with open(log_path, "rb") as f:
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                break
+            parts = chunk.split(b"\n")
+            count = len(parts) - 1
+            # チャンク内 i 番目の改行の直後 = 全体で (newlines + i + 1) 行目の先頭
+            first = step - newlines % step - 1
+            if first < count:
+                ends = list(accumulate(map(len, parts)))
+                for i in range(first, count, step):
+                    offsets.append(base + ends[i] + i + 1)
+            newlines += count
+            base += len(chunk)
+            last_byte = chunk[-1:]
+
+    total_lines = newlines + (1 if base and last_byte != b"\n" else 0)
+    index = {
+        "version": INDEX_VERSION,
+        "step": step,
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "lines": total_lines,
+        "offsets": offsets,
+    }
+    sidecar = index_path(log_path)
+    tmp_path = f"{sidecar}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(tmp_path, sidecar)
+    except OSError as e:
+        # 書き込めないフォルダでもメモリキャッシュで継続する
+        print(f"[collectlog][warn] line index save failed: {sidecar} ({e})")
+    _remember(log_path, index)
+    return index
+
+
+def _remember(log_path, index):
+    with _cache_lock:
+        _cache[log_path] = index
+        _cache.move_to_end(log_path)
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _is_current(index, key):
+    return index.get("version") == INDEX_VERSION and (index.get("size"), index.get("mtime_ns")) == key
+
+
+def load_index(log_path):
+    """インデックスを返す（未作成・ファイル更新済みの場合はその場で作成）"""
+    key = _stat_key(log_path)
+    with _cache_lock:
+        index = _cache.get(log_path)
+        if index is not None and _is_current(index, key):
+            _cache.move_to_end(log_path)
+            return index
+    try:
+        with open(index_path(log_path), "r") as f:
+            index = json.load(f)
+        if _is_current(index, key):
+            _remember(log_path, index)
+            return index
+    except (OSError, ValueError):
+        pass
+    return build_index(log_path)
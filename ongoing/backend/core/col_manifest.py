@@ -0,0 +1,116 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+
+# 前回取得分との一致確認に使う先頭/末尾ウィンドウ
+HEAD_BYTES = 4096
+TAIL_BYTES = int(os.getenv("COLLECT_INCREMENTAL_TAIL_KB", "64")) * 1024
+COPY_BUFFER = 1024 * 1024
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _window_digests(f, size):
+    """先頭 size バイト分の先頭/末尾ウィンドウのハッシュ（ローカル/SFTPファイル共通）"""
+    f.seek(0)
+    head = f.read(min(HEAD_BYTES, size))
+    tail_offset = max(0, size - TAIL_BYTES)
+    f.seek(tail_offset)
+    tail = f.read(size - tail_offset)
+    return _digest(head), _digest(tail)
+
+
+def fingerprint(local_file):
+    """ローカルファイルのサイズと先頭/末尾ハッシュ"""
+    size = os.path.getsize(local_file)
+    with open(local_file, "rb") as f:
+        head, tail = _window_digests(f, size)
+    return {"size": size, "head": head, "tail": tail}
+
+
+class NodeManifest():
+    """CVMごとの前回収集状態（リモートパス -> サイズ / mtime / ハッシュ / ローカル保存先）
+
+    前回のバンドルフォルダに残っているファイルを基準に、リモート側で追記された
+    バイト範囲だけを取得するために使う。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._current = {}
+        try:
+            with open(path, "r") as f:
+                self._previous = json.load(f).get("files", {})
+        except (OSError, ValueError):
+            self._previous = {}
+
+    def get(self, remote_path):
+        """前回エントリを返す（基準ファイルが削除/変更されている場合は None）"""
+        entry = self._previous.get(remote_path)
+        if not entry:
+            return None
+        try:
+            if os.path.getsize(entry["local_path"]) != entry["size"]:
+                return None
+        except (OSError, KeyError):
+            return None
+        return entry
+
+    def record(self, remote_path, local_file, mtime):
+        """取得済みファイルの状態を記録（mtime は取得前に stat したリモートの値）"""
+        entry = fingerprint(local_file)
+        entry["mtime"] = mtime
+        entry["local_path"] = os.path.abspath(local_file)
+        with self._lock:
+            self._current[remote_path] = entry
+
+    def save(self):
+        """今回の結果で上書き保存（今回失敗したファイルは前回エントリを残す）"""
+        with self._lock:
+            files = dict(self._previous)
+            files.update(self._current)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"files": files}, f)
+        os.replace(tmp_path, self.path)
+
+
+def fetch_delta(sftp, remote_path, remote_stat, local_file, entry, callback=None):
+    """前回ファイルをコピーし、リモートで追記された範囲のみSFTPで取得する
+
+    戻り値は取得したバイト数。ローテーション/切り詰め/書き換えを検出した場合は
+    None を返し、呼び出し側で全量取得する。
+    callback(取得済みバイト, 追記分の合計) は paramiko の転送コールバックと同じ形式。
+    """
+    base_size = entry["size"]
+    if remote_stat.st_size < base_size:
+        return None
+
+    with sftp.open(remote_path, "rb") as rf:
+        # サイズと mtime が一致すれば変更なし、それ以外は先頭/末尾ウィンドウで前回分と同一か確認
+        unchanged = remote_stat.st_size == base_size and int(remote_stat.st_mtime) == entry.get("mtime")
+        if base_size and not unchanged:
+            if _window_digests(rf, base_size) != (entry["head"], entry["tail"]):
+                return None
+
+        shutil.copyfile(entry["local_path"], local_file)
+        transferred = 0
+        with open(local_file, "ab") as lf:
+            rf.seek(base_size)
+            rf.prefetch(remote_stat.st_size)
+            while True:
+                data = rf.read(COPY_BUFFER)
+                if not data:
+                    break
+                lf.write(data)
+                transferred += len(data)
+                if callback:
+                    callback(transferred, remote_stat.st_size - base_size)
+    return transferred
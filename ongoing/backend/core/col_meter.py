@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+from collections import deque
+
+
+# 転送量（バイト数/スループット/ETA）を進捗として通知する間隔（秒）
+REPORT_INTERVAL = float(os.getenv("COLLECT_PROGRESS_BYTES_INTERVAL", "1.0"))
+# 全体スループットを算出する直近区間（秒）
+RATE_WINDOW = 5.0
+# 結果に残す転送時間の長いファイル数
+SLOWEST_FILES = 5
+
+
+def _rate(nbytes, seconds):
+    return round(nbytes / seconds, 1) if seconds > 0 else 0.0
+
+
+class TransferMeter:
+    """1台のCVMのログファイル転送量を集計し、ファイル単位/全体のスループットと ETA を算出する
+
+    SFTP の転送コールバック等、複数のダウンロードスレッドから呼ばれる。
+    差分収集で前回ファイルから再利用したバイト（base）はスループットに含めない。
+    """
+
+    def __init__(self, total_files, on_report=None, interval=None):
+        self.total_files = total_files
+        self._on_report = on_report
+        self._interval = REPORT_INTERVAL if interval is None else interval
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._last_report = 0.0
+        self._active = {}
+        self._finished = []
+        self._samples = deque()
+
+    def start_file(self, name, size, base=0):
+        """転送開始（フォールバックで再取得する場合も呼び直してよい）"""
+        with self._lock:
+            self._active[name] = {"size": size or 0, "base": base, "done": base, "started": time.monotonic()}
+
+    def callback(self, name):
+        """paramiko の callback(転送済みバイト, 合計) 形式の関数を返す（値は base からの相対）"""
+        def _callback(transferred, total=None):
+            self.update(name, transferred)
+        return _callback
+
+    def update(self, name, transferred):
+        now = time.monotonic()
+        with self._lock:
+            item = self._active.get(name)
+            if item is None:
+                return
+            item["done"] = item["base"] + transferred
+            if now - self._last_report < self._interval:
+                return
+            self._last_report = now
+            snapshot = self._snapshot(now)
+        if self._on_report:
+            self._on_report(snapshot)
+
+    def finish_file(self, name, ok, size=None, wire_bytes=None):
+        """転送完了。size は取得後のローカルファイルサイズ、wire_bytes は回線上の転送量（gzip 時は圧縮後）"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._active.pop(name, None)
+            if item is None:
+                return
+            if ok and size is not None:
+                item["done"] = size
+            moved = max(0, item["done"] - item["base"])
+            seconds = now - item["started"]
+            self._finished.append({
+                "file": name,
+                "ok": ok,
+                "bytes": item["done"] if ok else 0,
+                "moved": moved,
+                "wire_bytes": moved if wire_bytes is None else wire_bytes,
+                "seconds": round(seconds, 3),
+                "rate_bps": _rate(moved, seconds),
+            })
+
+    def _moved_total(self):
+        return (sum(f["moved"] for f in self._finished)
+                + sum(max(0, a["done"] - a["base"]) for a in self._active.values()))
+
+    def _snapshot(self, now):
+        """ロック保持中に呼ぶ"""
+        moved = self._moved_total()
+        self._samples.append((now, moved))
+        while len(self._samples) > 2 and now - self._samples[0][0] > RATE_WINDOW:
+            self._samples.popleft()
+        first_t, first_moved = self._samples[0]
+        rate = _rate(moved - first_moved, now - first_t) if now > first_t else _rate(moved, now - self._started)
+
+        done = sum(f["bytes"] for f in self._finished) + sum(a["done"] for a in self._active.values())
+        known = sum(f["bytes"] for f in self._finished) + sum(a["size"] for a in self._active.values())
+        started = len(self._finished) + len(self._active)
+        # 未着手ファイルは着手済みファイルの平均サイズで見積もる
+        pending = max(0, self.total_files - started)
+        total = known + (int(known / started * pending) if started else 0)
+        remaining = max(0, total - done)
+        return {
+            "bytes_done": done,
+            "bytes_total": total,
+            "files_done": len(self._finished),
+            "files_total": self.total_files,
+            "rate_bps": rate,
+            "eta_seconds": round(remaining / rate, 1) if rate > 0 else None,
+            "elapsed": round(now - self._started, 1),
+            "active": [
+                {
+                    "file": name,
+                    "bytes": a["done"],
+                    "size": a["size"],
+                    "rate_bps": _rate(a["done"] - a["base"], now - a["started"]),
+                }
+                for name, a in self._active.items()
+            ],
+        }
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot(time.monotonic())
+
+    def summary(self, workers=None):
+        """収集結果（ジョブレコード）に残す集計値"""
+        with self._lock:
+            seconds = time.monotonic() - self._started
+            moved = sum(f["moved"] for f in self._finished)
+            slowest = sorted(self._finished, key=lambda f: f["seconds"], reverse=True)[:SLOWEST_FILES]
+            return {
+                "bytes": sum(f["bytes"] for f in self._finished),
+                "moved_bytes": moved,
+                "wire_bytes": sum(f["wire_bytes"] for f in self._finished),
+                "seconds": round(seconds, 3),
+                "rate_bps": _rate(moved, seconds),
+                "files": sum(1 for f in self._finished if f["ok"]),
+                "failed": sum(1 for f in self._finished if not f["ok"]),
+                "workers": workers,
+                "slowest": [
+                    {k: f[k] for k in ("file", "bytes", "seconds", "rate_bps", "ok")}
+                    for f in slowest
+                ],
+            }
@@ -0,0 +1,92 @@
+import os
+import mmap
+import threading
+from collections import OrderedDict
+
+import col_lineindex
+
+
+# 範囲指定なしで全文を返す上限。超える場合は先頭 AUTO_PAGE_BYTES のみ返す
+FULL_READ_MAX_BYTES = int(os.getenv("COLLECT_FULL_READ_MAX_MB", "8")) * 1024 * 1024
+AUTO_PAGE_BYTES = int(os.getenv("COLLECT_AUTO_PAGE_KB", "1024")) * 1024
+# プロセス内で保持する mmap ハンドル数
+MMAP_CACHE_SIZE = int(os.getenv("COLLECT_MMAP_CACHE_SIZE", "16"))
+
+_handles = OrderedDict()
+_handles_lock = threading.Lock()
+
+
+def _mapped(log_path):
+    """(mmap or None, size) を返す。サイズ/mtime が変わったファイルは再マップする
+
+    キャッシュから外れた mmap は明示的に close しない（読み込み中の memoryview が
+    参照を持つため、最後の参照が外れた時点で解放される）。
+    """
+    st = os.stat(log_path)
+    key = (st.st_size, st.st_mtime_ns)
+    with _handles_lock:
+        cached = _handles.get(log_path)
+        if cached is not None and cached[0] == key:
+            _handles.move_to_end(log_path)
+            return cached[1], st.st_size
+
+    mm = None
+    if st.st_size > 0:
+        with open(log_path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with _handles_lock:
+        _handles[log_path] = (key, mm)
+        _handles.move_to_end(log_path)
+        while len(_handles) > MMAP_CACHE_SIZE:
+            _handles.popitem(last=False)
+    return mm, st.st_size
+
+
+def _decode(mm, start, end):
+    """mmap の [start, end) をコピーせずに UTF-8 デコード（不正バイトは置換）"""
+    if mm is None or end <= start:
+        return ""
+    with memoryview(mm) as view, view[start:end] as part:
+        return str(part, "utf-8", "replace")
+
+
+def read_range(log_path, start, length):
+    """バイト範囲 [start, start+length) を (テキスト, 実際のバイト数) で返す"""
+    mm, size = _mapped(log_path)
+    start = min(max(0, start), size)
+    end = min(size, start + max(0, length))
+    return _decode(mm, start, end), end - start
+
+
+def read_lines(log_path, start_line, end_line):
+    """[start_line, end_line) の行を行オフセットインデックス + mmap で読み込む"""
+    mm, size = _mapped(log_path)
+    if mm is None or end_line <= start_line:
+        return []
+    index = col_lineindex.load_index(log_path)
+    step = index["step"]
+    offsets = index["offsets"]
+    block = min(start_line // step, len(offsets) - 1)
+
+    # インデックス位置から start_line まで改行を辿る
+    pos = offsets[block]
+    for _ in range(start_line - block * step):
+        nl = mm.find(b"\n", pos)
+        if nl < 0:
+            return []
+        pos = nl + 1
+
+    end = pos
+    for _ in range(end_line - start_line):
+        if end >= size:
+            break
+        nl = mm.find(b"\n", end)
+        end = size if nl < 0 else nl + 1
+
+    text = _decode(mm, pos, end)
+    if not text:
+        return []
+    lines = text.split("\n")
+    if text.endswith("\n"):
+        lines.pop()
+    return [line.rstrip("\r") for line in lines]
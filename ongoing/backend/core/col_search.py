@@ -0,0 +1,320 @@
+import os
+import re
+import json
+import mmap
+import time
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from re import _parser as _sre_parse
+except ImportError:  # Python 3.10 以前
+    import sre_parse as _sre_parse
+
+
+# 検索ワーカープロセス数
+SEARCH_WORKERS = int(os.getenv("COLLECT_SEARCH_WORKERS", str(os.cpu_count() or 2)))
+# 前後行の最大数
+MAX_CONTEXT = 5
+READ_CHUNK = 8 * 1024 * 1024
+# 1回の検索の制限時間（秒）。超えたファイルは打ち切り、応答しない検索プロセスは終了させる
+SEARCH_TIMEOUT = float(os.getenv("COLLECT_SEARCH_TIMEOUT", "30"))
+# 制限時間を過ぎても結果を返さない検索プロセスを終了させるまでの猶予（秒）
+TERMINATE_GRACE = 2
+# 検索語の最大文字数
+MAX_QUERY_LENGTH = int(os.getenv("COLLECT_SEARCH_MAX_QUERY", "256"))
+INDEX_FILENAME = ".search_trigram.json"
+INDEX_VERSION = 1
+
+_TOKEN_RE = re.compile(rb"\w{3,}")
+_WORD_BYTES = b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_"
+# チャンク境界をまたいで持ち越す単語の上限（改行も区切りも無い巨大な行でメモリを使い切らないため）
+MAX_CARRY = 64 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+_index_cache = {}
+_index_cache_lock = threading.Lock()
+
+
+class SearchTimeout(Exception):
+    """検索が制限時間を超えた"""
+
+
+def get_pool():
+    """検索用プロセスプール（スレッドを持つサーバープロセスからの fork を避けるため spawn）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, SEARCH_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def reset_pool():
+    """検索プロセスを実行中のタスクごと終了し、次回の get_pool で作り直す"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is None:
+        return
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        try:
+            process.terminate()
+        except Exception:
+            pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _subpatterns(value):
+    if isinstance(value, _sre_parse.SubPattern):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _subpatterns(item)
+
+
+def _check_complexity(parsed, in_repeat=False):
+    """バックトラックが指数的に増える形（量指定子の入れ子・後方参照）を ValueError にする"""
+    for op, av in parsed:
+        if op is _sre_parse.GROUPREF or op is _sre_parse.GROUPREF_EXISTS:
+            raise ValueError("regex too complex: backreferences are not allowed")
+        if op in (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT):
+            low, high, body = av
+            if in_repeat and low != high:
+                raise ValueError("regex too complex: nested quantifiers are not allowed")
+            _check_complexity(body, in_repeat or high > 1)
+            continue
+        for sub in _subpatterns(av):
+            _check_complexity(sub, in_repeat)
+
+
+def compile_query(query, regex=False, ignore_case=False):
+    """検索語をバイト列の正規表現に変換（不正・長すぎる・複雑すぎる正規表現は ValueError）"""
+    if not query:
+        raise ValueError("query is required")
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValueError(f"query too long (max {MAX_QUERY_LENGTH} characters)")
+    pattern = query.encode("utf-8")
+    if not regex:
+        pattern = re.escape(pattern)
+    flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+    try:
+        re.compile(pattern, flags)
+        if regex:
+            _check_complexity(_sre_parse.parse(pattern, flags))
+    except re.error as e:
+        raise ValueError(f"invalid regex: {e}")
+    return pattern, flags
+
+
+def _count_newlines(mm, start, end):
+    count = 0
+    while start < end:
+        stop = min(end, start + READ_CHUNK)
+        count += mm[start:stop].count(b"\n")
+        start = stop
+    return count
+
+
+def _line_text(mm, start, end):
+    return mm[start:end].decode("utf-8", errors="replace").rstrip("\r")
+
+
+def _on_deadline(signum, frame):
+    raise SearchTimeout("search timed out")
+
+
+def search_file(path, pattern, flags, context=0, limit=1000, deadline=None):
+    """1ファイルを mmap して検索し ([{line, text, before, after}], 打ち切り有無) を返す（プロセスプールで実行）
+
+    line は1始まりの行番号。1行に複数ヒットしても1件として返す。
+    deadline（time.time() の時刻）を過ぎると SearchTimeout を送出する。正規表現の照合中でも
+    SIGALRM で中断できるため、ワーカープロセスのメインスレッドで実行する場合のみタイマーを掛ける。
+    """
+    if deadline is None or threading.current_thread() is not threading.main_thread():
+        return _search_file(path, pattern, flags, context, limit)
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise SearchTimeout("search timed out")
+    previous = signal.signal(signal.SIGALRM, _on_deadline)
+    signal.setitimer(signal.ITIMER_REAL, remaining)
+    try:
+        return _search_file(path, pattern, flags, context, limit)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _search_file(path, pattern, flags, context, limit):
+    size = os.path.getsize(path)
+    if size == 0:
+        return [], False
+    rx = re.compile(pattern, flags)
+    matches = []
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        pos = 0
+        line_no = 0
+        counted = 0
+        while pos <= size:
+            m = rx.search(mm, pos)
+            if m is None:
+                break
+            hit = m.start()
+            del m
+            start = mm.rfind(b"\n", 0, hit) + 1
+            end = mm.find(b"\n", hit)
+            end = size if end < 0 else end
+            line_no += _count_newlines(mm, counted, start)
+            counted = start
+
+            before = []
+            cursor = start
+            for _ in range(context):
+                if cursor == 0:
+                    break
+                prev_start = mm.rfind(b"\n", 0, cursor - 1) + 1
+                before.insert(0, _line_text(mm, prev_start, cursor - 1))
+                cursor = prev_start
+            after = []
+            cursor = end
+            for _ in range(context):
+                if cursor >= size - 1:
+                    break
+                next_end = mm.find(b"\n", cursor + 1)
+                next_end = size if next_end < 0 else next_end
+                after.append(_line_text(mm, cursor + 1, next_end))
+                cursor = next_end
+
+            matches.append({
+                "line": line_no + 1,
+                "text": _line_text(mm, start, end),
+                "before": before,
+                "after": after,
+            })
+            if len(matches) >= limit:
+                return matches, True
+            pos = end + 1
+    finally:
+        mm.close()
+    return matches, False
+
+
+def file_trigrams(path):
+    """ファイル内の単語（\\w{3,}、小文字化）から trigram 集合を作成（プロセスプールで実行）"""
+    grams = set()
+    carry = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                data = carry
+            else:
+                # 単語がチャンク境界で切れないよう、末尾の単語は次回に回す
+                # 上限を超える単語は今回処理し、末尾2バイトを重ねて持ち越す（境界をまたぐ trigram を失わない）
+                data = carry + chunk
+                cut = len(data.rstrip(_WORD_BYTES))
+                if len(data) - cut > MAX_CARRY:
+                    carry = data[-2:]
+                else:
+                    data, carry = data[:cut], data[cut:]
+            for token in set(_TOKEN_RE.findall(data.lower())):
+                for i in range(len(token) - 2):
+                    grams.add(token[i:i + 3])
+            if not chunk:
+                break
+    return sorted(g.decode("ascii") for g in grams)
+
+
+def query_trigrams(query):
+    """リテラル検索語に必ず含まれる trigram（単語部分のみ）"""
+    grams = set()
+    for token in _TOKEN_RE.findall(query.encode("utf-8").lower()):
+        for i in range(len(token) - 2):
+            grams.add(token[i:i + 3].decode("ascii"))
+    return grams
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def build_index(bundle_folder, entries):
+    """バンドル単位の trigram 転置インデックス（trigram -> ファイルのビットマスク）を作成・保存する
+
+    entries は (フルパス, 相対パス) のリスト。
+    """
+    files = []
+    grams = {}
+    pool = get_pool()
+    futures = [(path, relpath, _file_key(path), pool.submit(file_trigrams, path)) for path, relpath in entries]
+    for bit, (path, relpath, (size, mtime_ns), future) in enumerate(futures):
+        files.append({"path": relpath, "size": size, "mtime_ns": mtime_ns})
+        for gram in future.result():
+            grams[gram] = grams.get(gram, 0) | (1 << bit)
+    index = {"version": INDEX_VERSION, "files": files, "grams": grams}
+    index_file = os.path.join(bundle_folder, INDEX_FILENAME)
+    tmp_path = f"{index_file}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    os.replace(tmp_path, index_file)
+    return {"files": len(files), "trigrams": len(grams), "index_bytes": os.path.getsize(index_file)}
+
+
+def _load_index(bundle_folder):
+    index_file = os.path.join(bundle_folder, INDEX_FILENAME)
+    try:
+        mtime_ns = os.stat(index_file).st_mtime_ns
+    except OSError:
+        return None
+    with _index_cache_lock:
+        cached = _index_cache.get(index_file)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+    try:
+        with open(index_file, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != INDEX_VERSION:
+        return None
+    with _index_cache_lock:
+        _index_cache[index_file] = (mtime_ns, index)
+    return index
+
+
+def prune(bundle_folder, entries, query):
+    """インデックスで一致し得ないファイルを除外し (検索対象, 除外数) を返す
+
+    インデックスが無い、または作成後に更新されたファイルは常に検索対象とする。
+    """
+    required = query_trigrams(query)
+    index = _load_index(bundle_folder) if required else None
+    if index is None:
+        return entries, 0
+
+    mask = -1
+    grams = index["grams"]
+    for gram in required:
+        mask &= grams.get(gram, 0)
+    indexed = {}
+    for bit, item in enumerate(index["files"]):
+        indexed[item["path"]] = (bit, item["size"], item["mtime_ns"])
+
+    targets = []
+    for path, relpath in entries:
+        info = indexed.get(relpath)
+        try:
+            fresh = info is not None and (info[1], info[2]) == _file_key(path)
+        except OSError:
+            fresh = False
+        if not fresh or mask & (1 << info[0]):
+            targets.append((path, relpath))
+    return targets, len(entries) - len(targets)
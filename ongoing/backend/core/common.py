@@ -5,8 +5,11 @@ from zoneinfo import ZoneInfo  # 3.9
 import re
 import json
 import os
+import time
+import threading
 import paramiko
 import ela
+import ssh_pool
 
 
 es = ela.ElasticGateway()
@@ -78,14 +81,97 @@ def change_timestamp(timestamp):
 
 
 # from _rt:get_session_rt, get_cvmlist
-def connect_ssh(hostname):
+def connect_ssh(hostname, channels=1):
+    """CVMへのSSH接続をプールから借りる（失敗時 False）
+
+    戻り値は SSHClient 互換のリース。close() でトランスポートをプールへ返却する
+    （TCP/SSHセッションは維持され、次回はハンドシェイクなしで再利用される）。
+    channels は同時に開く予定のチャネル数。
+    """
+    lease = _ssh_pool.acquire(hostname, channels=channels)
+    return lease if lease else False
+
+
+# 読み込み済み秘密鍵（パス -> ((mtime_ns, size), PKey)）と鍵読み込み/署名/接続の計測値
+_key_cache = {}
+_key_lock = threading.Lock()
+_auth_stats = {
+    "key_type": None,
+    "key_bits": None,
+    "key_loads": 0,
+    "key_load_seconds": 0.0,
+    "signs": 0,
+    "sign_seconds": 0.0,
+    "connects": 0,
+    "connect_seconds": 0.0,
+}
+
+
+def _add_stat(name, seconds):
+    with _key_lock:
+        _auth_stats[name + "s"] += 1
+        _auth_stats[name + "_seconds"] += seconds
+
+
+def _instrument_sign(pkey):
+    """認証時の署名処理（sign_ssh_data）の回数と所要時間を計測する"""
+    sign = pkey.sign_ssh_data
+
+    def _timed_sign(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return sign(*args, **kwargs)
+        finally:
+            _add_stat("sign", time.perf_counter() - started)
+
+    pkey.sign_ssh_data = _timed_sign
+    return pkey
+
+
+def load_private_key(key_file):
+    """秘密鍵を読み込む（RSA / ECDSA / Ed25519 を自動判別）
+
+    パース結果はキャッシュし、ファイルの mtime / サイズが変わった場合のみ読み直す
+    （k8s Secret のローテーションに追従）。ファイルが無い場合は FileNotFoundError。
+    """
+    st = os.stat(key_file)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _key_lock:
+        cached = _key_cache.get(key_file)
+        if cached and cached[0] == stamp:
+            return cached[1]
+
+    started = time.perf_counter()
+    pkey = _instrument_sign(paramiko.PKey.from_path(key_file))
+    elapsed = time.perf_counter() - started
+    with _key_lock:
+        _key_cache[key_file] = (stamp, pkey)
+        _auth_stats["key_type"] = pkey.get_name()
+        _auth_stats["key_bits"] = pkey.get_bits()
+    _add_stat("key_load", elapsed)
+    print(f"[ssh] private key loaded: {key_file} type={pkey.get_name()} bits={pkey.get_bits()} ({elapsed * 1000:.1f}ms)")
+    return pkey
+
+
+def ssh_auth_stats():
+    """鍵読み込み・署名・接続（ハンドシェイク+認証）の回数と平均所要時間"""
+    with _key_lock:
+        stats = dict(_auth_stats)
+    for name in ("key_load", "sign", "connect"):
+        count = stats[name + "s"]
+        stats[name + "_avg_ms"] = round(stats[name + "_seconds"] / count * 1000, 2) if count else None
+        stats[name + "_seconds"] = round(stats[name + "_seconds"], 4)
+    return stats
+
+
+def _open_ssh_client(hostname):
     """SSH接続を確立（詳細なエラーメッセージ付き）"""
     username = "nutanix"
     # 環境変数でSSH鍵のパスを指定
     key_file = os.getenv("SSH_KEY_PATH", "/app/config/.ssh/loghoi-key")
     
     try:
-        rsa_key = paramiko.RSAKey.from_private_key_file(key_file)
+        private_key = load_private_key(key_file)
     except FileNotFoundError:
         error_msg = (
             f"❌ SSH秘密鍵が見つかりません: {key_file}\n"
@@ -103,8 +189,11 @@ def connect_ssh(hostname):
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     try:
         # タイムアウトを10秒に設定
-        client.connect(hostname=hostname, username=username, pkey=rsa_key, timeout=10)
-        print(f">>>>>>>> SSH connecting success to {hostname} <<<<<<<<<")
+        started = time.perf_counter()
+        client.connect(hostname=hostname, username=username, pkey=private_key, timeout=10)
+        elapsed = time.perf_counter() - started
+        _add_stat("connect", elapsed)
+        print(f">>>>>>>> SSH connecting success to {hostname} ({elapsed * 1000:.0f}ms) <<<<<<<<<")
 
     except paramiko.ssh_exception.AuthenticationException as e:
         error_msg = (
@@ -129,6 +218,17 @@ def connect_ssh(hostname):
     return client
 
 
+_ssh_pool = ssh_pool.default_pool(_open_ssh_client)
+
+
+def ssh_pool_stats():
+    return dict(_ssh_pool.stats(), auth=ssh_auth_stats())
+
+
+def close_ssh_pool():
+    _ssh_pool.close_all()
+
+
 # Get Prism Leader 
 def get_prism_leader(ssh):
     stdin, stdout, stderr = ssh.exec_command(
@@ -0,0 +1,359 @@
+import os
+import time
+import threading
+
+import paramiko
+
+
+# 1トランスポートあたりの同時チャネル数上限（sshd MaxSessions=10 未満に抑える）
+MAX_CHANNELS = int(os.getenv("SSH_POOL_MAX_CHANNELS", "8"))
+# 1CVMあたりのトランスポート数上限（超える場合は空きを待つ）
+MAX_TRANSPORTS = int(os.getenv("SSH_POOL_MAX_TRANSPORTS", "4"))
+# 未使用トランスポートを切断するまでの時間（秒）
+IDLE_TIMEOUT = int(os.getenv("SSH_POOL_IDLE_TIMEOUT", "300"))
+# SSH keepalive 間隔（秒）
+KEEPALIVE = int(os.getenv("SSH_POOL_KEEPALIVE", "30"))
+# この時間以上使われていないトランスポートは貸し出し前にチャネルを開いて生存確認する（秒）
+HEALTH_CHECK_AFTER = int(os.getenv("SSH_POOL_HEALTH_CHECK_AFTER", "30"))
+HEALTH_CHECK_TIMEOUT = 5
+# 空きトランスポート待ちの上限（秒）
+ACQUIRE_TIMEOUT = int(os.getenv("SSH_POOL_ACQUIRE_TIMEOUT", "30"))
+# リースの予約チャネル数を使い切っている時に、チャネルが閉じるのを待つ上限（秒）
+CHANNEL_WAIT_TIMEOUT = int(os.getenv("SSH_POOL_CHANNEL_WAIT_TIMEOUT", "30"))
+CHANNEL_POLL_INTERVAL = 0.05
+REAP_INTERVAL = 30
+
+
+class _PooledTransport:
+    """認証済み SSHClient 1本と、その上で貸し出し中のチャネル数"""
+
+    def __init__(self, hostname, client):
+        self.hostname = hostname
+        self.client = client
+        self.transport = client.get_transport()
+        self.reserved = 0
+        self.leases = 0
+        # 生存確認に失敗したが貸し出し中のリースがある（新規貸し出しはせず、返却されたら切断する）
+        self.draining = False
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+    def is_active(self):
+        return self.transport is not None and self.transport.is_active() and self.transport.is_authenticated()
+
+    def check(self):
+        """チャネルを1本開閉して応答を確認する（keepalive だけでは半死状態の TCP を検出できないため）"""
+        try:
+            channel = self.transport.open_session(timeout=HEALTH_CHECK_TIMEOUT)
+            channel.close()
+            return True
+        except paramiko.ChannelException:
+            # サーバー側でチャネル数上限等により拒否された（トランスポート自体は応答している）
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+class SSHLease:
+    """プールのトランスポートを借りる SSHClient 互換のハンドル
+
+    exec_command / open_sftp / open_session で開いたチャネルは close() 時にまとめて閉じ、
+    トランスポートはプールへ返却する（TCP/SSH セッションは切断しない）。
+    開いているチャネルが予約数（channels）に達している間は、どれかが閉じるまで
+    CHANNEL_WAIT_TIMEOUT 秒まで待ち、超えたら SSHException を送出する。
+    get_transport() で直接開いたチャネルは予約数に数えられないため、呼び出し側で閉じること。
+    """
+
+    def __init__(self, pool, pooled, channels):
+        self._pool = pool
+        self._pooled = pooled
+        self._channels = channels
+        # (close() で閉じる対象, 予約数に数えるチャネル)
+        self._opened = []
+        self._opening = 0
+        self._cond = threading.Condition()
+        self._released = False
+
+    @property
+    def hostname(self):
+        return self._pooled.hostname
+
+    def get_transport(self):
+        return self._pooled.transport
+
+    def exec_command(self, command, *args, **kwargs):
+        return self._open(lambda: self._pooled.client.exec_command(command, *args, **kwargs),
+                          lambda streams: streams[1].channel)
+
+    def open_sftp(self):
+        return self._open(self._pooled.client.open_sftp, lambda sftp: sftp.get_channel())
+
+    def open_session(self, timeout=None):
+        return self._open(lambda: self._pooled.transport.open_session(timeout=timeout), lambda channel: channel)
+
+    def _open(self, opener, channel_of):
+        """予約数の範囲でチャネルを開き、close() の対象として記録する"""
+        deadline = time.monotonic() + CHANNEL_WAIT_TIMEOUT
+        with self._cond:
+            while self._live() + self._opening >= self._channels:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise paramiko.SSHException(
+                        f"channel reservation exceeded: {self.hostname} (channels={self._channels})"
+                    )
+                # リモート側からのチャネルクローズは通知されないため、短い間隔で確認する
+                self._cond.wait(min(remaining, CHANNEL_POLL_INTERVAL))
+            self._opening += 1
+        try:
+            resource = opener()
+        finally:
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify_all()
+        with self._cond:
+            self._opened.append((resource, channel_of(resource)))
+        return resource
+
+    def _live(self):
+        """開いているチャネル数（閉じたものは記録から外す。ロック保持中に呼ぶ）"""
+        self._opened = [(resource, channel) for resource, channel in self._opened if not channel.closed]
+        return len(self._opened)
+
+    def close(self):
+        with self._cond:
+            if self._released:
+                return
+            self._released = True
+            opened, self._opened = self._opened, []
+            self._cond.notify_all()
+        for resource, _ in opened:
+            try:
+                resource.close()
+            except Exception:
+                pass
+        self._pool.release(self._pooled, self._channels)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        # close() されずに破棄されたリースも返却する
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class SSHTransportPool:
+    """CVM ごとに認証済み SSH トランスポートを保持し、チャネル単位で貸し出すプール
+
+    connector(hostname) は接続・認証済みの paramiko.SSHClient（失敗時 False/None）を返す関数。
+    """
+
+    def __init__(self, connector, max_channels=None, max_transports=None, idle_timeout=None):
+        self._connector = connector
+        self.max_channels = max_channels or MAX_CHANNELS
+        self.max_transports = max_transports or MAX_TRANSPORTS
+        self.idle_timeout = IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self._hosts = {}
+        self._connecting = {}
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._closed = False
+        self._stats = {"created": 0, "reused": 0, "evicted": 0, "unhealthy": 0}
+
+    def acquire(self, hostname, channels=1, timeout=None):
+        """hostname のトランスポートを借りて SSHLease を返す（接続失敗時 None）
+
+        channels は同時に開く予定のチャネル数。空きのあるトランスポートが無ければ
+        上限まで新規接続し、上限に達している場合は返却を待つ。
+        """
+        channels = max(1, min(int(channels), self.max_channels))
+        deadline = time.monotonic() + (ACQUIRE_TIMEOUT if timeout is None else timeout)
+        self._ensure_reaper()
+        while True:
+            with self._cond:
+                pooled = self._pick(hostname, channels)
+                if pooled is None:
+                    # 縮退中（draining）のものは数えず、代わりの接続を張れるようにする
+                    open_count = (sum(1 for p in self._hosts.get(hostname, []) if not p.draining)
+                                  + self._connecting.get(hostname, 0))
+                    if open_count < self.max_transports:
+                        self._connecting[hostname] = self._connecting.get(hostname, 0) + 1
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            print(f"[sshpool][warn] no free transport: {hostname} (max={self.max_transports})")
+                            return None
+                        self._cond.wait(min(remaining, 1.0))
+                        continue
+                else:
+                    # last_used は貸し出し/返却時にしか更新されないため、貸し出し中のものは確認しない
+                    # （長時間のリースが使用中でも idle に見える）
+                    needs_check = pooled.leases == 0 and time.monotonic() - pooled.last_used >= HEALTH_CHECK_AFTER
+                    self._reserve(pooled, channels)
+
+            if pooled is not None:
+                # 一定時間使われていなかったものは貸し出し前に生存確認する
+                if not needs_check or pooled.check():
+                    with self._cond:
+                        self._stats["reused"] += 1
+                    return SSHLease(self, pooled, channels)
+                with self._cond:
+                    self._stats["unhealthy"] += 1
+                    self._retire(pooled, channels)
+                continue
+
+            # ロック外で接続（ハンドシェイク中も他ホストの貸し出しを止めない）
+            try:
+                client = self._connector(hostname)
+            except Exception as e:
+                print(f"[sshpool][error] connect failed: {hostname} ({e})")
+                client = None
+            with self._cond:
+                self._connecting[hostname] -= 1
+                if not client:
+                    self._cond.notify_all()
+                    return None
+                pooled = _PooledTransport(hostname, client)
+                if KEEPALIVE > 0:
+                    pooled.transport.set_keepalive(KEEPALIVE)
+                self._hosts.setdefault(hostname, []).append(pooled)
+                self._reserve(pooled, channels)
+                self._stats["created"] += 1
+            return SSHLease(self, pooled, channels)
+
+    def _pick(self, hostname, channels):
+        """空きチャネルが最も多い生存トランスポートを選ぶ（ロック保持中に呼ぶ）"""
+        best = None
+        for pooled in list(self._hosts.get(hostname, [])):
+            if not pooled.is_active():
+                self._discard(pooled)
+                continue
+            if pooled.draining:
+                continue
+            if pooled.reserved + channels <= self.max_channels:
+                if best is None or pooled.reserved < best.reserved:
+                    best = pooled
+        return best
+
+    def _reserve(self, pooled, channels):
+        pooled.reserved += channels
+        pooled.leases += 1
+        pooled.last_used = time.monotonic()
+
+    def release(self, pooled, channels):
+        with self._cond:
+            pooled.reserved = max(0, pooled.reserved - channels)
+            pooled.leases = max(0, pooled.leases - 1)
+            pooled.last_used = time.monotonic()
+            if self._closed or not pooled.is_active() or (pooled.draining and pooled.leases == 0):
+                self._discard(pooled)
+            self._cond.notify_all()
+
+    def _retire(self, pooled, channels):
+        """生存確認に失敗したトランスポートの予約を戻し、新規貸し出しを止める（ロック保持中に呼ぶ）
+
+        確認中に他のリースが借りていた場合は、そのチャネルを切らないよう返却まで待ってから切断する。
+        """
+        pooled.reserved = max(0, pooled.reserved - channels)
+        pooled.leases = max(0, pooled.leases - 1)
+        if pooled.leases == 0:
+            print(f"[sshpool][warn] unhealthy transport dropped: {pooled.hostname}")
+            self._discard(pooled)
+        else:
+            print(f"[sshpool][warn] unhealthy transport draining: {pooled.hostname} (leases={pooled.leases})")
+            pooled.draining = True
+        self._cond.notify_all()
+
+    def _discard(self, pooled):
+        """プールから外して切断（ロック保持中に呼ぶ。貸し出し中のチャネルも切れる）"""
+        entries = self._hosts.get(pooled.hostname, [])
+        if pooled in entries:
+            entries.remove(pooled)
+            if not entries:
+                self._hosts.pop(pooled.hostname, None)
+        pooled.close()
+
+    def evict_idle(self):
+        """貸し出しが無く IDLE_TIMEOUT を超えたトランスポートを切断し、切断数を返す"""
+        now = time.monotonic()
+        evicted = 0
+        with self._cond:
+            for entries in list(self._hosts.values()):
+                for pooled in list(entries):
+                    if pooled.leases == 0 and (now - pooled.last_used > self.idle_timeout or not pooled.is_active()):
+                        self._discard(pooled)
+                        evicted += 1
+            self._stats["evicted"] += evicted
+        if evicted:
+            print(f"[sshpool] evicted idle transports={evicted}")
+        return evicted
+
+    def _ensure_reaper(self):
+        with self._cond:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="ssh-pool-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while not self._closed:
+            time.sleep(REAP_INTERVAL)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                print(f"[sshpool][error] reaper: {e}")
+
+    def close_all(self):
+        """全トランスポートを切断（アプリ停止時）"""
+        with self._cond:
+            self._closed = True
+            for entries in list(self._hosts.values()):
+                for pooled in list(entries):
+                    self._discard(pooled)
+            self._cond.notify_all()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            return {
+                "hosts": {
+                    hostname: [
+                        {
+                            "leases": p.leases,
+                            "channels": p.reserved,
+                            "draining": p.draining,
+                            "age": round(now - p.created, 1),
+                            "idle": round(now - p.last_used, 1),
+                        }
+                        for p in entries
+                    ]
+                    for hostname, entries in self._hosts.items()
+                },
+                "max_channels": self.max_channels,
+                "max_transports": self.max_transports,
+                **self._stats,
+            }
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool(connector):
+    """プロセス共通のプールを返す（common が core.common としても読み込まれるため、ここで1つに保持する）"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = SSHTransportPool(connector)
+        return _default_pool
@@ -1,5 +1,7 @@
 import sys
 import os
+import json
+import shlex
 from typing import Dict, Any, List
 import asyncio
 import threading
@@ -21,6 +23,8 @@ import socketio
 
 # 接続管理システムのインポート
 from fastapi_app.connection_manager import connection_manager
+from fastapi_app.tail_filter import LineFilter
+from fastapi_app.tail_stream import MAX_SOURCES
 
 # Elasticsearch
 from elasticsearch import Elasticsearch
@@ -32,12 +36,14 @@ from shared.gateways import (
     SyslogGateway, 
     ElasticGateway
 )
-from core.common import connect_ssh, get_cvmlist, get_cvm_hostnames
+from core.common import connect_ssh, get_cvmlist, get_cvm_hostnames, close_ssh_pool
 from config import Config
 
 # ルーターのインポート
 from fastapi_app.routers.collect_log import router as collect_log_router
 from fastapi_app.routers.collect_log import cache as collect_cache
+from fastapi_app.routers.collect_log import job_queue as collect_job_queue
+from fastapi_app.routers.collect_log import job_notifier as collect_job_notifier
 from fastapi_app.routers.uuid import router as uuid_router
 
 # エラーハンドリングのインポート
@@ -183,7 +189,7 @@ async def start_ssh_log_monitoring(cvm_ip: str, log_path: str, log_name: str):
         print(f"過去のログを取得中: {log_path}")
         ssh_history = connect_ssh(cvm_ip)
         if ssh_history:
-            stdin_history, stdout_history, stderr_history = ssh_history.exec_command(f"tail -n 20 {log_path}")
+            stdin_history, stdout_history, stderr_history = ssh_history.exec_command(f"tail -n 20 {shlex.quote(log_path)}")
             
             # 過去のログを読み取り
             for line in stdout_history:
@@ -220,7 +226,7 @@ async def monitor_realtime_logs(ssh, log_path, log_name):
         while reconnect_count < max_reconnects:
             try:
                 print(f"SSH接続でtail -fを実行: {log_path} (再接続回数: {reconnect_count})")
-                stdin, stdout, stderr = ssh.exec_command(f"tail -f {log_path}")
+                stdin, stdout, stderr = ssh.exec_command(f"tail -f {shlex.quote(log_path)}")
                 
                 # リアルタイムログを読み取り
                 while True:
@@ -321,8 +327,67 @@ async def disconnect(sid):
     print(f"SocketIO disconnected: {sid}")
     # 接続管理システムから削除（SSH接続とログ監視も即座に停止）
     await connection_manager.remove_socket_connection(sid)
+    collect_job_notifier.unsubscribe(sid)
     print(f"Cleanup done for: {sid}")
 
+# リアルタイムログで tail できるログの一覧（フロントエンドの lib/rt-logs.ts と同じ内容を保つこと）
+RTLOG_LOGFILE_JSON = os.getenv("RTLOG_LOGFILE_JSON", "/app/config/rt_logfile.json")
+_rt_log_paths = None
+
+def _allowed_tail_paths():
+    """rt_logfile.json の src_path 一覧（読み込めない場合は空 = すべて拒否）"""
+    global _rt_log_paths
+    if _rt_log_paths is None:
+        try:
+            with open(RTLOG_LOGFILE_JSON, encoding="utf-8") as f:
+                _rt_log_paths = frozenset(item['src_path'] for item in json.load(f)['LOGFILE_LIST'])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[RTLOG] リアルタイムログ一覧を読み込めません: {RTLOG_LOGFILE_JSON} ({e})")
+            return frozenset()
+    return _rt_log_paths
+
+def _check_tail_path(path):
+    """tail するパスが設定済みのリアルタイムログか確認（任意のパス・コマンド文字列を CVM 上で実行させない）"""
+    if path not in _allowed_tail_paths():
+        raise ValueError(f'リアルタイムログとして登録されていないパスです: {path}')
+
+def _build_tail_sources(data, cvm_ip, log_path, log_name):
+    """複数ログの同時 tail 指定（log_paths / cvm_ips）から送信元の一覧を作る（指定が無ければ None）
+
+    log_paths は [{'log_path', 'log_name'}, ...] またはパスのリスト、cvm_ips は CVM IP のリスト。
+    ラベルは CVM が1台ならログ名、ログが1つなら CVM IP、両方複数なら "CVM IP:ログ名"。
+    """
+    raw_paths = data.get('log_paths')
+    cvm_ips = data.get('cvm_ips')
+    if not raw_paths and not cvm_ips:
+        return None
+    paths = []
+    for item in raw_paths or [{'log_path': log_path, 'log_name': log_name}]:
+        if isinstance(item, str):
+            item = {'log_path': item}
+        if not isinstance(item, dict) or not item.get('log_path'):
+            raise ValueError(f'log_paths の指定が不正です: {item}')
+        _check_tail_path(item['log_path'])
+        paths.append((item['log_path'], item.get('log_name') or os.path.basename(item['log_path'])))
+    cvm_ips = list(dict.fromkeys(cvm_ips or [cvm_ip]))
+    paths = list(dict.fromkeys(paths))
+    if len(cvm_ips) * len(paths) > MAX_SOURCES:
+        raise ValueError(f'同時に tail できるログは {MAX_SOURCES} 件までです（指定: {len(cvm_ips) * len(paths)} 件）')
+    sources = []
+    for ip in cvm_ips:
+        for path, name in paths:
+            if len(cvm_ips) == 1:
+                label = name
+            elif len(paths) == 1:
+                label = ip
+            else:
+                label = f'{ip}:{name}'
+            # ラベルは再開位置のキーにもなるため、重複したらパスで区別する
+            if any(source['label'] == label for source in sources):
+                label = f'{ip}:{path}'
+            sources.append({'cvm_ip': ip, 'log_path': path, 'label': label})
+    return sources
+
 @sio.event
 async def start_tail_f(sid, data):
     """tail -f開始イベント"""
@@ -340,26 +405,94 @@ async def start_tail_f(sid, data):
             }, to=sid)
             return
         
-        # 接続管理システムを使用してSSH接続とログ監視を開始
-        ssh_success = await connection_manager.add_ssh_connection(sid, cvm_ip)
-        if not ssh_success:
+        try:
+            _check_tail_path(log_path)
+        except ValueError as e:
+            await sio.emit('tail_f_status', {
+                'status': 'error',
+                'message': str(e)
+            }, to=sid)
+            return
+        
+        # サーバー側フィルタ（include / exclude の正規表現、重要度）
+        try:
+            line_filter = LineFilter.from_request(data)
+        except ValueError as e:
             await sio.emit('tail_f_status', {
                 'status': 'error',
-                'message': f'SSH接続失敗: {cvm_ip}'
+                'message': f'フィルタ指定が不正です: {e}'
             }, to=sid)
             return
         
-        monitoring_success = await connection_manager.start_log_monitoring(sid, log_path, log_name, sio)
-        if not monitoring_success:
+        # クラスタ全CVMの同じログをまとめて tail（get_cvmlist の CVM 一覧を cvm_ips として扱う）
+        cluster_name = data.get('cluster_name')
+        if cluster_name:
+            try:
+                cluster_data = await asyncio.to_thread(get_cvmlist, cluster_name)
+            except Exception as e:
+                await sio.emit('tail_f_status', {
+                    'status': 'error',
+                    'message': f'CVM一覧の取得に失敗しました: {e}'
+                }, to=sid)
+                return
+            cvm_ips = list(cluster_data.get('cvms_ip') or [])
+            if not cvm_ips:
+                await sio.emit('tail_f_status', {
+                    'status': 'error',
+                    'message': f'CVMが見つかりません: {cluster_name}'
+                }, to=sid)
+                return
+            data = dict(data, cvm_ips=cvm_ips, log_paths=None)
+        
+        # 複数ログの同時 tail（log_paths / cvm_ips）。SSH接続は送信元ごとにプールから借りる
+        try:
+            sources = _build_tail_sources(data, cvm_ip, log_path, log_name)
+        except ValueError as e:
             await sio.emit('tail_f_status', {
                 'status': 'error',
-                'message': f'ログ監視開始失敗: {log_path}'
+                'message': str(e)
             }, to=sid)
             return
         
+        # 接続管理システムを使用してSSH接続とログ監視を開始
+        # （同じログの tail が稼働中ならSSH接続を取らずにそのストリームへ参加する）
+        if sources is None and not connection_manager.has_tail_stream(cvm_ip, log_path):
+            ssh_success = await connection_manager.add_ssh_connection(sid, cvm_ip)
+            if not ssh_success:
+                await sio.emit('tail_f_status', {
+                    'status': 'error',
+                    'message': f'SSH接続失敗: {cvm_ip}'
+                }, to=sid)
+                return
+        
+        # 再接続時は前回の stream_id と最後に受信した seq から再開する
+        resume = data.get('resume') if isinstance(data.get('resume'), dict) else None
+        # クラスタ指定時（または ordered 指定時）は行頭の時刻順に並べ替えてまとめる
+        reorder = sources is not None and bool(cluster_name or data.get('ordered'))
+        monitoring = await connection_manager.start_log_monitoring(
+            sid, log_path, log_name, sio, line_filter, cvm_ip=cvm_ip, resume=resume,
+            sources=sources, reorder=reorder
+        )
+        if not monitoring:
+            await sio.emit('tail_f_status', {
+                'status': 'error',
+                'message': f'ログ監視開始失敗: {log_path}' if sources is None else 'ログ監視開始失敗: すべてのログで開始できませんでした'
+            }, to=sid)
+            return
+        
+        target = cvm_ip
+        if sources is not None:
+            failed = [source['label'] for source in monitoring['sources'] if 'error' in source]
+            target = f"{cluster_name} の{len(sources) - len(failed)}台" if cluster_name else f"{len(sources) - len(failed)}件のログ"
+            if failed:
+                target += f"（開始失敗: {', '.join(failed)}）"
+        message = f'tail -f再開: {target}' if monitoring['resumed'] else f'tail -f開始: {target}'
+        if monitoring['missed']:
+            message += f"（保持期間外の{monitoring['missed']}行は再送できません）"
         await sio.emit('tail_f_status', {
             'status': 'started',
-            'message': f'tail -f開始: {cvm_ip}'
+            'message': message,
+            **monitoring
         }, to=sid)
         print(f"tail -f started: {sid}")
             
@@ -392,6 +525,49 @@ async def stop_tail_f(sid, data):
             'message': f'tail -f停止エラー: {str(e)}'
         }, to=sid)
 
+@sio.event
+async def fetch_log_range(sid, data):
+    """送信が追いつかずスキップした行（log_gap で通知した範囲）を取得"""
+    try:
+        from_line = int((data or {}).get('from_line'))
+        to_line = int((data or {}).get('to_line'))
+    except (TypeError, ValueError):
+        await sio.emit('log_range', {'error': 'from_line / to_line が不正です'}, to=sid)
+        return
+    result = await connection_manager.fetch_log_range(sid, from_line, to_line)
+    if result is None:
+        await sio.emit('log_range', {'from_line': from_line, 'to_line': to_line, 'error': 'ログ監視中ではありません'}, to=sid)
+        return
+    await sio.emit('log_range', result, to=sid)
+
+@sio.event
+async def subscribe_job(sid, data):
+    """ログ収集ジョブの進捗購読（以降 collect_progress イベントで更新をプッシュ）"""
+    job_id = (data or {}).get('job_id')
+    if not job_id:
+        await sio.emit('collect_progress', {'error': 'job_id が指定されていません'}, to=sid)
+        return
+    await sio.enter_room(sid, f"collect_job:{job_id}")
+    collect_job_notifier.subscribe(sid, job_id)
+    # 購読開始時点の状態を送る（取りこぼし防止）
+    record = await collect_job_notifier.snapshot(job_id)
+    if record is None:
+        await sio.emit('collect_progress', {'job_id': job_id, 'error': 'Job not found'}, to=sid)
+        return
+    await sio.emit('collect_progress', dict(record, job_id=job_id), to=sid)
+
+@sio.event
+async def unsubscribe_job(sid, data):
+    """ログ収集ジョブの進捗購読解除"""
+    job_id = (data or {}).get('job_id')
+    if not job_id:
+        return
+    await sio.leave_room(sid, f"collect_job:{job_id}")
+    collect_job_notifier.unsubscribe(sid, job_id)
+
+async def _emit_collect_progress(job_id, payload):
+    await sio.emit('collect_progress', payload, room=f"collect_job:{job_id}")
+
 async def stop_ssh_log_monitoring():
     """SSH接続とログ監視を停止"""
     global ssh_connection, ssh_log_task
@@ -801,11 +977,17 @@ async def websocket_log_endpoint(websocket: WebSocket, client_id: str):
             
             print(f"###### WebSocket log request: {message}")
             
-            # SSH接続確立
+            # SSH接続確立（プールのトランスポートを借りる）
             ssh = connect_ssh(message.cvm)
+            if not ssh:
+                await websocket.send_json({"error": f"SSH接続失敗: {message.cvm}"})
+                continue
             
-            # リアルタイムログ開始
-            await start_realtime_log(websocket, ssh, message)
+            # リアルタイムログ開始（終了後はtailチャネルを閉じてトランスポートを返却）
+            try:
+                await start_realtime_log(websocket, ssh, message)
+            finally:
+                ssh.close()
             
     except WebSocketDisconnect:
         manager.disconnect(websocket, client_id)
@@ -871,7 +1053,8 @@ async def readiness_check():
             "version": "2.0.0",
             "elasticsearch": es_status,
             "active_connections": len(connection_manager.socket_connections),
-            "active_ssh_connections": len(connection_manager.ssh_connections)
+            "active_ssh_connections": len(connection_manager.ssh_connections),
+            "active_tail_streams": len(connection_manager.tail_streams)
         }
     except Exception as e:
         return {
@@ -947,6 +1130,11 @@ async def startup_event():
                 )
     _cache_cleanup_task = asyncio.create_task(_cache_cleanup_loop())
 
+    # ログ収集ジョブのワーカーループ開始（このPodのスロット分だけキューから取得して実行）
+    await collect_job_queue.start()
+    # ジョブ進捗のプッシュ通知開始
+    await collect_job_notifier.start(_emit_collect_progress)
+
 async def shutdown_event():
     """アプリケーション停止時の処理"""
     system_logger.info(
@@ -958,6 +1146,10 @@ async def shutdown_event():
     try:
         if '_cache_cleanup_task' in globals() and _cache_cleanup_task:
             _cache_cleanup_task.cancel()
+        await collect_job_queue.stop()
+        await collect_job_notifier.stop()
+        await connection_manager.idle_scheduler.close()
+        close_ssh_pool()
     except Exception as e:
         system_logger.error(
             "Error during shutdown",
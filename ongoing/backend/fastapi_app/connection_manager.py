@@ -6,11 +6,14 @@ import asyncio
 import time
 import sys
 import os
-from typing import Dict, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple
 
 # パスを追加してcoreモジュールをインポート
 sys.path.append(os.path.join(os.path.dirname(__file__), '../core'))
-from common import connect_ssh
+from common import connect_ssh, ssh_pool_stats
+from fastapi_app.deadline_scheduler import DeadlineScheduler
+from fastapi_app.tail_filter import LineFilter
+from fastapi_app.tail_stream import RESUME_GRACE_SECONDS, BatchEmitter, TailStream, TailSubscriber
 
 # 構造化ログのインポート
 from fastapi_app.utils.structured_logger import system_logger, EventType
@@ -22,16 +25,21 @@ class ConnectionManager:
     def __init__(self):
         # 接続管理用の辞書
         self.socket_connections: Dict[str, dict] = {}  # sid -> connection_info
-        self.ssh_connections: Dict[str, any] = {}      # sid -> ssh_connection
-        self.monitoring_tasks: Dict[str, asyncio.Task] = {}  # sid -> monitoring_task
+        self.ssh_connections: Dict[str, any] = {}      # sid -> ssh_connection（ストリームへ渡すまでの一時保持）
+        # (cvm_ip, log_path) -> 共有tailストリーム、sid -> 購読中のストリームキーと送信元ラベル
+        self.tail_streams: Dict[Tuple[str, str], TailStream] = {}
+        self.tail_subscriptions: Dict[str, Dict[Tuple[str, str], Optional[str]]] = {}
+        self.tail_subscribers: Dict[str, TailSubscriber] = {}  # sid -> 送信バッファ
+        self._streams_lock = asyncio.Lock()
         # 同時実行防止と制御
         self._locks: Dict[str, asyncio.Lock] = {}
         self._start_stop_in_progress: Set[str] = set()
         # 制御パラメータ
-        self.max_lines_per_second: int = 20
         self.idle_timeout_seconds: int = 300
         self.max_retries: int = 5
         self.retry_backoff_seconds: float = 2.0
+        # 全sidのアイドルタイムアウトを1本のタスクで管理
+        self.idle_scheduler = DeadlineScheduler(self._on_idle_deadline)
 
     async def add_socket_connection(self, sid: str) -> None:
         """SocketIO接続を追加"""
@@ -39,11 +47,10 @@ class ConnectionManager:
             'connected_at': time.time(),
             'is_active': True,
             'last_emit_ts': time.time(),
-            'idle_watch_task': None
         }
         print(f"SocketIO接続を追加: {sid}")
-        # アイドルタイムアウト監視を開始
-        await self._ensure_idle_watch(sid)
+        # アイドルタイムアウトの期限を登録
+        self.idle_scheduler.schedule(sid, self.idle_timeout_seconds)
 
     async def record_heartbeat(self, sid: str) -> None:
         """クライアントからのハートビートを記録"""
@@ -59,19 +66,14 @@ class ConnectionManager:
         await self._cleanup_ssh_connection(sid)
         print(f"🔌 SSH接続のクリーンアップ完了: {sid}")
         
-        # 関連するログ監視タスクを即座に停止
+        # 関連するログ監視タスクを即座に停止（切断済みなので送信待ちの行は送らない）
+        # 最後の購読者でも、再接続による再開に備えてストリームはしばらく残す
         print(f"🔌 ログ監視タスクのクリーンアップ開始: {sid}")
-        await self._cleanup_monitoring_task(sid)
+        await self._cleanup_monitoring_task(sid, flush=False, linger=True)
         print(f"🔌 ログ監視タスクのクリーンアップ完了: {sid}")
         
-        # アイドル監視タスクを停止
-        if sid in self.socket_connections and self.socket_connections[sid].get('idle_watch_task'):
-            task = self.socket_connections[sid]['idle_watch_task']
-            try:
-                task.cancel()
-            except Exception:
-                pass
-            self.socket_connections[sid]['idle_watch_task'] = None
+        # アイドルタイムアウトの期限を取り消す
+        self.idle_scheduler.cancel(sid)
         
         # SocketIO接続情報を削除
         if sid in self.socket_connections:
@@ -86,7 +88,7 @@ class ConnectionManager:
         while attempt < self.max_retries:
             try:
                 print(f"[RTLOG] SSH接続試行 {attempt+1}/{self.max_retries}: {cvm_ip}")
-                ssh = connect_ssh(cvm_ip)
+                ssh = await asyncio.to_thread(connect_ssh, cvm_ip)
                 if ssh:
                     print(f"[RTLOG] SSH接続成功: {cvm_ip}")
                     return ssh
@@ -126,6 +128,9 @@ class ConnectionManager:
                 return False
             
             self.ssh_connections[sid] = ssh_connection
+            if sid in self.socket_connections:
+                self.socket_connections[sid]['cvm_ip'] = cvm_ip
+                self.socket_connections[sid]['ssh_cvm_ip'] = cvm_ip
             print(f"[RTLOG] SSH接続成功: {cvm_ip} (SID: {sid})")
             return True
             
@@ -136,44 +141,141 @@ class ConnectionManager:
             if sid in self._start_stop_in_progress:
                 self._start_stop_in_progress.remove(sid)
 
-    async def start_log_monitoring(self, sid: str, log_path: str, log_name: str, sio) -> bool:
-        """ログ監視を開始"""
+    def has_tail_stream(self, cvm_ip: str, log_path: str) -> bool:
+        """同じCVM・ログパスの tail が稼働中か（参加するだけならSSH接続は不要）"""
+        return (cvm_ip, log_path) in self.tail_streams
+
+    async def start_log_monitoring(self, sid: str, log_path: str, log_name: str, sio,
+                                   line_filter: Optional[LineFilter] = None, cvm_ip: Optional[str] = None,
+                                   resume: Optional[dict] = None,
+                                   sources: Optional[List[dict]] = None, reorder: bool = False) -> Optional[dict]:
+        """ログ監視を開始（同じCVM・ログパスのtailが動いていれば共有する）
+
+        新規のストリームは `tail -n N -F` を1回だけ実行し、直近N行（履歴）とその後の追記を
+        同じチャネルで受け取る。SSH接続は add_ssh_connection 済みのものを引き継ぎ、
+        無ければプールから借りる（同じCVMなら1本のトランスポート上のチャネルになる）。
+        sources（[{'cvm_ip', 'log_path', 'label'}, ...]）を指定すると、複数のログを
+        まとめて1つの送信バッファへ流し、行ごとに label を付けて送る。
+        reorder=True なら、送信元をまたいで行頭のタイムスタンプ順に並べ替えて送る。
+        line_filter を指定すると、一致した行だけをこの購読者へ送る（ストリームは共有のまま）。
+        resume（{'stream_id', 'seq'}、複数時は {'sources': {label: {'stream_id', 'seq'}}}）が
+        稼働中のストリームと一致すれば、seq の次の行から再送する。
+        成功時は {'stream_id', 'seq', 'resumed', 'missed'}（複数時は送信元ごとの結果を 'sources' に入れる）、
+        失敗時は None を返す。
+        """
+        cvm_ip = cvm_ip or self.socket_connections.get(sid, {}).get('cvm_ip')
+        tagged = sources is not None
+        if not tagged:
+            sources = [{'cvm_ip': cvm_ip, 'log_path': log_path, 'label': None}]
         # 同時実行防止
         async with self._get_lock(sid):
-            if sid not in self.ssh_connections:
-                print(f"SSH接続がありません: {sid}")
-                return False
-            if sid in self.monitoring_tasks:
+            if sid in self.tail_subscriptions:
                 print(f"既にログ監視中です: {sid}")
-                return False
+                return None
             if sid in self._start_stop_in_progress:
                 print(f"start/stop処理中のため監視開始をスキップ: {sid}")
-                return False
+                return None
             self._start_stop_in_progress.add(sid)
         
         try:
-            # 過去のログを取得
-            await self._get_historical_logs(sid, log_path)
+            if sid in self.socket_connections:
+                self.socket_connections[sid]['cvm_ip'] = cvm_ip
+            subscriber = self._make_tail_subscriber(sid, log_name, sio, line_filter, tagged=tagged, reorder=reorder)
+            self.tail_subscriptions[sid] = {}
+            resume = resume or {}
+            # CVMごとに順番に購読する（2本目以降のリースは1本目が張ったトランスポートを再利用する）
+            # 異なるCVM同士は並行して接続する
+            by_cvm: Dict[str, List[int]] = {}
+            for index, source in enumerate(sources):
+                by_cvm.setdefault(source['cvm_ip'], []).append(index)
+            results: List[dict] = [{} for _ in sources]
             
-            # チャンネルが完全に閉じるまで待機
-            await asyncio.sleep(0.5)
+            async def subscribe_cvm(indexes: List[int]) -> None:
+                for index in indexes:
+                    source = sources[index]
+                    results[index] = await self._subscribe_source(
+                        sid, source, subscriber,
+                        (resume.get('sources') or {}).get(source['label']) if tagged else resume
+                    )
             
-            # リアルタイム監視タスクを開始
-            print(f"リアルタイム監視を開始: {log_path} (SID: {sid})")
-            monitoring_task = asyncio.create_task(
-                self._monitor_realtime_logs(sid, log_path, log_name, sio)
-            )
-            self.monitoring_tasks[sid] = monitoring_task
-            
-            return True
+            await asyncio.gather(*[subscribe_cvm(indexes) for indexes in by_cvm.values()])
+            # 引き継がなかったSSH接続は返却する
+            await self._cleanup_ssh_connection(sid)
+            if not any('error' not in result for result in results):
+                await self._cleanup_monitoring_task(sid)
+                return None
+            if not tagged:
+                result = results[0]
+                return {key: result[key] for key in ('stream_id', 'seq', 'resumed', 'missed')}
+            return {
+                'sources': results,
+                'resumed': any(result.get('resumed') for result in results),
+                'missed': sum(result.get('missed', 0) for result in results),
+            }
             
         except Exception as e:
             print(f"ログ監視開始エラー: {e}")
-            return False
+            await self._cleanup_monitoring_task(sid)
+            return None
         finally:
             if sid in self._start_stop_in_progress:
                 self._start_stop_in_progress.remove(sid)
 
+    async def _subscribe_source(self, sid: str, source: dict, subscriber: TailSubscriber,
+                                resume: Optional[dict] = None) -> dict:
+        """1つのログ（CVM・ログパス）のストリームを購読し、送信元ごとの結果を返す"""
+        cvm_ip, log_path, label = source['cvm_ip'], source['log_path'], source.get('label')
+        key = (cvm_ip, log_path)
+        result = {'label': label, 'cvm_ip': cvm_ip, 'log_path': log_path}
+        handler = self._make_tail_handler(sid, subscriber, label)
+        async with self._streams_lock:
+            stream = self.tail_streams.get(key)
+            if stream is None:
+                # 新しいストリームを登録してから接続する（接続待ちの間に来た同じログの要求も参加できる）
+                # 履歴行を取りこぼさないよう、tail の実行前に購読を登録する
+                print(f"リアルタイム監視を開始: {cvm_ip}:{log_path} (SID: {sid})")
+                stream = TailStream(cvm_ip, log_path, on_closed=self._on_stream_closed,
+                                    on_dropped=self._on_subscriber_dropped)
+                self.tail_streams[key] = stream
+                stream.subscribe(sid, handler)
+                self.tail_subscriptions.setdefault(sid, {})[key] = label
+                created = True
+            else:
+                # 既存ストリームに参加（SSH接続は不要）
+                resumed = bool(resume) and resume.get('stream_id') == stream.stream_id
+                after_seq = int(resume.get('seq') or 0) if resumed else None
+                print(f"既存のtailストリームに{'再開' if resumed else '参加'}: {cvm_ip}:{log_path} "
+                      f"(SID: {sid}, 購読者: {len(stream.subscribers) + 1}{f', seq>{after_seq}' if resumed else ''})")
+                first_seq, recent, missed = stream.subscribe(sid, handler, after_seq=after_seq)
+                self.tail_subscriptions.setdefault(sid, {})[key] = label
+                created = False
+        
+        if created:
+            lease = self._take_ssh_connection(sid, cvm_ip)
+            if lease is None:
+                lease = await self._connect_ssh_with_retry(cvm_ip)
+            if not lease:
+                await stream.close()
+                return dict(result, error=f'SSH接続失敗: {cvm_ip}')
+            try:
+                await stream.start(lease)
+            except Exception as e:
+                print(f"ログ監視開始エラー: {cvm_ip}:{log_path} ({e})")
+                await stream.close()
+                return dict(result, error=str(e))
+            return dict(result, stream_id=stream.stream_id, seq=0, resumed=False, missed=0)
+        
+        # 途中参加・再開時は保持中の行を先に送る（追加のSSH実行なし）
+        if recent:
+            await handler(first_seq, recent)
+        return dict(result, stream_id=stream.stream_id, seq=first_seq - 1, resumed=resumed, missed=missed)
+
+    def _take_ssh_connection(self, sid: str, cvm_ip: str):
+        """add_ssh_connection 済みの同じCVMへのSSH接続があれば引き継ぐ（1回だけ）"""
+        if self.socket_connections.get(sid, {}).get('ssh_cvm_ip', cvm_ip) != cvm_ip:
+            return None
+        return self.ssh_connections.pop(sid, None)
+
     async def stop_log_monitoring(self, sid: str) -> None:
         """ログ監視を停止"""
         async with self._get_lock(sid):
@@ -197,6 +299,7 @@ class ConnectionManager:
                 self._start_stop_in_progress.remove(sid)
         if sid in self.socket_connections:
             self.socket_connections[sid]['is_active'] = False
+        self.idle_scheduler.cancel(sid)
         print(f"🔌 stop_all 完了: {sid}")
 
     async def _cleanup_ssh_connection(self, sid: str) -> None:
@@ -213,168 +316,118 @@ class ConnectionManager:
                 del self.ssh_connections[sid]
                 print(f"SSH接続情報を削除: {sid}")
     
-    async def _cleanup_monitoring_task(self, sid: str) -> None:
-        """ログ監視タスクをクリーンアップ"""
-        if sid in self.monitoring_tasks:
-            try:
-                task = self.monitoring_tasks[sid]
-                print(f"ログ監視タスクをキャンセル開始: {sid}")
-                task.cancel()
-                try:
-                    await task
-                except asyncio.CancelledError:
-                    print(f"ログ監視タスクをキャンセル完了: {sid}")
-                except Exception as e:
-                    print(f"ログ監視タスクキャンセルエラー: {e}")
-            finally:
-                del self.monitoring_tasks[sid]
-                print(f"ログ監視タスクを停止完了: {sid}")
+    async def _cleanup_monitoring_task(self, sid: str, flush: bool = True, linger: bool = False) -> None:
+        """ストリームの購読を解除（最後の購読者ならリモートのtailも停止）
+
+        linger=True なら、最後の購読者でも RESUME_GRACE_SECONDS の間はストリームを残す。
+        """
+        subscriber = self.tail_subscribers.pop(sid, None)
+        if subscriber is not None:
+            await subscriber.close(flush=flush)
+        keys = self.tail_subscriptions.pop(sid, None)
+        if not keys:
+            return
+        async with self._streams_lock:
+            for key in keys:
+                stream = self.tail_streams.get(key)
+                if stream is None:
+                    continue
+                remaining = stream.unsubscribe(sid)
+                print(f"ログ監視の購読を解除: {sid} ({key[0]}:{key[1]}, 残り購読者: {remaining})")
+                if remaining > 0:
+                    continue
+                if linger and RESUME_GRACE_SECONDS > 0:
+                    print(f"再開待ちのためストリームを維持: {key[0]}:{key[1]} ({RESUME_GRACE_SECONDS:.0f}秒)")
+                    stream.linger(RESUME_GRACE_SECONDS, self._close_unused_stream)
+                    continue
+                self.tail_streams.pop(key, None)
+                await stream.close()
+    
+    async def _close_unused_stream(self, stream: TailStream) -> None:
+        """再開待ちの間に購読されなかったストリームを停止"""
+        async with self._streams_lock:
+            if stream.subscribers or self.tail_streams.get(stream.key) is not stream:
+                return
+            self.tail_streams.pop(stream.key, None)
+            print(f"再開されなかったストリームを停止: {stream.key[0]}:{stream.key[1]}")
+            await stream.close()
     
-    async def _get_historical_logs(self, sid: str, log_path: str) -> None:
-        """過去のログを取得"""
-        if sid not in self.ssh_connections:
+    def _on_stream_closed(self, stream: TailStream) -> None:
+        """リモートのtailが終了したストリームを一覧と購読から外す"""
+        if self.tail_streams.get(stream.key) is stream:
+            del self.tail_streams[stream.key]
+        for sid in list(stream.subscribers):
+            keys = self.tail_subscriptions.get(sid)
+            if not keys or stream.key not in keys:
+                continue
+            del keys[stream.key]
+            # 複数ログをまとめて tail している場合は、残りの送信元が終わるまで購読を続ける
+            if keys:
+                continue
+            del self.tail_subscriptions[sid]
+            subscriber = self.tail_subscribers.pop(sid, None)
+            if subscriber is not None:
+                asyncio.create_task(subscriber.close())
+    
+    def _on_subscriber_dropped(self, stream: TailStream, sid: str, error: Exception) -> None:
+        """ストリームが送信に失敗した購読者を外したら、その sid の監視ごと停止する"""
+        if stream.key not in self.tail_subscriptions.get(sid, {}):
+            return
+        asyncio.create_task(self._stop_dropped_subscriber(sid, error))
+
+    async def _stop_dropped_subscriber(self, sid: str, error: Exception) -> None:
+        subscriber = self.tail_subscribers.get(sid)
+        sio = subscriber.emitter.sio if subscriber is not None else None
+        # 他の送信元の購読・送信バッファも残さない（最後の購読者ならストリームも停止する）
+        await self.stop_log_monitoring(sid)
+        print(f"[RTLOG] 送信エラーのため監視を停止: {sid} ({error})")
+        if sio is None:
             return
-        
-        print(f"過去のログを取得中: {log_path} (SID: {sid})")
-        
         try:
-            # 既存のSSH接続を再利用
-            ssh_history = self.ssh_connections[sid]
-            if ssh_history:
-                stdin, stdout, stderr = ssh_history.exec_command(f"tail -n 20 {log_path}")
-                
-                # 完全に読み切ってからチャンネルを解放
-                lines = stdout.readlines()
-                stdout.channel.close()  # チャンネルを明示的に閉じる
-                
-                print(f"過去のログ取得完了: {sid} ({len(lines)}行)")
+            await sio.emit('tail_f_status', {
+                'status': 'stopped',
+                'message': f'tail -f停止（送信エラー: {error}）'
+            }, to=sid)
         except Exception as e:
-            print(f"過去ログ取得エラー: {e}")
+            print(f"[RTLOG] tail_f_status 送信失敗: {sid} ({e})")
+
+    def _make_tail_subscriber(self, sid: str, log_name: str, sio, line_filter: Optional[LineFilter] = None,
+                              tagged: bool = False, reorder: bool = False) -> TailSubscriber:
+        """sid 宛ての送信バッファを作る（tagged なら行ごとに送信元ラベルを付けて送る）"""
+        emitter = BatchEmitter(sio, sid, log_name, highlight=bool(line_filter and line_filter.highlights), tagged=tagged)
+        subscriber = TailSubscriber(emitter, line_filter, reorder=reorder).start()
+        self.tail_subscribers[sid] = subscriber
+        return subscriber
     
-    async def _monitor_realtime_logs(self, sid: str, log_path: str, log_name: str, sio) -> None:
-        """リアルタイムログ監視"""
-        line_count = 0
-        tokens = self.max_lines_per_second
-        last_refill = time.time()
-        
-        try:
+    def _make_tail_handler(self, sid: str, subscriber: TailSubscriber, label: Optional[str] = None):
+        """ストリームから受け取った行を sid 宛ての送信バッファへ入れるハンドラを作る"""
+        async def handler(first_seq, lines):
             # 接続がアクティブかチェック
             if sid not in self.socket_connections or not self.socket_connections[sid]['is_active']:
-                print(f"[RTLOG] 接続が非アクティブです: {sid}")
-                return
-            
-            # 既存のSSH接続を再利用
-            if sid not in self.ssh_connections:
-                print(f"[RTLOG] SSH接続がありません: {sid}")
                 return
-            
-            ssh_connection = self.ssh_connections[sid]
-            print(f"[RTLOG] 既存のSSH接続を使用してリアルタイム監視を開始 (SID: {sid})")
-            
-            print(f"[RTLOG] tail -fコマンドを実行: {log_path} (SID: {sid})")
-            stdin, stdout, stderr = ssh_connection.exec_command(f"tail -f {log_path}")
-            
-            # stdout をノンブロッキングモードに設定
-            stdout.channel.setblocking(0)
-            
-            # ログを読み取り
-            while sid in self.socket_connections and self.socket_connections[sid]['is_active']:
-                try:
-                    # レート制御（1秒毎のトークン補充）
-                    now = time.time()
-                    if now - last_refill >= 1.0:
-                        tokens = self.max_lines_per_second
-                        last_refill = now
-                    
-                    # ノンブロッキングreadline
-                    line = None
-                    try:
-                        line = stdout.readline()
-                    except Exception:
-                        # データがない場合は次のループへ
-                        await asyncio.sleep(0.1)
-                        continue
-                    
-                    if not line:
-                        # データがない場合は少し待機
-                        await asyncio.sleep(0.1)
-                        continue
-                    # トークンが尽きている場合はスキップ
-                    if tokens <= 0:
-                        await asyncio.sleep(0.1)
-                        continue
-                    tokens -= 1
-                    
-                    line_count += 1
-                    
-                    # SocketIOでログを送信
-                    try:
-                        await sio.emit('log', {
-                            'name': log_name,
-                            'line': line.strip(),
-                            'line_number': line_count,
-                            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
-                        })
-                        if sid in self.socket_connections:
-                            self.socket_connections[sid]['last_emit_ts'] = time.time()
-                    except Exception as e:
-                        print(f"[RTLOG] SocketIOログ送信エラー: {e}")
-                        break
-                    
-                    # 次のループの前に必ずyield（イベントループを解放）
-                    await asyncio.sleep(0.05)
-                    
-                except asyncio.CancelledError:
-                    print(f"[RTLOG] ログ監視タスクがキャンセルされました（正常終了）: {sid}")
-                    return  # タスクキャンセルは正常終了として扱う
-                except Exception as e:
-                    print(f"[RTLOG] ログ読み取りエラー: {e}")
-                    break
-            
-            # 接続がアクティブでない場合は終了
-            if sid not in self.socket_connections or not self.socket_connections[sid]['is_active']:
-                print(f"[RTLOG] 接続が非アクティブになりました: {sid}")
-                
-        except asyncio.CancelledError:
-            print(f"[RTLOG] ログ監視タスクがキャンセルされました（正常終了）: {sid}")
-            # タスクキャンセルは正常終了として扱う
-        except Exception as e:
-            print(f"[RTLOG] ログ監視タスクで予期しないエラー: {e}")
-        finally:
-            # SSH接続をクリーンアップ
-            try:
-                if 'ssh_connection' in locals():
-                    print(f"[RTLOG] 🔌 リアルタイムログ用SSH接続を切断: {sid}")
-                    ssh_connection.close()
-                    print(f"[RTLOG] SSH connection close: {sid}")
-            except Exception as e:
-                print(f"[RTLOG] 🔌 SSH接続クリーンアップエラー: {e}")
-            print(f"[RTLOG] 🔌 リアルタイムログ監視を終了: {sid}")
+            await subscriber.offer(first_seq, [line.strip() for line in lines], label)
+            self.socket_connections[sid]['last_emit_ts'] = time.time()
+        
+        return handler
 
-    async def _ensure_idle_watch(self, sid: str) -> None:
-        """アイドルタイムアウト監視開始（監視未開始時のみ適用）"""
-        if sid not in self.socket_connections:
+    async def fetch_log_range(self, sid: str, from_line: int, to_line: int) -> Optional[dict]:
+        """送信が追いつかずディスクへ退避した行を行番号の範囲で取得"""
+        subscriber = self.tail_subscribers.get(sid)
+        if subscriber is None:
+            return None
+        return await subscriber.fetch_range(from_line, to_line)
+
+    async def _on_idle_deadline(self, sid: str) -> None:
+        """アイドルタイムアウト（監視未開始のまま idle_timeout_seconds 経過）で停止"""
+        info = self.socket_connections.get(sid)
+        if info is None or not info['is_active']:
             return
-        if self.socket_connections[sid].get('idle_watch_task'):
+        # 監視中はタイムアウトしない（監視が終わっていれば次の期限で判定する）
+        if sid in self.tail_subscriptions:
+            self.idle_scheduler.schedule(sid, self.idle_timeout_seconds)
             return
-        async def watcher():
-            try:
-                while sid in self.socket_connections and self.socket_connections[sid]['is_active']:
-                    # 監視開始後はタイムアウトしない
-                    if sid in self.monitoring_tasks:
-                        await asyncio.sleep(2)
-                        continue
-                    # 監視未開始時は接続開始時刻で判定
-                    connected_at = self.socket_connections[sid].get('connected_at', time.time())
-                    if time.time() - connected_at > self.idle_timeout_seconds:
-                        print(f"⏲️ アイドルタイムアウトにより停止: {sid}")
-                        await self.stop_all(sid)
-                        break
-                    await asyncio.sleep(2)
-            except asyncio.CancelledError:
-                pass
-        task = asyncio.create_task(watcher())
-        self.socket_connections[sid]['idle_watch_task'] = task
+        print(f"⏲️ アイドルタイムアウトにより停止: {sid}")
+        await self.stop_all(sid)
 
     def _get_lock(self, sid: str) -> asyncio.Lock:
         """SIDに紐づくロックを取得/生成"""
@@ -387,7 +440,12 @@ class ConnectionManager:
         return {
             'socket_connected': sid in self.socket_connections,
             'ssh_connected': sid in self.ssh_connections,
-            'monitoring': sid in self.monitoring_tasks,
+            'monitoring': sid in self.tail_subscriptions,
+            'tail_streams': [
+                {'cvm_ip': key[0], 'log_path': key[1], 'label': label}
+                for key, label in self.tail_subscriptions[sid].items()
+            ] if sid in self.tail_subscriptions else None,
+            'buffer': self.tail_subscribers[sid].status() if sid in self.tail_subscribers else None,
             'is_active': self.socket_connections.get(sid, {}).get('is_active', False) if sid in self.socket_connections else False
         }
     
@@ -396,7 +454,10 @@ class ConnectionManager:
         return {
             'socket_connections': len(self.socket_connections),
             'ssh_connections': len(self.ssh_connections),
-            'monitoring_tasks': len(self.monitoring_tasks),
+            'monitoring_tasks': len(self.tail_subscriptions),
+            'idle_deadlines': len(self.idle_scheduler),
+            'tail_streams': [stream.status() for stream in self.tail_streams.values()],
+            'ssh_pool': ssh_pool_stats(),
             'details': {sid: self.get_connection_status(sid) for sid in self.socket_connections.keys()}
         }
 
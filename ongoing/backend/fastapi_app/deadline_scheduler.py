@@ -0,0 +1,108 @@
+"""
+期限管理（アイドルタイムアウト等）
+全キーの期限を1つのヒープで管理し、1本のタスクが最も近い期限まで待つ
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class DeadlineScheduler:
+    """キーごとの期限を保持し、期限切れになったキーだけ on_expire(key) を呼ぶ
+
+    キーの数に関わらずタスクは1本で、次の期限まで（または期限の追加・前倒しまで）待機する。
+    取り消し・再登録はヒープの要素を消さずに世代番号で無効化し、無効な要素が
+    増えたらヒープを作り直す。
+    """
+
+    def __init__(self, on_expire: Callable[[Hashable], Awaitable[None]]):
+        self._on_expire = on_expire
+        # (期限, 世代, キー)
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._entries: Dict[Hashable, Tuple[float, int]] = {}
+        self._generation = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def schedule(self, key: Hashable, delay: float) -> None:
+        """key の期限を delay 秒後に設定（既存の期限は置き換える）"""
+        deadline = time.monotonic() + delay
+        generation = next(self._generation)
+        self._entries[key] = (deadline, generation)
+        heapq.heappush(self._heap, (deadline, generation, key))
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._compact()
+        if self._heap[0][1] == generation:
+            # 最も近い期限が変わったので待ち時間を計算し直す
+            self._wakeup.set()
+        self._ensure_task()
+
+    def cancel(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def _compact(self) -> None:
+        self._heap = [(deadline, generation, key) for key, (deadline, generation) in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _pop_expired(self, now: float) -> List[Hashable]:
+        expired = []
+        while self._heap:
+            deadline, generation, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != generation:
+                heapq.heappop(self._heap)
+                continue
+            if deadline > now:
+                break
+            heapq.heappop(self._heap)
+            del self._entries[key]
+            expired.append(key)
+        return expired
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                for key in self._pop_expired(time.monotonic()):
+                    self.expired += 1
+                    # 停止処理（SSH切断等）が遅くても他のキーの期限を遅らせない
+                    asyncio.create_task(self._expire(key))
+                self._wakeup.clear()
+                if not self._heap:
+                    await self._wakeup.wait()
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(0.0, self._heap[0][0] - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            pass
+
+    async def _expire(self, key: Hashable) -> None:
+        try:
+            await self._on_expire(key)
+        except Exception as e:
+            print(f"期限切れ処理エラー: {key} ({e})")
+
+    async def close(self) -> None:
+        self._entries.clear()
+        self._heap.clear()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
@@ -0,0 +1,509 @@
+"""
+ログ収集ジョブのキュー
+SQLite（出力PVC上）にジョブを永続化し、Pod ごとのワーカースロット数まで順次実行する。
+進捗は Socket.IO でプッシュ通知する（間引き・集約して送信）
+
+ジョブDBを複数レプリカで共有するには、COLLECT_JOB_DB を全Podからマウントできる RWX ボリューム
+（SQLite のファイルロックが機能するもの）に置く必要がある。既定の出力PVCは RWO のため1レプリカで運用する。
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from fastapi_app.utils.structured_logger import system_logger, EventType
+
+
+# ジョブDB（複数レプリカで共有する場合は RWX ボリューム上のパスを指定する）
+JOB_DB_PATH = os.getenv("COLLECT_JOB_DB", "/app/output/collect_jobs.db")
+# 1 Pod あたりの同時実行ジョブ数
+WORKER_SLOTS = int(os.getenv("COLLECT_WORKER_SLOTS", "2"))
+# ハートビートが途絶えた running ジョブを再投入するまでの秒数と最大試行回数
+STALE_SECONDS = int(os.getenv("COLLECT_JOB_STALE_SECONDS", "120"))
+MAX_ATTEMPTS = int(os.getenv("COLLECT_JOB_MAX_ATTEMPTS", "2"))
+POLL_INTERVAL = 2.0
+HEARTBEAT_INTERVAL = 10.0
+# 進捗の書き込み間隔（ステージが変わった場合は即時）
+PROGRESS_WRITE_INTERVAL = 0.5
+# 完了/失敗ジョブの保持期間（秒）
+RETENTION_SECONDS = int(os.getenv("COLLECT_JOB_RETENTION_HOURS", "72")) * 3600
+# 進捗プッシュの最短間隔（秒）。間に届いた更新は最新値に集約して送る
+PUSH_INTERVAL = float(os.getenv("COLLECT_PROGRESS_PUSH_INTERVAL", "0.25"))
+# 他Podで実行中のジョブを購読している場合のストア確認間隔（秒）
+REMOTE_POLL_INTERVAL = 1.0
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+class JobLeaseLost(Exception):
+    """実行中のジョブが再投入され、このワーカーの所有でなくなった"""
+
+
+class CollectionJobStore:
+    """ジョブレコードの永続化（SQLite）
+
+    レコード本体（フロントエンドへ返す辞書）は JSON として data 列に保存し、
+    キュー制御に使う値（status / target / owner / claim / heartbeat）は列として持つ。
+    対象CVMは job_targets に1行ずつ持ち、同じCVMを含むジョブは同時に1件だけ実行する。
+    claim() ごとに発行するトークン（claim 列）を持つワーカーだけが running のレコードを更新できる。
+    """
+
+    def __init__(self, db_path: str = JOB_DB_PATH):
+        self.db_path = db_path
+        self._progress_written: Dict[str, tuple] = {}
+        # このプロセスが実行中のジョブ -> claim トークン
+        self._claims: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    owner TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    heartbeat REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "claim" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN claim TEXT")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job_targets (
+                    job_id TEXT NOT NULL,
+                    target TEXT NOT NULL,
+                    PRIMARY KEY (job_id, target)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS job_targets_target ON job_targets (target)")
+
+    @contextmanager
+    def _connect(self):
+        # 複数スレッド/プロセスから使うため操作ごとに接続する（自動コミット、書き込みは BEGIN IMMEDIATE）
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        try:
+            conn.execute("PRAGMA busy_timeout = 10000")
+            yield conn
+        finally:
+            conn.close()
+
+    def create(self, job_id: str, targets: List[str], params: Dict[str, Any], record: Dict[str, Any]) -> None:
+        """ジョブを登録（targets は収集対象のCVM IP）"""
+        now = time.time()
+        targets = list(dict.fromkeys(targets))
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO jobs (id, status, target, params, data, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, record["status"], ",".join(targets), json.dumps(params), json.dumps(record, ensure_ascii=False), now, now),
+            )
+            conn.executemany(
+                "INSERT INTO job_targets (job_id, target) VALUES (?, ?)",
+                [(job_id, target) for target in targets],
+            )
+            conn.execute("COMMIT")
+
+    def add_listener(self, listener: Callable[[str, Dict[str, Any]], None]) -> None:
+        """レコード更新時に listener(job_id, 更新項目) を呼ぶ（任意のスレッドから呼ばれる）"""
+        self._listeners.append(listener)
+
+    def _notify(self, job_id: str, fields: Dict[str, Any]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(job_id, fields)
+            except Exception as e:
+                print(f"[collectlog][warn] job listener error: {e}")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        """レコードの項目を更新（status を含む場合は列も更新）
+
+        このプロセスが実行中のジョブが再投入されていた場合は更新せず JobLeaseLost を送出する
+        （収集スレッドの進捗コールバックから送出され、収集を打ち切る）。
+        """
+        claim = self._claims.get(job_id)
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT data, claim FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return
+            if claim is not None and row[1] != claim:
+                conn.execute("ROLLBACK")
+                raise JobLeaseLost(f"job {job_id} was reclaimed by another worker")
+            record = json.loads(row[0])
+            record.update(fields)
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET data = ?, status = ?, heartbeat = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(record, ensure_ascii=False), record["status"], now, now, job_id),
+            )
+            conn.execute("COMMIT")
+        self._notify(job_id, fields)
+
+    def update_progress(self, job_id: str, progress: Dict[str, Any]) -> None:
+        """進捗を間引いて書き込む（収集スレッドから高頻度で呼ばれるため。通知は毎回行う）"""
+        now = time.monotonic()
+        stage = progress.get("stage")
+        with self._lock:
+            last = self._progress_written.get(job_id)
+            if last and last[0] == stage and now - last[1] < PROGRESS_WRITE_INTERVAL and stage != "done":
+                skip = True
+            else:
+                skip = False
+                self._progress_written[job_id] = (stage, now)
+        if skip:
+            self._notify(job_id, {"progress": progress})
+        else:
+            self.update(job_id, progress=progress)
+
+    def release(self, job_id: str) -> None:
+        """実行を終えたジョブの claim トークンと進捗の間引き状態を破棄"""
+        with self._lock:
+            self._progress_written.pop(job_id, None)
+            self._claims.pop(job_id, None)
+
+    def claim(self, owner: str, exclude: Optional[List[str]] = None) -> Optional[tuple]:
+        """最も古い queued ジョブを running にして (job_id, params) を返す
+
+        対象CVMのいずれかを含むジョブが実行中の場合は後回しにする（CVM単体/クラスター指定を問わない）。
+        exclude には自プロセスでまだ実行中のジョブを渡す（再投入された自分のジョブを二重に実行しない）。
+        """
+        token = uuid.uuid4().hex
+        exclude = list(exclude or [])
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                f"""
+                SELECT id, params, data FROM jobs AS j
+                WHERE status = 'queued'
+                  AND id NOT IN ({", ".join("?" * len(exclude))})
+                  AND NOT EXISTS (
+                    SELECT 1 FROM job_targets AS t
+                    JOIN job_targets AS rt ON rt.target = t.target
+                    JOIN jobs AS r ON r.id = rt.job_id AND r.status = 'running'
+                    WHERE t.job_id = j.id
+                  )
+                ORDER BY created_at LIMIT 1
+                """,
+                exclude,
+            ).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            job_id, params, data = row
+            record = json.loads(data)
+            record.update({"status": "running", "worker": owner})
+            now = time.time()
+            conn.execute(
+                """
+                UPDATE jobs SET status = 'running', owner = ?, claim = ?, attempts = attempts + 1,
+                    heartbeat = ?, updated_at = ?, data = ?
+                WHERE id = ?
+                """,
+                (owner, token, now, now, json.dumps(record, ensure_ascii=False), job_id),
+            )
+            conn.execute("COMMIT")
+        with self._lock:
+            self._claims[job_id] = token
+        return job_id, json.loads(params)
+
+    def heartbeat(self, job_ids) -> List[str]:
+        """実行中ジョブのハートビートを更新し、所有でなくなっていたジョブIDを返す"""
+        claims = [(job_id, self._claims.get(job_id)) for job_id in job_ids]
+        claims = [(job_id, claim) for job_id, claim in claims if claim is not None]
+        if not claims:
+            return []
+        now = time.time()
+        lost = []
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for job_id, claim in claims:
+                cursor = conn.execute(
+                    "UPDATE jobs SET heartbeat = ? WHERE id = ? AND claim = ? AND status = 'running'",
+                    (now, job_id, claim),
+                )
+                if cursor.rowcount == 0:
+                    lost.append(job_id)
+            conn.execute("COMMIT")
+        return lost
+
+    def recover_stale(self) -> int:
+        """ハートビートが途絶えた running ジョブを再投入（試行回数超過は failed）し件数を返す
+
+        再投入時に claim トークンを消すため、元のワーカーが生きていても次の更新で JobLeaseLost となり停止する。
+        """
+        now = time.time()
+        recovered = 0
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, attempts, data, claim FROM jobs WHERE status = 'running' AND heartbeat < ?",
+                (now - STALE_SECONDS,),
+            ).fetchall()
+            for job_id, attempts, data, claim in rows:
+                record = json.loads(data)
+                if attempts >= MAX_ATTEMPTS:
+                    record.update({
+                        "status": "failed",
+                        "error": "worker lost (pod restarted or stopped)",
+                        "completed_at": datetime.now().isoformat(),
+                    })
+                else:
+                    record.update({
+                        "status": "queued",
+                        "progress": {"stage": "queued", "current": 0, "total": 100, "message": "ログ収集を再試行します..."},
+                    })
+                # 読み取った claim のままの場合だけ書き換える（compare-and-set）
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = ?, owner = NULL, claim = NULL, data = ?, updated_at = ? "
+                    "WHERE id = ? AND claim IS ?",
+                    (record["status"], json.dumps(record, ensure_ascii=False), now, job_id, claim),
+                )
+                recovered += cursor.rowcount
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?",
+                (now - RETENTION_SECONDS,),
+            )
+            conn.execute("DELETE FROM job_targets WHERE job_id NOT IN (SELECT id FROM jobs)")
+            conn.execute("COMMIT")
+        return recovered
+
+
+class CollectionJobQueue:
+    """Pod 内のワーカーループ（空きスロット分だけ queued ジョブを取得して実行）"""
+
+    def __init__(self, store: CollectionJobStore, slots: int = WORKER_SLOTS):
+        self.store = store
+        self.slots = max(1, slots)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.running: Dict[str, asyncio.Task] = {}
+        self._runner: Optional[Callable[..., Awaitable[None]]] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def set_runner(self, runner: Callable[..., Awaitable[None]]) -> None:
+        """ジョブ実行関数 runner(job_id, **params) を登録"""
+        self._runner = runner
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def notify(self) -> None:
+        """新規ジョブ投入時に即座にキューを確認させる"""
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _loop(self) -> None:
+        last_maintenance = 0.0
+        while True:
+            try:
+                now = time.monotonic()
+                if now - last_maintenance >= HEARTBEAT_INTERVAL:
+                    last_maintenance = now
+                    lost = await asyncio.to_thread(self.store.heartbeat, list(self.running))
+                    if lost:
+                        # 収集スレッドは次の進捗更新で JobLeaseLost により停止する
+                        system_logger.warning(
+                            "Collection jobs reclaimed by another worker",
+                            event_type=EventType.SYSTEM_ERROR,
+                            job_ids=lost
+                        )
+                    recovered = await asyncio.to_thread(self.store.recover_stale)
+                    if recovered:
+                        system_logger.warning(
+                            "Stale collection jobs recovered",
+                            event_type=EventType.SYSTEM_ERROR,
+                            count=recovered
+                        )
+                while len(self.running) < self.slots and self._runner:
+                    claimed = await asyncio.to_thread(self.store.claim, self.owner, list(self.running))
+                    if claimed is None:
+                        break
+                    job_id, params = claimed
+                    task = asyncio.create_task(self._run(job_id, params))
+                    self.running[job_id] = task
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                system_logger.error(
+                    "Collection job queue error",
+                    event_type=EventType.SYSTEM_ERROR,
+                    error=str(e)
+                )
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _run(self, job_id: str, params: Dict[str, Any]) -> None:
+        try:
+            await self._runner(job_id, **params)
+        finally:
+            self.running.pop(job_id, None)
+            self.store.release(job_id)
+            self.notify()
+
+
+class JobProgressNotifier:
+    """ジョブ更新を購読中のクライアントへプッシュする
+
+    収集スレッドからの高頻度な更新はジョブごとに集約し、PUSH_INTERVAL 秒に
+    1回だけ最新値を送信する（完了/失敗は即時）。他Podで実行中のジョブは
+    ストアを定期確認して変化があれば送信する。完了/失敗を送ったジョブは購読を終える。
+    """
+
+    def __init__(self, store: CollectionJobStore, interval: float = PUSH_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self._emit: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._scheduled: Set[str] = set()
+        self._last_sent: Dict[str, float] = {}
+        self._subscribers: Dict[str, Set[str]] = {}
+        self._remote_snapshots: Dict[str, Dict[str, Any]] = {}
+        self._watch_task: Optional[asyncio.Task] = None
+        store.add_listener(self.publish)
+
+    async def start(self, emit: Callable[[str, Dict[str, Any]], Awaitable[None]]) -> None:
+        """送信関数 emit(job_id, payload) を登録して開始（イベントループ上で呼ぶ）"""
+        self._emit = emit
+        self._loop = asyncio.get_running_loop()
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_remote())
+
+    async def stop(self) -> None:
+        if self._watch_task:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+    def subscribe(self, sid: str, job_id: str) -> None:
+        self._subscribers.setdefault(job_id, set()).add(sid)
+
+    def unsubscribe(self, sid: str, job_id: Optional[str] = None) -> None:
+        """購読解除（job_id 未指定時は sid の全購読）"""
+        job_ids = [job_id] if job_id else list(self._subscribers)
+        for jid in job_ids:
+            sids = self._subscribers.get(jid)
+            if sids is None:
+                continue
+            sids.discard(sid)
+            if not sids:
+                self._subscribers.pop(jid, None)
+                self._remote_snapshots.pop(jid, None)
+
+    def _finish(self, job_id: str) -> None:
+        """完了/失敗を送ったジョブの購読を破棄（以降はストアを確認しない）"""
+        self._subscribers.pop(job_id, None)
+        self._remote_snapshots.pop(job_id, None)
+        self._last_sent.pop(job_id, None)
+
+    def publish(self, job_id: str, fields: Dict[str, Any]) -> None:
+        """更新を集約キューへ入れる（任意のスレッドから呼べる）"""
+        loop = self._loop
+        if loop is None or job_id not in self._subscribers:
+            return
+        with self._lock:
+            self._pending.setdefault(job_id, {}).update(fields)
+            if job_id in self._scheduled:
+                return
+            self._scheduled.add(job_id)
+            elapsed = time.monotonic() - self._last_sent.get(job_id, 0.0)
+            delay = 0.0 if fields.get("status") in TERMINAL_STATUSES else max(0.0, self.interval - elapsed)
+        loop.call_soon_threadsafe(loop.call_later, delay, self._flush, job_id)
+
+    def _flush(self, job_id: str) -> None:
+        with self._lock:
+            self._scheduled.discard(job_id)
+            fields = self._pending.pop(job_id, None)
+            if not fields:
+                return
+            self._last_sent[job_id] = time.monotonic()
+        if fields.get("status") in TERMINAL_STATUSES:
+            self._finish(job_id)
+        asyncio.create_task(self._send(job_id, fields))
+
+    async def _send(self, job_id: str, fields: Dict[str, Any]) -> None:
+        try:
+            await self._emit(job_id, dict(fields, job_id=job_id))
+        except Exception as e:
+            system_logger.error(
+                "Job progress push failed",
+                event_type=EventType.SYSTEM_ERROR,
+                job_id=job_id,
+                error=str(e)
+            )
+
+    async def snapshot(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """購読開始時の現在状態を返す"""
+        record = await asyncio.to_thread(self.store.get, job_id)
+        if record is not None:
+            self._remote_snapshots[job_id] = record
+        return record
+
+    async def _watch_remote(self) -> None:
+        # 自Podで更新が流れていない購読ジョブはストアの変化を見て送信する
+        while True:
+            try:
+                await asyncio.sleep(REMOTE_POLL_INTERVAL)
+                now = time.monotonic()
+                for job_id in list(self._subscribers):
+                    snapshot = self._remote_snapshots.get(job_id)
+                    if snapshot is not None and snapshot.get("status") in TERMINAL_STATUSES:
+                        # 購読開始時点で完了済みのジョブ（状態は snapshot() で送信済み）
+                        self._finish(job_id)
+                        continue
+                    if now - self._last_sent.get(job_id, 0.0) < REMOTE_POLL_INTERVAL * 2:
+                        continue
+                    record = await asyncio.to_thread(self.store.get, job_id)
+                    if record is None:
+                        # 保持期間を過ぎて削除されたジョブ
+                        self._finish(job_id)
+                        continue
+                    if record == snapshot:
+                        continue
+                    self._remote_snapshots[job_id] = record
+                    await self._send(job_id, record)
+                    if record.get("status") in TERMINAL_STATUSES:
+                        self._finish(job_id)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                system_logger.error(
+                    "Job progress watch error",
+                    event_type=EventType.SYSTEM_ERROR,
+                    error=str(e)
+                )
@@ -1,19 +1,24 @@
 """
 ログコレクト機能専用のAPIルーター
 """
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
 from typing import Dict, Any, List, Optional
 from pydantic import BaseModel
 import asyncio
+import functools
+import json
 import uuid
 from datetime import datetime
 
-from core.broker_col import CollectLogGateway
-from core.common import connect_ssh
+from core.broker_col import CollectLogGateway, CollectionAborted, TRANSFER_MODES
+from core.col_archive import available_formats, media_type, validate_level
+from core.col_search import compile_query
+from core.common import connect_ssh, get_cvmlist
 from fastapi_app.utils.error_handler import handle_api_error, create_success_response, create_error_response
 from fastapi_app.utils.cache import SimpleTTLCache
 from fastapi_app.utils.structured_logger import api_logger, EventType, log_execution_time
+from fastapi_app.job_queue import CollectionJobStore, CollectionJobQueue, JobProgressNotifier, JobLeaseLost
 
 # ルーターの作成
 router = APIRouter(prefix="/api/col", tags=["collect-log"])
@@ -22,15 +27,25 @@ router = APIRouter(prefix="/api/col", tags=["collect-log"])
 col = CollectLogGateway()
 cache = SimpleTTLCache()
 
-# ジョブ管理用の辞書
-collection_jobs: Dict[str, Dict[str, Any]] = {}
+# ジョブ管理（出力PVC上のSQLite。実行は各Podのワーカースロットで順次。複数レプリカで共有するには RWX が必要）
+job_store = CollectionJobStore()
+job_queue = CollectionJobQueue(job_store)
+# 進捗のプッシュ通知（Socket.IO の送信関数は app_fastapi 起動時に登録）
+job_notifier = JobProgressNotifier(job_store)
 
 # ========================================
 # Pydantic Models
 # ========================================
 
 class LogCollectionRequest(BaseModel):
-    cvm: str
+    cvm: Optional[str] = None
+    cluster_name: Optional[str] = None  # 指定時はクラスター内の全CVMから収集
+    concurrency: Optional[int] = None  # SFTP同時ダウンロード数（未指定時は環境変数の既定値）
+    max_parallel_cvms: Optional[int] = None  # クラスター収集時の同時CVM数
+    archive_format: Optional[str] = None  # zip / store / tar.zst / tar.lz4（未指定時は COLLECT_ARCHIVE_FORMAT）
+    compress_level: Optional[int] = None  # 圧縮レベル（未指定時は形式ごとの既定値）
+    incremental: Optional[bool] = None  # 前回収集分との差分のみ転送（未指定時は COLLECT_INCREMENTAL）
+    transfer_mode: Optional[str] = None  # sftp / gzip（未指定時は COLLECT_TRANSFER_MODE）
 
 class LogDisplayRequest(BaseModel):
     log_file: str
@@ -40,36 +55,67 @@ class LogDisplayRequest(BaseModel):
     page: int | None = None   # ページ番号（1から開始）
     page_size: int | None = None # ページサイズ（デフォルト: 1000行）
 
+class LogSearchRequest(BaseModel):
+    query: str
+    zip_name: Optional[str] = None  # 未指定時は全バンドルを検索
+    regex: bool = False
+    ignore_case: bool = False
+    context: int = 0  # 前後に付ける行数（最大5）
+    max_results: int = 1000  # ヒット件数の上限（最大10000）
+    use_index: bool = True  # trigram インデックスがあれば候補ファイルを絞り込む
+
 
 # ========================================
 # Background Task Functions
 # ========================================
 
-async def run_log_collection(job_id: str, cvm: str) -> None:
-    """バックグラウンドでログ収集を実行"""
+async def run_log_collection(
+    job_id: str,
+    cvm: Optional[str],
+    concurrency: Optional[int] = None,
+    cluster_name: Optional[str] = None,
+    max_parallel_cvms: Optional[int] = None,
+    archive_format: Optional[str] = None,
+    compress_level: Optional[int] = None,
+    incremental: Optional[bool] = None,
+    transfer_mode: Optional[str] = None,
+    cvms: Optional[List[str]] = None,
+) -> None:
+    """ワーカースロットでログ収集を実行（cluster_name 指定時は全CVMへファンアウト）
+
+    cvms は投入時に解決したクラスターのCVM一覧（ジョブの直列化に使ったものと同じ一覧で収集する）。
+    """
+    data = None
     try:
-        collection_jobs[job_id]["status"] = "running"
-        collection_jobs[job_id]["started_at"] = datetime.now().isoformat()
-        
         # 進捗情報を初期化
-        collection_jobs[job_id]["progress"] = {
-            "stage": "init",
-            "current": 0,
-            "total": 100,
-            "message": "ログ収集を開始しています..."
-        }
+        await asyncio.to_thread(
+            job_store.update, job_id,
+            status="running",
+            started_at=datetime.now().isoformat(),
+            progress={
+                "stage": "init",
+                "current": 0,
+                "total": 100,
+                "message": "ログ収集を開始しています..."
+            }
+        )
         
         api_logger.info(
             "Background log collection started",
             event_type=EventType.DATA_CREATE,
             job_id=job_id,
-            cvm=cvm
+            cvm=cvm,
+            cluster_name=cluster_name
         )
         
         # 進捗コールバック関数
         def progress_callback(progress_info):
-            """進捗情報を更新"""
-            collection_jobs[job_id]["progress"] = progress_info
+            """進捗情報を更新（収集スレッドから呼ばれる）"""
+            try:
+                job_store.update_progress(job_id, progress_info)
+            except JobLeaseLost as e:
+                # 再投入されたジョブは収集を打ち切る（バンドルも破棄される）
+                raise CollectionAborted(str(e)) from e
             api_logger.info(
                 f"Log collection progress: {progress_info.get('message')}",
                 event_type=EventType.DATA_CREATE,
@@ -80,71 +126,172 @@ async def run_log_collection(job_id: str, cvm: str) -> None:
         
         # 同期的な処理を別スレッドで実行（イベントループをブロックしない）
         loop = asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, col.collect_logs, cvm, progress_callback)
+        if cluster_name:
+            if not cvms:
+                cluster_data = await loop.run_in_executor(None, get_cvmlist, cluster_name)
+                cvms = list(cluster_data.get("cvms_ip", []))
+                if not cvms:
+                    raise Exception(f"No CVMs found for cluster {cluster_name}")
+                await asyncio.to_thread(job_store.update, job_id, cvms=cvms)
+            data = await loop.run_in_executor(None, functools.partial(
+                col.collect_cluster_logs, cvms, progress_callback,
+                max_workers=concurrency,
+                max_parallel=max_parallel_cvms,
+                archive_format=archive_format,
+                compress_level=compress_level,
+                incremental=incremental,
+                transfer_mode=transfer_mode,
+            ))
+        else:
+            data = await loop.run_in_executor(None, functools.partial(
+                col.collect_logs, cvm, progress_callback,
+                max_workers=concurrency,
+                archive_format=archive_format,
+                compress_level=compress_level,
+                incremental=incremental,
+                transfer_mode=transfer_mode,
+            ))
         
         # ログ収集完了後、Collect Log関連のキャッシュをクリア
         cleared_count = cache.clear_by_pattern(r"^col:")
         
-        collection_jobs[job_id]["status"] = "completed"
-        collection_jobs[job_id]["completed_at"] = datetime.now().isoformat()
-        collection_jobs[job_id]["result"] = data
+        await asyncio.to_thread(
+            job_store.update, job_id,
+            status="completed",
+            completed_at=datetime.now().isoformat(),
+            result=data
+        )
         
         api_logger.info(
             "Background log collection completed",
             event_type=EventType.DATA_CREATE,
             job_id=job_id,
             cvm=cvm,
+            cluster_name=cluster_name,
             cache_cleared=cleared_count
         )
         
+    except (JobLeaseLost, CollectionAborted) as e:
+        # 再投入されたジョブは別のワーカーが実行するため、結果を書き込まずに終了する
+        # （収集完了後に所有を失った場合は、作成済みのバンドルを再実行分と重複させない）
+        if data and data.get("zip_name"):
+            await asyncio.to_thread(col.remove_bundle, data["zip_name"])
+        api_logger.warning(
+            "Background log collection abandoned",
+            event_type=EventType.API_ERROR,
+            job_id=job_id,
+            cvm=cvm,
+            cluster_name=cluster_name,
+            error=str(e)
+        )
+        
     except Exception as e:
-        collection_jobs[job_id]["status"] = "failed"
-        collection_jobs[job_id]["error"] = str(e)
-        collection_jobs[job_id]["completed_at"] = datetime.now().isoformat()
+        try:
+            await asyncio.to_thread(
+                job_store.update, job_id,
+                status="failed",
+                error=str(e),
+                completed_at=datetime.now().isoformat()
+            )
+        except JobLeaseLost:
+            pass
         
         api_logger.error(
             "Background log collection failed",
             event_type=EventType.API_ERROR,
             job_id=job_id,
             cvm=cvm,
+            cluster_name=cluster_name,
             error=str(e)
         )
 
+job_queue.set_runner(run_log_collection)
+
 # ========================================
 # API Endpoints
 # ========================================
 
 @router.post("/getlogs", response_model=Dict[str, Any])
 @log_execution_time(api_logger)
-async def collect_logs(request: LogCollectionRequest, background_tasks: BackgroundTasks) -> Dict[str, Any]:
-    """ログ収集API（非同期実行）"""
+async def collect_logs(request: LogCollectionRequest) -> Dict[str, Any]:
+    """ログ収集API（ジョブキューへ投入し、空きワーカースロットで実行）"""
+    if not request.cvm and not request.cluster_name:
+        raise HTTPException(status_code=400, detail="cvm or cluster_name is required")
+    if request.archive_format and request.archive_format not in available_formats():
+        raise HTTPException(
+            status_code=400,
+            detail=f"unsupported archive_format: {request.archive_format} (available: {', '.join(available_formats())})"
+        )
+    try:
+        validate_level(request.archive_format, request.compress_level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if request.transfer_mode and request.transfer_mode not in TRANSFER_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"unsupported transfer_mode: {request.transfer_mode} (available: {', '.join(TRANSFER_MODES)})"
+        )
+    # クラスター指定時は投入時にCVM一覧を解決する（実行の直列化と収集に同じ一覧を使う）
+    cvms = [request.cvm]
+    if request.cluster_name:
+        try:
+            cluster_data = await asyncio.to_thread(get_cvmlist, request.cluster_name)
+        except Exception as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        cvms = list(cluster_data.get("cvms_ip") or [])
+        if not cvms:
+            raise HTTPException(status_code=404, detail=f"No CVMs found for cluster {request.cluster_name}")
     try:
         # ジョブIDを生成
         job_id = str(uuid.uuid4())
         
         # ジョブ情報を初期化
-        collection_jobs[job_id] = {
-            "status": "pending",
+        record = {
+            "status": "queued",
             "cvm": request.cvm,
+            "cluster_name": request.cluster_name,
+            "cvms": cvms if request.cluster_name else None,
+            "archive_format": request.archive_format,
+            "incremental": request.incremental,
+            "transfer_mode": request.transfer_mode,
             "created_at": datetime.now().isoformat(),
             "started_at": None,
             "completed_at": None,
             "result": None,
-            "error": None
+            "error": None,
+            "progress": {
+                "stage": "queued",
+                "current": 0,
+                "total": 100,
+                "message": "ログ収集の実行待ちです..."
+            }
         }
+        params = {
+            "cvm": request.cvm,
+            "concurrency": request.concurrency,
+            "cluster_name": request.cluster_name,
+            "max_parallel_cvms": request.max_parallel_cvms,
+            "archive_format": request.archive_format,
+            "compress_level": request.compress_level,
+            "incremental": request.incremental,
+            "transfer_mode": request.transfer_mode,
+            "cvms": cvms if request.cluster_name else None,
+        }
+        # 同じCVMを含む収集は同時に1件まで（CVM単体/クラスター指定を問わない。CVMへの負荷を抑える）
+        await asyncio.to_thread(job_store.create, job_id, cvms, params, record)
         
         api_logger.info(
             "Log collection job created",
             event_type=EventType.DATA_CREATE,
             job_id=job_id,
-            cvm=request.cvm
+            cvm=request.cvm,
+            cluster_name=request.cluster_name
         )
         
-        # バックグラウンドタスクとして実行
-        background_tasks.add_task(run_log_collection, job_id, request.cvm)
+        job_queue.notify()
         
         return create_success_response(
-            {"job_id": job_id, "status": "pending"},
+            {"job_id": job_id, "status": "queued"},
             "ログ収集を開始しました"
         )
     except Exception as e:
@@ -160,10 +307,10 @@ async def collect_logs(request: LogCollectionRequest, background_tasks: Backgrou
 async def get_job_status(job_id: str) -> Dict[str, Any]:
     """ログ収集ジョブのステータス確認API"""
     try:
-        if job_id not in collection_jobs:
+        job = await asyncio.to_thread(job_store.get, job_id)
+        if job is None:
             raise HTTPException(status_code=404, detail="Job not found")
         
-        job = collection_jobs[job_id]
         return create_success_response(job, "ジョブステータスを取得しました")
     except HTTPException:
         raise
@@ -283,9 +430,59 @@ async def get_cache_stats() -> Dict[str, Any]:
     except Exception as e:
         raise handle_api_error(e, "キャッシュ統計情報取得")
 
+@router.post("/search")
+async def search_logs(request: LogSearchRequest):
+    """バンドル内ログ検索API（NDJSONで1行1件ストリーミング）"""
+    try:
+        compile_query(request.query, request.regex, request.ignore_case)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if request.zip_name and request.zip_name not in col.get_ziplist():
+        raise HTTPException(status_code=404, detail="File not found")
+
+    api_logger.info(
+        "Log search started",
+        event_type=EventType.DATA_READ,
+        zip_name=request.zip_name,
+        regex=request.regex
+    )
+
+    def _ndjson():
+        results = col.search_logs(
+            request.query,
+            zip_name=request.zip_name,
+            regex=request.regex,
+            ignore_case=request.ignore_case,
+            context=request.context,
+            max_results=min(10000, max(1, request.max_results)),
+            use_index=request.use_index,
+        )
+        try:
+            for item in results:
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            results.close()
+
+    # 同期ジェネレーターはスレッドプール上で反復される（イベントループをブロックしない）
+    return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+
+@router.post("/search/index/{zip_name}", response_model=Dict[str, Any])
+async def build_search_index(zip_name: str) -> Dict[str, Any]:
+    """バンドルの検索用 trigram インデックス作成API"""
+    if zip_name not in col.get_ziplist():
+        raise HTTPException(status_code=404, detail="File not found")
+    try:
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(None, col.build_search_index, zip_name)
+        if 'error' in data:
+            raise HTTPException(status_code=404, detail=data['error'])
+        return create_success_response(data, "検索インデックスを作成しました")
+    except Exception as e:
+        raise handle_api_error(e, "検索インデックス作成")
+
 @router.get("/download/{zip_name}")
 async def download_zip(zip_name: str):
-    """ZIPダウンロードAPI"""
+    """ZIPダウンロードAPI（tar.zst / tar.lz4 バンドルも同じエンドポイントで配信）"""
     try:
         zip_path = col.download_zip(zip_name)
         if not zip_path:
@@ -293,7 +490,7 @@ async def download_zip(zip_name: str):
         return FileResponse(
             path=zip_path,
             filename=zip_name,
-            media_type='application/zip'
+            media_type=media_type(zip_name)
         )
     except Exception as e:
         raise handle_api_error(e, "ZIPダウンロード")
@@ -0,0 +1,138 @@
+"""
+リアルタイムログ（tail）のサーバー側フィルタ
+start_tail_f で指定された正規表現・重要度で行を絞り込み、一致位置（ハイライト用）を返す
+"""
+import re
+from typing import Dict, Iterable, List, Optional
+
+
+# 重要度の並び（severity には列挙またはこの名前を指定）
+SEVERITY_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+_SEVERITY_ALIASES = {
+    'D': 'DEBUG', 'DEBUG': 'DEBUG',
+    'I': 'INFO', 'INFO': 'INFO',
+    'W': 'WARNING', 'WARN': 'WARNING', 'WARNING': 'WARNING',
+    'E': 'ERROR', 'ERROR': 'ERROR',
+    'F': 'CRITICAL', 'FATAL': 'CRITICAL', 'CRITICAL': 'CRITICAL',
+}
+# glog 形式（例: "E20251009 12:00:00.123456 ..."）
+_GLOG_RE = re.compile(r'^([IWEF])\d{4}[ \d]')
+# 一般的なログ形式（例: "2025-10-09 12:00:00,123Z ERROR ..."）
+_LEVEL_RE = re.compile(r'\b(DEBUG|INFO|WARN(?:ING)?|ERROR|CRITICAL|FATAL)\b')
+# 1行あたり返す一致位置の上限
+MAX_SPANS = 32
+
+
+def detect_severity(line: str) -> Optional[str]:
+    """行頭付近から重要度を判定（判定できなければ None）"""
+    m = _GLOG_RE.match(line)
+    if m:
+        return _SEVERITY_ALIASES[m.group(1)]
+    m = _LEVEL_RE.search(line, 0, 128)
+    if m:
+        return _SEVERITY_ALIASES[m.group(1)]
+    return None
+
+
+class LineFilter:
+    """include / exclude の正規表現と重要度で行を絞り込む
+
+    正規表現は生成時に1回だけコンパイルする。重要度を判定できない行
+    （スタックトレースの続き等）は同じ送信元の直前の行の重要度を引き継ぐため、購読者ごとに1つ作る。
+    """
+
+    def __init__(self, include: Optional[str] = None, exclude: Optional[str] = None,
+                 severity: Optional[Iterable[str]] = None, ignore_case: bool = False):
+        flags = re.IGNORECASE if ignore_case else 0
+        self.include = self._compile(include, flags, 'include')
+        self.exclude = self._compile(exclude, flags, 'exclude')
+        self.severity = self._levels(severity)
+        # 送信元（複数ログの同時 tail 時のラベル）ごとの直前の重要度
+        self._last_levels: Dict[Optional[str], Optional[str]] = {}
+
+    @staticmethod
+    def _compile(pattern: Optional[str], flags: int, label: str):
+        if not pattern:
+            return None
+        try:
+            return re.compile(pattern, flags)
+        except re.error as e:
+            raise ValueError(f"invalid {label} regex: {e}")
+
+    @staticmethod
+    def _levels(severity) -> Optional[set]:
+        if not severity:
+            return None
+        if isinstance(severity, str):
+            severity = [severity]
+        levels = set()
+        for name in severity:
+            level = _SEVERITY_ALIASES.get(str(name).upper())
+            if level is None:
+                raise ValueError(f"invalid severity: {name} (使用可能: {', '.join(SEVERITY_LEVELS)})")
+            levels.add(level)
+        return levels
+
+    @classmethod
+    def from_request(cls, data: dict) -> Optional["LineFilter"]:
+        """start_tail_f のデータから作成（指定が無ければ None、不正な指定は ValueError）"""
+        data = data or {}
+        line_filter = cls(
+            include=data.get('include'),
+            exclude=data.get('exclude'),
+            severity=data.get('severity'),
+            ignore_case=bool(data.get('ignore_case')),
+        )
+        return line_filter if line_filter.active else None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.include or self.exclude or self.severity)
+
+    @property
+    def highlights(self) -> bool:
+        """一致位置を返すか（include 指定時のみ）"""
+        return self.include is not None
+
+    def match(self, line: str, source: Optional[str] = None) -> Optional[List[List[int]]]:
+        """送信対象なら include の一致位置 [[開始, 終了], ...]（無指定なら空リスト）、対象外なら None"""
+        if self.severity is not None:
+            level = detect_severity(line)
+            if level is None:
+                level = self._last_levels.get(source)
+            else:
+                self._last_levels[source] = level
+            if level not in self.severity:
+                return None
+        if self.exclude is not None and self.exclude.search(line):
+            return None
+        if self.include is None:
+            return []
+        found = False
+        spans = []
+        for m in self.include.finditer(line):
+            found = True
+            if m.end() > m.start():
+                spans.append([m.start(), m.end()])
+                if len(spans) >= MAX_SPANS:
+                    break
+        return spans if found else None
+
+    def spans(self, line: str) -> List[List[int]]:
+        """行内の include の一致位置（重要度の状態を更新しない）"""
+        if self.include is None:
+            return []
+        spans = []
+        for m in self.include.finditer(line):
+            if m.end() > m.start():
+                spans.append([m.start(), m.end()])
+                if len(spans) >= MAX_SPANS:
+                    break
+        return spans
+
+    def describe(self) -> dict:
+        return {
+            'include': self.include.pattern if self.include else None,
+            'exclude': self.exclude.pattern if self.exclude else None,
+            'severity': sorted(self.severity, key=SEVERITY_LEVELS.index) if self.severity else None,
+        }
@@ -0,0 +1,167 @@
+"""
+複数ログ（クラスタ全CVM等）の tail を行頭のタイムスタンプ順にまとめる
+到着から一定時間（並べ替えウィンドウ）だけ行を保持し、ヒープで時刻の古い順に取り出す
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import re
+import time
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+
+# 並べ替えのために行を保持する時間（ミリ秒）。CVM 間の到着の遅れをこの範囲で吸収する
+REORDER_WINDOW_MS = int(os.getenv("RTLOG_REORDER_WINDOW_MS", "500"))
+# 保持する行数の上限（超えた分はウィンドウを待たずに古い順に送る）
+REORDER_MAX_LINES = int(os.getenv("RTLOG_REORDER_MAX_LINES", "10000"))
+
+# glog 形式（例: "E20251009 12:00:00.123456 ..." / "E1009 12:00:00.123456 ..."）
+_GLOG_TS_RE = re.compile(r'^[IWEF](\d{4})?(\d{2})(\d{2}) (\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?')
+# ISO 形式（例: "2025-10-09 12:00:00,123Z ..." / "2025-10-09T12:00:00.123456+00:00 ..."）
+_ISO_TS_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:[.,](\d{1,6}))?')
+
+
+def parse_timestamp(line: str) -> Optional[float]:
+    """行頭のタイムスタンプを UNIX 時刻（秒）で返す（読めなければ None）
+
+    タイムゾーン表記は無視し、ローカル時刻として扱う（CVM 同士の比較にのみ使う）。
+    年の無い glog 形式は現在の年とみなす。
+    """
+    m = _GLOG_TS_RE.match(line)
+    if m:
+        year = int(m.group(1)) if m.group(1) else datetime.now().year
+        month, day = int(m.group(2)), int(m.group(3))
+    else:
+        m = _ISO_TS_RE.match(line)
+        if not m:
+            return None
+        year, month, day = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    try:
+        ts = datetime(year, month, day, int(m.group(4)), int(m.group(5)), int(m.group(6))).timestamp()
+    except ValueError:
+        return None
+    fraction = m.group(7)
+    if fraction:
+        ts += int(fraction) / (10 ** len(fraction))
+    return ts
+
+
+class ReorderBuffer:
+    """送信元ごとの行を、並べ替えウィンドウ内でタイムスタンプ順に並べ直して sink へ渡す
+
+    offer() で受け取った行は到着から window_ms 経過するまでヒープに保持する。
+    いずれかの行が期限を過ぎたら、その行が出るまでヒープ先頭（最も古い時刻）から順に
+    sink(先頭seq, lines, 送信元) へ渡す。期限は行ごとの到着時刻で判定するため、時計の遅れた
+    送信元の行が先頭に居座っても、他の送信元の行はウィンドウを過ぎた時点で送られる。
+    タイムスタンプの無い行（スタックトレースの続き等）や時刻が戻った行は、同じ送信元の
+    直前の行の時刻を使うため、送信元内の順序は変わらない。ウィンドウより遅れて届いた行は
+    そのまま送る（おおよその時刻順）。
+    """
+
+    def __init__(self, sink: Callable[[int, List[str], Optional[str]], Awaitable[None]],
+                 window_ms: Optional[int] = None, max_lines: Optional[int] = None):
+        self._sink = sink
+        self.window = (REORDER_WINDOW_MS if window_ms is None else window_ms) / 1000.0
+        self.max_lines = max(1, max_lines or REORDER_MAX_LINES)
+        # (時刻, 到着順, 到着時刻, 送信元, seq, 行)
+        self._heap: List[Tuple[float, int, float, Optional[str], int, str]] = []
+        self._order = itertools.count()
+        # 未送信の行の (到着時刻, 到着順)（到着順に並ぶ）と、先頭より後ろで送信済みになった到着順
+        self._arrivals: Deque[Tuple[float, int]] = deque()
+        self._gone: Set[int] = set()
+        self._last_ts: Dict[Optional[str], float] = {}
+        self.lines_released = 0
+        self._wakeup = asyncio.Event()
+        self._release_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def start(self) -> "ReorderBuffer":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    @property
+    def held(self) -> int:
+        """並べ替え待ちの行数"""
+        return len(self._heap)
+
+    async def offer(self, first_seq: int, lines: List[str], source: Optional[str] = None) -> None:
+        if self._closed or not lines:
+            return
+        now = time.monotonic()
+        last = self._last_ts.get(source)
+        for seq, line in enumerate(lines, first_seq):
+            ts = parse_timestamp(line)
+            if ts is None or (last is not None and ts < last):
+                ts = last if last is not None else time.time()
+            last = ts
+            order = next(self._order)
+            heapq.heappush(self._heap, (ts, order, now, source, seq, line))
+            self._arrivals.append((now, order))
+        self._last_ts[source] = last
+        if len(self._heap) > self.max_lines:
+            await self._release(len(self._heap) - self.max_lines)
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        try:
+            while not self._closed:
+                if not self._heap:
+                    await self._wakeup.wait()
+                    self._wakeup.clear()
+                    continue
+                # 最も早く届いた未送信の行の期限まで待つ
+                due = self._arrivals[0][0] + self.window - time.monotonic()
+                if due > 0:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), due)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._release()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"[RTLOG] 並べ替えエラー: {e}")
+
+    async def _release(self, count: Optional[int] = None) -> None:
+        """ウィンドウを過ぎた行と、それより時刻の古い行（count 指定時は先頭から count 行）を時刻順に sink へ渡す"""
+        async with self._release_lock:
+            deadline = time.monotonic() - self.window
+            runs: List[Tuple[int, List[str], Optional[str]]] = []
+            released = 0
+            while self._heap and (released < count if count is not None
+                                  else self._arrivals and self._arrivals[0][0] <= deadline):
+                _, order, _, source, seq, line = heapq.heappop(self._heap)
+                released += 1
+                self._gone.add(order)
+                while self._arrivals and self._arrivals[0][1] in self._gone:
+                    self._gone.discard(self._arrivals.popleft()[1])
+                # 同じ送信元の連続した seq はまとめて渡す
+                if runs and runs[-1][2] == source and runs[-1][0] + len(runs[-1][1]) == seq:
+                    runs[-1][1].append(line)
+                else:
+                    runs.append((seq, [line], source))
+            self.lines_released += released
+            for first_seq, lines, source in runs:
+                await self._sink(first_seq, lines, source)
+
+    async def close(self, flush: bool = True) -> None:
+        """保持中の行を送り（flush=False なら捨てる）、停止する"""
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if flush:
+            await self._release(len(self._heap))
+        self._heap.clear()
+        self._arrivals.clear()
+        self._gone.clear()
@@ -0,0 +1,663 @@
+"""
+リアルタイムログ（tail）のストリーム処理
+SSHチャネルの読み込みを専用スレッドで行い、イベントループへ行単位で受け渡す
+1つのリモート tail を (CVM, ログパス) ごとに共有し、複数の購読者へ配信する
+購読者への送信は一定時間・一定行数ごとにまとめて1メッセージ（log_batch）にする
+送信が追いつかない購読者の分はディスクへ退避し、行を捨てずにスキップ範囲として通知する
+複数のストリームを1購読者へまとめる場合は、行ごとに送信元のラベルを付けて送る（時刻順の並べ替えも可能）
+"""
+import asyncio
+import concurrent.futures
+import os
+import shlex
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from fastapi_app.tail_filter import LineFilter
+from fastapi_app.tail_merge import ReorderBuffer
+
+
+# 1回の recv で読むバイト数
+RECV_BYTES = 65536
+# 1行の最大バイト数（改行が来ないまま超えた分は切り詰め、次の改行まで読み捨てる）
+MAX_LINE_BYTES = int(os.getenv("RTLOG_MAX_LINE_BYTES", str(64 * 1024)))
+TRUNCATED_MARK = " [truncated]"
+# リーダースレッドが停止要求を確認する間隔（秒、データ待ちのタイムアウト）
+READER_POLL_SECONDS = 1.0
+# イベントループ側に溜める行バッチ数の上限（超えるとリーダースレッドが待機し、SSHウィンドウで送信元を抑える）
+READER_QUEUE_BATCHES = int(os.getenv("RTLOG_READER_QUEUE_BATCHES", "256"))
+# tail 開始時に送る過去の行数（tail -n）
+HISTORY_LINES = int(os.getenv("RTLOG_HISTORY_LINES", "20"))
+# 途中から参加した購読者へ送る直近の行数
+RING_LINES = int(os.getenv("RTLOG_RING_LINES", "200"))
+# 再接続したクライアントが seq 指定で再開できるよう、ストリームごとに保持する行数
+RETAIN_LINES = max(RING_LINES, int(os.getenv("RTLOG_RETAIN_LINES", "2000")))
+# 切断で購読者がいなくなったストリームを再開待ちのため維持する時間（秒、0 なら即停止）
+RESUME_GRACE_SECONDS = float(os.getenv("RTLOG_RESUME_GRACE_SECONDS", "30"))
+# log_batch を送信する間隔（ミリ秒）と1メッセージあたりの最大行数
+BATCH_INTERVAL_MS = int(os.getenv("RTLOG_BATCH_INTERVAL_MS", "100"))
+BATCH_MAX_LINES = int(os.getenv("RTLOG_BATCH_MAX_LINES", "500"))
+# クライアントの ack を待たずに送れる log_batch 数と、ack を待つ上限（秒）
+MAX_INFLIGHT_BATCHES = int(os.getenv("RTLOG_MAX_INFLIGHT_BATCHES", "4"))
+ACK_TIMEOUT = float(os.getenv("RTLOG_ACK_TIMEOUT", "10"))
+# 購読者ごとにメモリに溜める送信待ち行数（超えた分はディスクへ退避）
+SUBSCRIBER_BUFFER_LINES = int(os.getenv("RTLOG_SUBSCRIBER_BUFFER_LINES", "5000"))
+# 退避ファイルの置き場所と購読者ごとの上限（超えた分は破棄して lost として通知）
+SPILL_DIR = os.getenv("RTLOG_SPILL_DIR", tempfile.gettempdir())
+SPILL_MAX_BYTES = int(os.getenv("RTLOG_SPILL_MAX_BYTES", str(64 * 1024 * 1024)))
+# fetch_log_range 1回で返す最大行数
+FETCH_MAX_LINES = int(os.getenv("RTLOG_FETCH_MAX_LINES", "2000"))
+# 1回の start_tail_f でまとめて tail できるログ（CVM × ログパス）の上限
+MAX_SOURCES = int(os.getenv("RTLOG_MAX_SOURCES", "16"))
+
+
+class ChannelLineReader:
+    """paramiko チャネルを専用スレッドで読み、行のリストを asyncio.Queue へ渡す
+
+    イベントループ上では `async for lines in reader` で受信順に行のリストを受け取る。
+    データが無い間はスレッドが recv で待機するだけで、ループ側はポーリングしない。
+    """
+
+    def __init__(self, channel, name: str = "tail-reader"):
+        self.channel = channel
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.error: Optional[str] = None
+
+    def start(self) -> "ChannelLineReader":
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=READER_QUEUE_BATCHES)
+        self.channel.settimeout(READER_POLL_SECONDS)
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        pending = b""
+        skipping = False
+        try:
+            while not self._stop.is_set():
+                # stderr を読み捨ててウィンドウ詰まりを防ぐ
+                while self.channel.recv_stderr_ready():
+                    self.channel.recv_stderr(RECV_BYTES)
+                try:
+                    data = self.channel.recv(RECV_BYTES)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                if skipping:
+                    # 切り詰めた行の残りを次の改行まで読み捨てる
+                    cut = data.find(b"\n")
+                    if cut < 0:
+                        continue
+                    data, skipping = data[cut + 1:], False
+                pending += data
+                lines = []
+                cut = pending.rfind(b"\n")
+                if cut >= 0:
+                    chunk, pending = pending[:cut], pending[cut + 1:]
+                    lines = [self._decode(line) for line in chunk.split(b"\n")]
+                if len(pending) > MAX_LINE_BYTES:
+                    # 改行の無いまま上限を超えた行は先頭だけを送り、バッファを伸ばし続けない
+                    lines.append(self._decode(pending))
+                    pending, skipping = b"", True
+                if lines and not self._put(lines):
+                    return
+            if pending and not self._stop.is_set():
+                self._put([self._decode(pending)])
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self._put(None)
+
+    @staticmethod
+    def _decode(raw: bytes) -> str:
+        if len(raw) > MAX_LINE_BYTES:
+            return raw[:MAX_LINE_BYTES].decode("utf-8", errors="replace") + TRUNCATED_MARK
+        return raw.decode("utf-8", errors="replace").rstrip("\r")
+
+    def _put(self, item) -> bool:
+        """ループ側のキューへ渡す（満杯なら空くまでこのスレッドで待つ）"""
+        if self._loop is None or self._loop.is_closed():
+            return False
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+        while True:
+            try:
+                future.result(timeout=READER_POLL_SECONDS)
+                return True
+            except concurrent.futures.TimeoutError:
+                if self._stop.is_set():
+                    future.cancel()
+                    return False
+            except Exception:
+                return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> List[str]:
+        if self._queue is None:
+            raise StopAsyncIteration
+        item = await self._queue.get()
+        if item is None:
+            raise StopAsyncIteration
+        return item
+
+    def close(self) -> None:
+        """停止要求を出してチャネルを閉じる（スレッドは recv タイムアウト以内に終了する）"""
+        self._stop.set()
+        try:
+            self.channel.close()
+        except Exception:
+            pass
+
+
+class TailStream:
+    """1つのリモート tail -f（cvm_ip, log_path）を複数の購読者（sid）へ配信する
+
+    受信した行にはストリーム内で単調増加する seq を振り、直近 RETAIN_LINES 行を保持する。
+    購読者ごとに handler(先頭seq, lines) を登録して受信順に渡す。新規の購読者には直近
+    RING_LINES 行を、再接続した購読者には指定 seq の次からの行を最初に送る。
+    最後の購読者が抜けたら close() でリモートの tail とSSHリースを解放する。
+    SSHリースは生成時に渡すか、接続を待つ間に参加を受け付けたい場合は start() で渡す。
+    handler が例外を出した購読者は外し、on_dropped(stream, sid, 例外) で呼び出し元へ知らせる。
+    """
+
+    def __init__(self, cvm_ip: str, log_path: str, ssh_connection=None,
+                 on_closed: Optional[Callable[["TailStream"], None]] = None,
+                 on_dropped: Optional[Callable[["TailStream", str, Exception], None]] = None):
+        self.cvm_ip = cvm_ip
+        self.log_path = log_path
+        self.key = (cvm_ip, log_path)
+        # 再開時に同じストリーム（同じ seq 系列）かを確認するためのID
+        self.stream_id = uuid.uuid4().hex[:12]
+        self.subscribers: Dict[str, Callable[[int, List[str]], Awaitable[None]]] = {}
+        self.retained: Deque[Tuple[int, str]] = deque(maxlen=RETAIN_LINES)
+        self.seq = 0
+        self.lines_received = 0
+        self.started_at = time.time()
+        self.closed = False
+        self._ssh = ssh_connection
+        self._on_closed = on_closed
+        self._on_dropped = on_dropped
+        self._reader: Optional[ChannelLineReader] = None
+        self._task: Optional[asyncio.Task] = None
+        self._linger_task: Optional[asyncio.Task] = None
+
+    async def start(self, ssh_connection=None) -> None:
+        """直近 HISTORY_LINES 行と以降の追記を1本のチャネルで受け取る（ローテーションにも追従）"""
+        if ssh_connection is not None:
+            self._ssh = ssh_connection
+        if self.closed:
+            raise RuntimeError(f"tail stream already closed: {self.cvm_ip}:{self.log_path}")
+        command = f"tail -n {HISTORY_LINES} -F {shlex.quote(self.log_path)}"
+        stdin, stdout, stderr = await asyncio.to_thread(self._ssh.exec_command, command)
+        self._reader = ChannelLineReader(stdout.channel, name=f"rtlog-{self.cvm_ip}").start()
+        self._task = asyncio.create_task(self._pump())
+        print(f"[RTLOG] tail stream started: {self.cvm_ip}:{self.log_path} (id={self.stream_id})")
+
+    def subscribe(self, sid: str, handler: Callable[[int, List[str]], Awaitable[None]],
+                  after_seq: Optional[int] = None) -> Tuple[int, List[str], int]:
+        """購読者を登録し、最初に送る (先頭seq, 行, 保持期間外で再送できない行数) を返す
+
+        after_seq 未指定なら直近 RING_LINES 行、指定時は after_seq より後の保持中の行。
+        """
+        self.subscribers[sid] = handler
+        if self._linger_task is not None:
+            self._linger_task.cancel()
+            self._linger_task = None
+        if after_seq is None:
+            items = list(self.retained)[-RING_LINES:]
+            missed = 0
+        else:
+            after_seq = min(max(0, after_seq), self.seq)
+            items = [item for item in self.retained if item[0] > after_seq]
+            oldest = items[0][0] if items else self.seq + 1
+            missed = max(0, oldest - after_seq - 1)
+        first = items[0][0] if items else self.seq + 1
+        return first, [line for _, line in items], missed
+
+    def unsubscribe(self, sid: str) -> int:
+        """購読を解除し、残りの購読者数を返す"""
+        self.subscribers.pop(sid, None)
+        return len(self.subscribers)
+
+    def linger(self, seconds: float, on_expire: Callable[["TailStream"], Awaitable[None]]) -> None:
+        """購読者がいない状態で seconds 秒経過したら on_expire を呼ぶ（その間に購読されれば取り消す）"""
+        if self._linger_task is not None:
+            self._linger_task.cancel()
+
+        async def expire():
+            try:
+                await asyncio.sleep(seconds)
+                self._linger_task = None
+                await on_expire(self)
+            except asyncio.CancelledError:
+                pass
+
+        self._linger_task = asyncio.create_task(expire())
+
+    async def _pump(self) -> None:
+        try:
+            async for lines in self._reader:
+                first = self.seq + 1
+                self.seq += len(lines)
+                self.retained.extend(zip(range(first, self.seq + 1), lines))
+                self.lines_received += len(lines)
+                for sid, handler in list(self.subscribers.items()):
+                    try:
+                        await handler(first, lines)
+                    except Exception as e:
+                        print(f"[RTLOG] subscriber dropped: {sid} ({e})")
+                        self.subscribers.pop(sid, None)
+                        if self._on_dropped:
+                            self._on_dropped(self, sid, e)
+            if self._reader.error:
+                print(f"[RTLOG] ログ読み取りエラー: {self.cvm_ip}:{self.log_path} ({self._reader.error})")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if not self.closed:
+                print(f"[RTLOG] tail stream ended: {self.cvm_ip}:{self.log_path}")
+                self._release()
+
+    def _release(self) -> None:
+        self.closed = True
+        if self._linger_task is not None and self._linger_task is not asyncio.current_task():
+            self._linger_task.cancel()
+        self._linger_task = None
+        if self._reader is not None:
+            self._reader.close()
+        if self._ssh is not None:
+            try:
+                self._ssh.close()
+            except Exception:
+                pass
+        if self._on_closed:
+            self._on_closed(self)
+
+    async def close(self) -> None:
+        """リモートの tail を止めてSSHリースを返却する"""
+        if self.closed:
+            return
+        self._release()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        print(f"[RTLOG] tail stream closed: {self.cvm_ip}:{self.log_path} (lines={self.lines_received})")
+
+    def status(self) -> dict:
+        return {
+            'cvm_ip': self.cvm_ip,
+            'log_path': self.log_path,
+            'stream_id': self.stream_id,
+            'seq': self.seq,
+            'retained_from': self.retained[0][0] if self.retained else None,
+            'subscribers': sorted(self.subscribers),
+            'lingering': self._linger_task is not None,
+            'lines_received': self.lines_received,
+            'started_at': self.started_at,
+        }
+
+
+class BatchEmitter:
+    """1購読者（sid）宛ての行をまとめて `log_batch` イベントで送信する
+
+    add() した行は BATCH_INTERVAL_MS 経過か BATCH_MAX_LINES 到達のどちらか早い方で
+    1メッセージとして送る。クライアントの ack 待ちが MAX_INFLIGHT_BATCHES に達すると
+    送信を待つため、行数到達時の add() には遅いクライアントの遅れがそのまま伝わる。
+    tagged=True（複数ログの同時 tail）なら行ごとの送信元ラベル（sources）と、
+    送信元ごとの最後の seq（last_seqs）を送る。
+    """
+
+    def __init__(self, sio, sid: str, name: str,
+                 interval_ms: Optional[int] = None, max_lines: Optional[int] = None,
+                 highlight: bool = False, tagged: bool = False):
+        self.sio = sio
+        self.sid = sid
+        self.name = name
+        # True なら行ごとの一致位置（matches）も送る
+        self.highlight = highlight
+        self.tagged = tagged
+        self.interval = (BATCH_INTERVAL_MS if interval_ms is None else interval_ms) / 1000.0
+        self.max_lines = max(1, max_lines or BATCH_MAX_LINES)
+        self.line_count = 0
+        self.batches_sent = 0
+        self._pending: List[str] = []
+        self._pending_matches: List[List[List[int]]] = []
+        self._pending_seqs: List[int] = []
+        self._pending_sources: List[Optional[str]] = []
+        # 最後に送った行の stream seq（クライアントの再開位置）。tagged なら送信元ごと
+        self.last_seq = 0
+        self.last_seqs: Dict[str, int] = {}
+        self._timer: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._inflight = 0
+        self._window = asyncio.Event()
+
+    @property
+    def inflight(self) -> int:
+        """ack 待ちのメッセージ数"""
+        return self._inflight
+
+    @property
+    def next_line(self) -> int:
+        """次に add() される行の行番号"""
+        return self.line_count + len(self._pending) + 1
+
+    async def add(self, lines: List[str], matches: Optional[List[List[List[int]]]] = None,
+                  seqs: Optional[List[int]] = None, sources: Optional[List[Optional[str]]] = None) -> None:
+        self._pending.extend(lines)
+        self._pending_seqs.extend(seqs or [0] * len(lines))
+        if self.tagged:
+            self._pending_sources.extend(sources or [None] * len(lines))
+        if self.highlight:
+            self._pending_matches.extend(matches or [[] for _ in lines])
+        while len(self._pending) >= self.max_lines:
+            await self.flush(self.max_lines)
+        if self._pending and self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.interval)
+            self._timer = None
+            await self.flush()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"[RTLOG] log_batch送信エラー: {self.sid} ({e})")
+
+    async def flush(self, limit: Optional[int] = None) -> None:
+        async with self._lock:
+            await self._flush_locked(limit)
+
+    async def _flush_locked(self, limit: Optional[int] = None) -> None:
+        if not self._pending:
+            return
+        await self._wait_window()
+        count = len(self._pending) if limit is None else min(limit, len(self._pending))
+        lines, self._pending = self._pending[:count], self._pending[count:]
+        seqs, self._pending_seqs = self._pending_seqs[:count], self._pending_seqs[count:]
+        first = self.line_count + 1
+        self.line_count += len(lines)
+        self.batches_sent += 1
+        payload = {
+            'name': self.name,
+            'lines': lines,
+            'first_line_number': first,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        if self.tagged:
+            sources, self._pending_sources = self._pending_sources[:count], self._pending_sources[count:]
+            for source, seq in zip(sources, seqs):
+                if source is not None and seq > self.last_seqs.get(source, 0):
+                    self.last_seqs[source] = seq
+            payload['sources'] = sources
+            payload['last_seqs'] = dict(self.last_seqs)
+        else:
+            self.last_seq = max(self.last_seq, seqs[-1])
+            payload['last_seq'] = self.last_seq
+        if self.highlight:
+            payload['matches'], self._pending_matches = self._pending_matches[:count], self._pending_matches[count:]
+        await self.sio.emit('log_batch', payload, to=self.sid, callback=self._on_ack)
+
+    async def gap(self, from_line: int, to_line: int, lost: int = 0) -> None:
+        """送信待ちの行を送ってから、from_line〜to_line を送らなかったことを `log_gap` で通知する"""
+        async with self._lock:
+            await self._flush_locked()
+            await self._wait_window()
+            self.line_count = to_line
+            await self.sio.emit('log_gap', {
+                'name': self.name,
+                'from_line': from_line,
+                'to_line': to_line,
+                'skipped': to_line - from_line + 1,
+                'lost': lost,
+            }, to=self.sid, callback=self._on_ack)
+
+    async def _wait_window(self) -> None:
+        """ack 待ちのメッセージ数が上限未満になるまで待つ"""
+        deadline = time.monotonic() + ACK_TIMEOUT
+        while self._inflight >= MAX_INFLIGHT_BATCHES:
+            self._window.clear()
+            try:
+                await asyncio.wait_for(self._window.wait(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                # ack が返らないクライアントで送信を止め続けない
+                print(f"[RTLOG][warn] log_batch ack timeout: {self.sid} (inflight={self._inflight})")
+                self._inflight = 0
+        self._inflight += 1
+
+    def _on_ack(self, *args) -> None:
+        self._inflight = max(0, self._inflight - 1)
+        self._window.set()
+
+    async def close(self) -> None:
+        """タイマーを止めて残りの行を送る"""
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"[RTLOG] log_batch送信エラー: {self.sid} ({e})")
+
+
+class TailSubscriber:
+    """1購読者分の送信バッファ
+
+    ストリームの行は offer() で受け取るだけで送信を待たないため、遅い購読者が
+    ストリームや他の購読者を止めない。送信待ちが SUBSCRIBER_BUFFER_LINES を超えた分は
+    ディスクへ退避し、送信側はその範囲を `log_gap`（スキップ行数と行範囲）として通知する。
+    退避した行は fetch_range() で後から取得できる。
+    line_filter を指定すると、一致した行だけに行番号を振って送る。
+    複数のストリームから offer() される場合は、source に送信元のラベルを渡す。
+    reorder=True なら、送信元をまたいで行頭のタイムスタンプ順に並べ替えてから行番号を振る。
+    """
+
+    def __init__(self, emitter: BatchEmitter, line_filter: Optional[LineFilter] = None,
+                 buffer_lines: Optional[int] = None, spill_max_bytes: Optional[int] = None,
+                 reorder: bool = False):
+        self.emitter = emitter
+        self.sid = emitter.sid
+        self.line_filter = line_filter
+        self.lines_filtered = 0
+        self.buffer_lines = max(1, buffer_lines or SUBSCRIBER_BUFFER_LINES)
+        self.spill_max_bytes = SPILL_MAX_BYTES if spill_max_bytes is None else spill_max_bytes
+        self.lines_spilled = 0
+        self.lines_lost = 0
+        # (行番号, 行, 一致位置, stream seq, 送信元)
+        self._buffer: Deque[Tuple[int, str, List[List[int]], int, Optional[str]]] = deque()
+        self._next_no = 1
+        # 退避した範囲 (先頭行番号, 末尾行番号, ファイル内オフセット, バイト数, 送信元)。オフセット -1 は破棄した範囲
+        self._segments: List[Tuple[int, int, int, int, Optional[str]]] = []
+        self._spill_file = None
+        self._spill_path: Optional[str] = None
+        self._spill_bytes = 0
+        self._reorder = ReorderBuffer(self._accept) if reorder else None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def start(self) -> "TailSubscriber":
+        self._task = asyncio.create_task(self._run())
+        if self._reorder is not None:
+            self._reorder.start()
+        return self
+
+    async def offer(self, first_seq: int, lines: List[str], source: Optional[str] = None) -> None:
+        """行に行番号を振ってバッファへ入れる（満杯ならディスクへ退避）。first_seq は先頭行の stream seq"""
+        if self._reorder is not None:
+            await self._reorder.offer(first_seq, lines, source)
+        else:
+            await self._accept(first_seq, lines, source)
+
+    async def _accept(self, first_seq: int, lines: List[str], source: Optional[str] = None) -> None:
+        if self._closed or not lines:
+            return
+        seqs = range(first_seq, first_seq + len(lines))
+        if self.line_filter is not None:
+            matched, spans, matched_seqs = [], [], []
+            for seq, line in zip(seqs, lines):
+                found = self.line_filter.match(line, source)
+                if found is not None:
+                    matched.append(line)
+                    spans.append(found)
+                    matched_seqs.append(seq)
+            self.lines_filtered += len(lines) - len(matched)
+            lines, seqs = matched, matched_seqs
+            if not lines:
+                return
+        else:
+            spans = [[] for _ in lines]
+        first = self._next_no
+        self._next_no += len(lines)
+        room = max(0, self.buffer_lines - len(self._buffer))
+        if room:
+            self._buffer.extend(zip(range(first, first + room), lines[:room], spans[:room], seqs[:room],
+                                    [source] * min(room, len(lines))))
+        if len(lines) > room:
+            self._spill(first + room, lines[room:], source)
+        self._wakeup.set()
+
+    def _spill(self, first: int, lines: List[str], source: Optional[str] = None) -> None:
+        last = first + len(lines) - 1
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        try:
+            if self._spill_bytes + len(data) > self.spill_max_bytes:
+                raise OSError("spill limit reached")
+            if self._spill_file is None:
+                fd, self._spill_path = tempfile.mkstemp(prefix=f"rtlog-{self.sid[:8]}-", suffix=".spill", dir=SPILL_DIR)
+                self._spill_file = os.fdopen(fd, "ab")
+                print(f"[RTLOG] 送信待ちの行をディスクへ退避: {self.sid} ({self._spill_path})")
+            self._spill_file.write(data)
+        except OSError:
+            self._segments.append((first, last, -1, 0, source))
+            self.lines_lost += len(lines)
+            return
+        self._segments.append((first, last, self._spill_bytes, len(data), source))
+        self._spill_bytes += len(data)
+        self.lines_spilled += len(lines)
+
+    def _lost_between(self, from_line: int, to_line: int) -> int:
+        return sum(
+            min(last, to_line) - max(first, from_line) + 1
+            for first, last, offset, _, _ in self._segments
+            if offset < 0 and last >= from_line and first <= to_line
+        )
+
+    async def _run(self) -> None:
+        try:
+            while not self._closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while not self._closed:
+                    expected = self.emitter.next_line
+                    # バッファ先頭（空なら次に振る番号）より前で未送信の行は退避済み
+                    gap_end = (self._buffer[0][0] if self._buffer else self._next_no) - 1
+                    if gap_end >= expected:
+                        await self.emitter.gap(expected, gap_end, self._lost_between(expected, gap_end))
+                        continue
+                    if not self._buffer:
+                        break
+                    batch, matches, seqs, sources = [], [], [], []
+                    while self._buffer and len(batch) < self.emitter.max_lines and self._buffer[0][0] == expected + len(batch):
+                        _, line, spans, seq, source = self._buffer.popleft()
+                        batch.append(line)
+                        matches.append(spans)
+                        seqs.append(seq)
+                        sources.append(source)
+                    await self.emitter.add(batch, matches, seqs, sources)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"[RTLOG] 購読者への送信エラー: {self.sid} ({e})")
+
+    async def fetch_range(self, from_line: int, to_line: int) -> dict:
+        """退避した行のうち from_line〜to_line を返す（1回あたり FETCH_MAX_LINES 行まで）"""
+        from_line = max(1, from_line)
+        end = min(to_line, from_line + FETCH_MAX_LINES - 1)
+        segments = [seg for seg in self._segments if seg[3] > 0 and seg[1] >= from_line and seg[0] <= end]
+        lines = []
+        if segments and self._spill_file is not None:
+            self._spill_file.flush()
+            try:
+                lines = await asyncio.to_thread(self._read_segments, self._spill_path, segments, from_line, end)
+            except OSError as e:
+                print(f"[RTLOG] 退避ファイル読み込みエラー: {self.sid} ({e})")
+        if self.line_filter is not None and self.line_filter.highlights:
+            for item in lines:
+                item['matches'] = self.line_filter.spans(item['line'])
+        return {
+            'name': self.emitter.name,
+            'from_line': from_line,
+            'to_line': end,
+            'lines': lines,
+            'missing': max(0, end - from_line + 1 - len(lines)),
+            'next_line': end + 1 if end < to_line else None,
+            'requested_to_line': to_line,
+        }
+
+    @staticmethod
+    def _read_segments(path: str, segments, from_line: int, to_line: int) -> List[dict]:
+        lines = []
+        with open(path, "rb") as f:
+            for first, last, offset, length, source in segments:
+                f.seek(offset)
+                chunk = f.read(length).decode("utf-8", errors="replace").split("\n")
+                for no, line in zip(range(first, last + 1), chunk):
+                    if from_line <= no <= to_line:
+                        item = {'line_number': no, 'line': line}
+                        if source is not None:
+                            item['source'] = source
+                        lines.append(item)
+        return lines
+
+    async def close(self, flush: bool = True) -> None:
+        """送信を止め、送信待ちの行を送り（flush=False なら捨てる）、退避ファイルを削除する"""
+        if self._reorder is not None:
+            await self._reorder.close(flush=False)
+        self._closed = True
+        self._wakeup.set()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if flush:
+            await self.emitter.close()
+        if self._spill_file is not None:
+            try:
+                self._spill_file.close()
+                os.remove(self._spill_path)
+            except OSError:
+                pass
+            self._spill_file = None
+
+    def status(self) -> dict:
+        return {
+            'buffered': len(self._buffer),
+            'lines_filtered': self.lines_filtered,
+            'filter': self.line_filter.describe() if self.line_filter else None,
+            'lines_sent': self.emitter.line_count,
+            'last_seq': self.emitter.last_seqs if self.emitter.tagged else self.emitter.last_seq,
+            'lines_spilled': self.lines_spilled,
+            'lines_lost': self.lines_lost,
+            'spill_bytes': self._spill_bytes,
+            'inflight': self.emitter.inflight,
+            'reorder_held': self._reorder.held if self._reorder is not None else None,
+        }
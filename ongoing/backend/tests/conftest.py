@@ -0,0 +1,13 @@
+"""
+バックエンドのユニットテスト共通設定
+core/ のモジュールは本番と同じく素の名前（import col_archive 等）で相互に import されるため、
+backend/ と backend/core/ を import パスに追加する
+"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in (os.path.join(BACKEND_DIR, "core"), BACKEND_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,94 @@
+"""ストリーミングバンドルの確定（close）と破棄（abort）"""
+import os
+import zipfile
+
+import pytest
+
+import col_archive
+from col_archive import ArchiveError, open_archive, validate_level
+
+
+def _write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.fixture
+def base(tmp_path):
+    return str(tmp_path / "loghoi_20250101_000000")
+
+
+@pytest.mark.parametrize("archive_format", ["zip", "store"])
+def test_close_publishes_complete_bundle(tmp_path, base, archive_format):
+    archive = open_archive(base, archive_format)
+    archive.add(_write(tmp_path, "a.log", b"alpha\n"), "cvm1/a.log")
+    archive.add(_write(tmp_path, "b.log", b"beta\n" * 1000), "cvm1/b.log")
+
+    path = archive.close()
+
+    assert path == base + ".zip"
+    assert not os.path.exists(path + ".part")
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        assert zf.read("cvm1/a.log") == b"alpha\n"
+        assert zf.read("cvm1/b.log") == b"beta\n" * 1000
+
+
+def test_parallel_deflate_member_is_valid(tmp_path, base, monkeypatch):
+    # 小さい閾値でチャンク並列圧縮の経路を通す
+    monkeypatch.setattr(col_archive, "PARALLEL_MIN_BYTES", 1024)
+    monkeypatch.setattr(col_archive, "CHUNK_BYTES", 4096)
+    data = b"".join(b"line %06d of a large log\n" % i for i in range(20000))
+    archive = open_archive(base, "zip", 1)
+    archive.add(_write(tmp_path, "big.log", data), "big.log")
+
+    with zipfile.ZipFile(archive.close()) as zf:
+        assert zf.read("big.log") == data
+
+
+def test_close_rejects_incomplete_bundle(tmp_path, base):
+    archive = open_archive(base, "zip")
+    archive.add(_write(tmp_path, "a.log", b"alpha\n"), "a.log")
+    archive.add(str(tmp_path / "missing.log"), "missing.log")
+
+    with pytest.raises(ArchiveError, match="missing.log"):
+        archive.close()
+
+    assert archive.failed == ["missing.log"]
+    assert not os.path.exists(base + ".zip")
+    assert not os.path.exists(base + ".zip.part")
+
+
+def test_abort_discards_partial_bundle(tmp_path, base):
+    archive = open_archive(base, "zip")
+    archive.add(_write(tmp_path, "a.log", b"alpha\n"), "a.log")
+
+    archive.abort()
+
+    assert not os.path.exists(base + ".zip")
+    assert not os.path.exists(base + ".zip.part")
+    with pytest.raises(RuntimeError):
+        archive.add(_write(tmp_path, "b.log", b"beta\n"), "b.log")
+
+
+def test_abort_after_close_removes_published_bundle(tmp_path, base):
+    archive = open_archive(base, "zip")
+    archive.add(_write(tmp_path, "a.log", b"alpha\n"), "a.log")
+    path = archive.close()
+    assert os.path.exists(path)
+
+    archive.abort()
+
+    assert not os.path.exists(path)
+
+
+def test_validate_level_ranges():
+    assert validate_level("zip", 9) == 9
+    assert validate_level("tar.zst", "22") == 22
+    assert validate_level("store", 5) == 5
+    for archive_format, level in (("zip", 10), ("zip", -1), ("tar.zst", 0), ("tar.lz4", 17)):
+        with pytest.raises(ValueError):
+            validate_level(archive_format, level)
+    with pytest.raises(ValueError):
+        validate_level("zip", "fast")
@@ -0,0 +1,59 @@
+"""行オフセットインデックスと、インデックスを使った行範囲のページ読み込み"""
+import pytest
+
+import col_lineindex
+import col_reader
+
+
+def _lines(count, trailing_newline=True):
+    text = "".join(f"{i:05d} {'x' * (i % 17)}\n" for i in range(count))
+    return text if trailing_newline else text.rstrip("\n")
+
+
+@pytest.fixture
+def small_step(monkeypatch):
+    monkeypatch.setattr(col_lineindex, "INDEX_STEP", 7)
+    # チャンク境界をまたぐ改行も数える
+    monkeypatch.setattr(col_lineindex, "READ_CHUNK", 50)
+
+
+@pytest.mark.parametrize("trailing_newline", [True, False])
+def test_build_index_offsets(tmp_path, small_step, trailing_newline):
+    log = tmp_path / "stargate.out"
+    text = _lines(100, trailing_newline)
+    log.write_text(text)
+
+    index = col_lineindex.build_index(str(log))
+
+    assert index["lines"] == 100
+    starts = [0]
+    for i, ch in enumerate(text.encode()):
+        if ch == ord("\n"):
+            starts.append(i + 1)
+    assert index["offsets"] == starts[::7][:len(index["offsets"])]
+    assert len(index["offsets"]) == (100 - 1) // 7 + 1
+    assert (tmp_path / ".stargate.out.lineidx").exists()
+
+
+def test_read_lines_pages(tmp_path, small_step):
+    log = tmp_path / "genesis.out"
+    text = _lines(250)
+    log.write_text(text)
+    expected = text.split("\n")[:-1]
+
+    for start in (0, 6, 7, 8, 99, 240):
+        assert col_reader.read_lines(str(log), start, start + 25) == expected[start:start + 25]
+    assert col_reader.read_lines(str(log), 250, 260) == []
+    assert col_reader.read_lines(str(log), 10, 10) == []
+
+
+def test_index_rebuilt_after_append(tmp_path, small_step):
+    log = tmp_path / "cerebro.out"
+    log.write_text(_lines(20))
+    assert col_lineindex.load_index(str(log))["lines"] == 20
+
+    with open(log, "a") as f:
+        f.write("appended line\n")
+
+    assert col_lineindex.load_index(str(log))["lines"] == 21
+    assert col_reader.read_lines(str(log), 20, 30) == ["appended line"]
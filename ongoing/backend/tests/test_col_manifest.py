@@ -0,0 +1,109 @@
+"""差分収集（前回ファイル + リモートで追記された範囲のみ取得）"""
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from col_manifest import NodeManifest, fetch_delta, fingerprint
+
+
+class _RemoteFile:
+    def __init__(self, path):
+        self._f = open(path, "rb")
+
+    def read(self, size=-1):
+        return self._f.read(size)
+
+    def seek(self, offset):
+        self._f.seek(offset)
+
+    def prefetch(self, file_size=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+
+class _LocalSFTP:
+    """ローカルファイルをリモートとして読む SFTPClient の代わり"""
+
+    def open(self, path, mode="r"):
+        return _RemoteFile(path)
+
+
+def _stat(path, mtime=None):
+    return SimpleNamespace(st_size=os.path.getsize(path), st_mtime=mtime or int(os.path.getmtime(path)))
+
+
+@pytest.fixture
+def files(tmp_path):
+    remote = tmp_path / "remote.log"
+    base = tmp_path / "prev" / "remote.log"
+    base.parent.mkdir()
+    content = b"".join(b"line %d\n" % i for i in range(5000))
+    remote.write_bytes(content)
+    base.write_bytes(content)
+    entry = dict(fingerprint(str(base)), mtime=int(os.path.getmtime(remote)), local_path=str(base))
+    return remote, base, entry, tmp_path / "new.log"
+
+
+def test_fetch_delta_transfers_appended_bytes_only(files):
+    remote, base, entry, local = files
+    appended = b"appended 1\nappended 2\n"
+    with open(remote, "ab") as f:
+        f.write(appended)
+    progress = []
+
+    transferred = fetch_delta(_LocalSFTP(), str(remote), _stat(remote, entry["mtime"] + 1), str(local), entry,
+                              callback=lambda done, total: progress.append((done, total)))
+
+    assert transferred == len(appended)
+    assert local.read_bytes() == remote.read_bytes()
+    assert progress[-1] == (len(appended), len(appended))
+
+
+def test_fetch_delta_unchanged_file_copies_previous(files):
+    remote, base, entry, local = files
+
+    assert fetch_delta(_LocalSFTP(), str(remote), _stat(remote, entry["mtime"]), str(local), entry) == 0
+    assert local.read_bytes() == base.read_bytes()
+
+
+def test_fetch_delta_detects_truncation(files):
+    remote, base, entry, local = files
+    remote.write_bytes(b"rotated\n")
+
+    assert fetch_delta(_LocalSFTP(), str(remote), _stat(remote), str(local), entry) is None
+    assert not local.exists()
+
+
+def test_fetch_delta_detects_rewritten_content(files):
+    remote, base, entry, local = files
+    data = bytearray(remote.read_bytes())
+    data[:4] = b"LINE"
+    remote.write_bytes(bytes(data) + b"more\n")
+
+    assert fetch_delta(_LocalSFTP(), str(remote), _stat(remote, entry["mtime"] + 1), str(local), entry) is None
+
+
+def test_manifest_round_trip_and_stale_base(tmp_path, files):
+    remote, base, entry, local = files
+    path = str(tmp_path / ".manifest" / "10.0.0.1.json")
+    manifest = NodeManifest(path)
+    assert manifest.get(str(remote)) is None
+
+    manifest.record(str(remote), str(base), 1700000000)
+    manifest.save()
+
+    loaded = NodeManifest(path).get(str(remote))
+    assert loaded["size"] == base.stat().st_size
+    assert loaded["mtime"] == 1700000000
+    assert loaded["local_path"] == str(base)
+
+    # 基準ファイルが変わっていれば使わない
+    with open(base, "ab") as f:
+        f.write(b"x")
+    assert NodeManifest(path).get(str(remote)) is None
@@ -0,0 +1,86 @@
+"""ログ検索（検索語の検証・ファイル検索・trigram インデックスによる除外）"""
+import os
+import time
+
+import pytest
+
+import col_search
+
+
+def _write(path, lines):
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+    return str(path)
+
+
+@pytest.mark.parametrize("query, regex", [
+    ("", False),
+    ("x" * (col_search.MAX_QUERY_LENGTH + 1), False),
+    ("(a", True),
+    ("(a+)+b", True),
+    (r"(a)\1", True),
+])
+def test_compile_query_rejects_invalid_queries(query, regex):
+    with pytest.raises(ValueError):
+        col_search.compile_query(query, regex=regex)
+
+
+def test_compile_query_escapes_literals():
+    pattern, flags = col_search.compile_query("a.b(", ignore_case=True)
+    assert pattern == b"a\\.b\\("
+    assert flags & col_search.re.IGNORECASE
+
+
+def test_search_file_returns_lines_with_context(tmp_path):
+    path = _write(tmp_path / "a.log", ["one", "ERROR first", "two", "three", "error second", "four"])
+    pattern, flags = col_search.compile_query("error", ignore_case=True)
+
+    matches, truncated = col_search.search_file(path, pattern, flags, context=1)
+
+    assert not truncated
+    assert matches == [
+        {"line": 2, "text": "ERROR first", "before": ["one"], "after": ["two"]},
+        {"line": 5, "text": "error second", "before": ["three"], "after": ["four"]},
+    ]
+
+
+def test_search_file_stops_at_limit(tmp_path):
+    path = _write(tmp_path / "a.log", ["hit hit"] * 5)
+    pattern, flags = col_search.compile_query("hit")
+
+    matches, truncated = col_search.search_file(path, pattern, flags, limit=3)
+
+    assert truncated
+    assert [m["line"] for m in matches] == [1, 2, 3]
+
+
+def test_search_file_raises_after_deadline(tmp_path):
+    # 検証をすり抜けた遅い正規表現も deadline で中断されること
+    path = _write(tmp_path / "a.log", ["a" * 40])
+
+    started = time.time()
+    with pytest.raises(col_search.SearchTimeout):
+        col_search.search_file(path, b"(a|aa)*c", 0, deadline=time.time() + 0.2)
+    assert time.time() - started < 5
+
+
+def test_prune_skips_files_without_query_trigrams(tmp_path):
+    bundle = tmp_path / "bundle"
+    bundle.mkdir()
+    entries = [
+        (_write(bundle / "a.log", ["kernel panic detected"]), "a.log"),
+        (_write(bundle / "b.log", ["all good"]), "b.log"),
+    ]
+    try:
+        stats = col_search.build_index(str(bundle), entries)
+    finally:
+        col_search.reset_pool()
+    assert stats["files"] == 2
+
+    assert col_search.prune(str(bundle), entries, "Panic") == ([entries[0]], 1)
+
+    # インデックス作成後に更新されたファイルは常に検索対象
+    with open(entries[1][0], "a") as f:
+        f.write("\npanic later")
+    os.utime(entries[1][0], ns=(0, 1))
+    assert col_search.prune(str(bundle), entries, "panic") == (entries, 0)
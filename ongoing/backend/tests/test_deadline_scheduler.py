@@ -0,0 +1,67 @@
+"""キーごとの期限を1本のタスクで管理する DeadlineScheduler"""
+import asyncio
+
+from fastapi_app.deadline_scheduler import DeadlineScheduler
+
+
+def test_expires_keys_in_deadline_order():
+    async def run():
+        expired = []
+
+        async def on_expire(key):
+            expired.append(key)
+
+        scheduler = DeadlineScheduler(on_expire)
+        scheduler.schedule("slow", 0.15)
+        scheduler.schedule("fast", 0.05)
+        scheduler.schedule("cancelled", 0.05)
+        scheduler.cancel("cancelled")
+        await asyncio.sleep(0.3)
+        await scheduler.close()
+        return expired, scheduler
+
+    expired, scheduler = asyncio.run(run())
+
+    assert expired == ["fast", "slow"]
+    assert scheduler.expired == 2
+    assert len(scheduler) == 0
+
+
+def test_reschedule_replaces_previous_deadline():
+    async def run():
+        expired = []
+
+        async def on_expire(key):
+            expired.append(key)
+
+        scheduler = DeadlineScheduler(on_expire)
+        scheduler.schedule("sid", 0.05)
+        scheduler.schedule("sid", 10)
+        await asyncio.sleep(0.15)
+        still_scheduled = "sid" in scheduler
+        # 前倒しした期限でも待ち時間を計算し直す
+        scheduler.schedule("sid", 0.01)
+        await asyncio.sleep(0.1)
+        await scheduler.close()
+        return expired, still_scheduled
+
+    assert asyncio.run(run()) == (["sid"], True)
+
+
+def test_failing_callback_does_not_stop_scheduler():
+    async def run():
+        expired = []
+
+        async def on_expire(key):
+            if key == "bad":
+                raise RuntimeError("boom")
+            expired.append(key)
+
+        scheduler = DeadlineScheduler(on_expire)
+        scheduler.schedule("bad", 0.01)
+        scheduler.schedule("good", 0.05)
+        await asyncio.sleep(0.15)
+        await scheduler.close()
+        return expired
+
+    assert asyncio.run(run()) == ["good"]
@@ -0,0 +1,108 @@
+"""ジョブストア（SQLite）の claim / heartbeat / 再投入の状態遷移"""
+import pytest
+
+from fastapi_app import job_queue
+from fastapi_app.job_queue import CollectionJobStore, JobLeaseLost
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "collect_jobs.db")
+
+
+@pytest.fixture
+def store(db_path):
+    return CollectionJobStore(db_path)
+
+
+def _create(store, job_id, targets):
+    store.create(job_id, targets, {"cvm": targets[0]}, {"job_id": job_id, "status": "queued"})
+
+
+def test_claim_marks_job_running(store):
+    _create(store, "j1", ["10.0.0.1"])
+
+    job_id, params = store.claim("pod-a")
+
+    assert job_id == "j1"
+    assert params == {"cvm": "10.0.0.1"}
+    record = store.get("j1")
+    assert record["status"] == "running"
+    assert record["worker"] == "pod-a"
+    assert store.claim("pod-a") is None
+
+
+def test_claim_serializes_jobs_sharing_a_cvm(store):
+    _create(store, "cluster", ["10.0.0.1", "10.0.0.2"])
+    _create(store, "single", ["10.0.0.2"])
+    _create(store, "other", ["10.0.0.3"])
+
+    assert store.claim("pod-a")[0] == "cluster"
+    # 10.0.0.2 を含む single は cluster の完了まで後回しになる
+    assert store.claim("pod-a")[0] == "other"
+    assert store.claim("pod-a") is None
+
+    store.update("cluster", status="completed")
+    store.release("cluster")
+    assert store.claim("pod-a")[0] == "single"
+
+
+def test_claim_skips_excluded_jobs(store):
+    _create(store, "j1", ["10.0.0.1"])
+
+    assert store.claim("pod-a", exclude=["j1"]) is None
+    assert store.claim("pod-a")[0] == "j1"
+
+
+def test_heartbeat_keeps_owned_jobs(store):
+    _create(store, "j1", ["10.0.0.1"])
+    store.claim("pod-a")
+
+    assert store.heartbeat(["j1"]) == []
+    assert store.recover_stale() == 0
+    assert store.get("j1")["status"] == "running"
+
+
+def test_recover_stale_requeues_and_revokes_claim(store, monkeypatch):
+    _create(store, "j1", ["10.0.0.1"])
+    store.claim("pod-a")
+    monkeypatch.setattr(job_queue, "STALE_SECONDS", -60)
+
+    assert store.recover_stale() == 1
+
+    assert store.get("j1")["status"] == "queued"
+    assert store.heartbeat(["j1"]) == ["j1"]
+    with pytest.raises(JobLeaseLost):
+        store.update("j1", progress={"stage": "download"})
+
+
+def test_reclaimed_job_belongs_to_new_worker(db_path, monkeypatch):
+    pod_a = CollectionJobStore(db_path)
+    pod_b = CollectionJobStore(db_path)
+    _create(pod_a, "j1", ["10.0.0.1"])
+    pod_a.claim("pod-a")
+    monkeypatch.setattr(job_queue, "STALE_SECONDS", -60)
+    pod_b.recover_stale()
+    monkeypatch.setattr(job_queue, "STALE_SECONDS", 120)
+
+    assert pod_b.claim("pod-b")[0] == "j1"
+
+    with pytest.raises(JobLeaseLost):
+        pod_a.update("j1", status="completed")
+    pod_b.update("j1", status="completed")
+    assert pod_a.get("j1")["status"] == "completed"
+    assert pod_a.heartbeat(["j1"]) == ["j1"]
+
+
+def test_recover_stale_fails_after_max_attempts(store, monkeypatch):
+    _create(store, "j1", ["10.0.0.1"])
+    store.claim("pod-a")
+    monkeypatch.setattr(job_queue, "STALE_SECONDS", -60)
+    monkeypatch.setattr(job_queue, "MAX_ATTEMPTS", 1)
+
+    assert store.recover_stale() == 1
+
+    record = store.get("j1")
+    assert record["status"] == "failed"
+    assert "worker lost" in record["error"]
+    assert store.claim("pod-a") is None
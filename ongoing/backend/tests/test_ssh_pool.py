@@ -0,0 +1,151 @@
+"""SSH トランスポートプール（チャネル予約・生存確認・縮退）"""
+import threading
+import time
+from types import SimpleNamespace
+
+import paramiko
+import pytest
+
+import ssh_pool
+
+
+class _Channel:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class _Transport:
+    def __init__(self):
+        self.active = True
+        self.healthy = True
+        self.on_check = None
+        self.sessions = []
+
+    def is_active(self):
+        return self.active
+
+    def is_authenticated(self):
+        return True
+
+    def set_keepalive(self, interval):
+        pass
+
+    def open_session(self, timeout=None):
+        if self.on_check is not None:
+            hook, self.on_check = self.on_check, None
+            hook()
+        if not self.healthy:
+            raise EOFError("no response")
+        channel = _Channel()
+        self.sessions.append(channel)
+        return channel
+
+
+class _Client:
+    def __init__(self):
+        self.transport = _Transport()
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def exec_command(self, command):
+        return None, SimpleNamespace(channel=self.transport.open_session()), None
+
+    def close(self):
+        self.closed = True
+        self.transport.active = False
+
+
+@pytest.fixture
+def pool():
+    clients = []
+
+    def connector(hostname):
+        clients.append(_Client())
+        return clients[-1]
+
+    pool = ssh_pool.SSHTransportPool(connector, max_channels=4, max_transports=2)
+    pool.clients = clients
+    yield pool
+    pool.close_all()
+
+
+def test_leases_share_a_transport_within_channel_limit(pool):
+    first = pool.acquire("cvm", channels=2)
+    second = pool.acquire("cvm", channels=2)
+    third = pool.acquire("cvm", channels=1)
+
+    assert len(pool.clients) == 2
+    assert first.get_transport() is second.get_transport()
+    assert third.get_transport() is not first.get_transport()
+
+    first.close()
+    second.close()
+    hosts = pool.stats()["hosts"]["cvm"]
+    assert [(h["leases"], h["channels"]) for h in hosts] == [(0, 0), (1, 1)]
+
+
+def test_lease_waits_for_a_channel_then_gives_up(pool, monkeypatch):
+    monkeypatch.setattr(ssh_pool, "CHANNEL_WAIT_TIMEOUT", 0.2)
+    lease = pool.acquire("cvm", channels=1)
+    _, stdout, _ = lease.exec_command("tail -F a.log")
+
+    # リモート側で閉じられたチャネルは予約数から外れる
+    threading.Timer(0.05, stdout.channel.close).start()
+    channel = lease.open_session()
+    assert not channel.closed
+
+    started = time.monotonic()
+    with pytest.raises(paramiko.SSHException):
+        lease.open_session()
+    assert time.monotonic() - started >= 0.2
+
+    lease.close()
+    assert channel.closed
+    assert pool.stats()["hosts"]["cvm"][0]["leases"] == 0
+
+
+def test_leased_transport_is_not_health_checked(pool, monkeypatch):
+    monkeypatch.setattr(ssh_pool, "HEALTH_CHECK_AFTER", 0)
+    first = pool.acquire("cvm")
+    transport = first.get_transport()
+    transport.healthy = False
+
+    second = pool.acquire("cvm")
+    assert second.get_transport() is transport
+    assert transport.sessions == []
+    first.close()
+    second.close()
+
+    # 貸し出しが無くなったものは確認され、応答が無ければ張り直す
+    third = pool.acquire("cvm")
+    assert third.get_transport() is not transport
+    assert pool.clients[0].closed
+    assert pool.stats()["unhealthy"] == 1
+    third.close()
+
+
+def test_unhealthy_transport_drains_until_last_release(pool, monkeypatch):
+    monkeypatch.setattr(ssh_pool, "HEALTH_CHECK_AFTER", 0)
+    pool.acquire("cvm").close()
+    transport = pool.clients[0].transport
+    transport.healthy = False
+    borrowed = []
+    # 生存確認中に別スレッド相当の貸し出しが入ったケース
+    transport.on_check = lambda: borrowed.append(pool.acquire("cvm"))
+
+    lease = pool.acquire("cvm")
+
+    assert borrowed[0].get_transport() is transport
+    assert lease.get_transport() is not transport
+    assert not pool.clients[0].closed
+    assert [h["draining"] for h in pool.stats()["hosts"]["cvm"]] == [True, False]
+
+    borrowed[0].close()
+    assert pool.clients[0].closed
+    assert len(pool.stats()["hosts"]["cvm"]) == 1
+    lease.close()
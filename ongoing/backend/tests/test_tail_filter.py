@@ -0,0 +1,42 @@
+"""tail のサーバー側フィルタ（include / exclude / 重要度）"""
+import pytest
+
+from fastapi_app.tail_filter import LineFilter, detect_severity
+
+
+def test_detect_severity():
+    assert detect_severity("E20251009 12:00:00.123456 1 stargate.cc] failed") == "ERROR"
+    assert detect_severity("W1009 12:00:00.1 1 cerebro.cc] slow") == "WARNING"
+    assert detect_severity("2025-10-09 12:00:00,123Z INFO genesis started") == "INFO"
+    assert detect_severity("2025-10-09 12:00:00 FATAL boom") == "CRITICAL"
+    assert detect_severity("    at Thread.run") is None
+
+
+def test_include_returns_spans_and_exclude_wins():
+    line_filter = LineFilter(include="err", exclude="ignore", ignore_case=True)
+
+    assert line_filter.match("ERR one err two") == [[0, 3], [8, 11]]
+    assert line_filter.match("err but ignore me") is None
+    assert line_filter.match("nothing here") is None
+    assert line_filter.highlights
+
+
+def test_severity_carries_over_to_continuation_lines_per_source():
+    line_filter = LineFilter(severity=["error", "W"])
+
+    assert line_filter.match("E20251009 12:00:00 1 a] failed", "cvm1") == []
+    assert line_filter.match("    stack frame", "cvm1") == []
+    assert line_filter.match("I20251009 12:00:00 1 a] ok", "cvm2") is None
+    assert line_filter.match("    stack frame", "cvm2") is None
+    assert line_filter.match("2025-10-09 12:00:00 WARN disk", "cvm2") == []
+
+
+def test_from_request():
+    assert LineFilter.from_request({}) is None
+    assert LineFilter.from_request({"include": ""}) is None
+    line_filter = LineFilter.from_request({"exclude": "heartbeat", "severity": "ERROR"})
+    assert line_filter.describe() == {"include": None, "exclude": "heartbeat", "severity": ["ERROR"]}
+    with pytest.raises(ValueError):
+        LineFilter.from_request({"include": "[bad"})
+    with pytest.raises(ValueError):
+        LineFilter.from_request({"severity": ["NOISE"]})
@@ -0,0 +1,99 @@
+"""複数ログの時刻順マージ（ReorderBuffer）"""
+import asyncio
+from datetime import datetime
+
+from fastapi_app.tail_merge import ReorderBuffer, parse_timestamp
+
+
+def test_parse_timestamp_formats():
+    expected = datetime(2025, 10, 9, 12, 0, 0).timestamp() + 0.5
+    assert parse_timestamp("I20251009 12:00:00.500000 1234 stargate.cc] x") == expected
+    assert parse_timestamp("2025-10-09 12:00:00,500Z INFO x") == expected
+    assert parse_timestamp("2025-10-09T12:00:00.5+00:00 x") == expected
+    assert parse_timestamp("I1009 12:00:00.5 x") == datetime(datetime.now().year, 10, 9, 12, 0, 0).timestamp() + 0.5
+    assert parse_timestamp("  at java.lang.Thread.run") is None
+    assert parse_timestamp("E20251399 12:00:00 bad date") is None
+
+
+class _Sink:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, first_seq, lines, source):
+        self.calls.append((first_seq, list(lines), source))
+
+    @property
+    def lines(self):
+        return [(source, line) for _, lines, source in self.calls for line in lines]
+
+
+def test_orders_sources_by_timestamp():
+    async def run():
+        sink = _Sink()
+        buffer = ReorderBuffer(sink, window_ms=100).start()
+        await buffer.offer(1, ["2025-10-09 12:00:01 a1", "2025-10-09 12:00:03 a3", "  continuation of a3"], "a")
+        await buffer.offer(1, ["2025-10-09 12:00:02 b2", "2025-10-09 12:00:04 b4"], "b")
+        await asyncio.sleep(0.3)
+        await buffer.close()
+        return sink
+
+    sink = asyncio.run(run())
+
+    assert [line for _, line in sink.lines] == [
+        "2025-10-09 12:00:01 a1",
+        "2025-10-09 12:00:02 b2",
+        "2025-10-09 12:00:03 a3",
+        "  continuation of a3",
+        "2025-10-09 12:00:04 b4",
+    ]
+    # 同じ送信元の連続した seq は1回の呼び出しにまとめる
+    assert (2, ["2025-10-09 12:00:03 a3", "  continuation of a3"], "a") in sink.calls
+
+
+def test_lagging_clock_does_not_hold_other_sources():
+    async def run():
+        sink = _Sink()
+        buffer = ReorderBuffer(sink, window_ms=200, max_lines=10000).start()
+        await buffer.offer(1, ["2025-10-09 12:00:05 b"], "b")
+        # 時計の遅れた送信元が、ヒープ先頭になる古い時刻の行を送り続ける
+        for i in range(8):
+            await buffer.offer(i + 1, [f"2025-10-09 11:00:{i:02d} a{i}"], "a")
+            await asyncio.sleep(0.05)
+        released = [line for _, line in sink.lines]
+        await buffer.close(flush=False)
+        return released
+
+    released = asyncio.run(run())
+
+    assert "2025-10-09 12:00:05 b" in released
+
+
+def test_max_lines_releases_oldest_first():
+    async def run():
+        sink = _Sink()
+        buffer = ReorderBuffer(sink, window_ms=60000, max_lines=3).start()
+        await buffer.offer(1, [f"2025-10-09 12:00:0{i} x{i}" for i in (5, 1, 4, 2)], "a")
+        held = buffer.held
+        released = [line for _, line in sink.lines]
+        await buffer.close(flush=False)
+        return held, released
+
+    held, released = asyncio.run(run())
+
+    # 時刻が戻った行は直前の行の時刻で扱うため、送信元内の順序は保たれる
+    assert released == ["2025-10-09 12:00:05 x5"]
+    assert held == 3
+
+
+def test_close_flushes_or_drops_held_lines():
+    async def run(flush):
+        sink = _Sink()
+        buffer = ReorderBuffer(sink, window_ms=60000).start()
+        await buffer.offer(1, ["2025-10-09 12:00:02 b"], "b")
+        await buffer.offer(1, ["2025-10-09 12:00:01 a"], "a")
+        await buffer.close(flush=flush)
+        await buffer.offer(2, ["2025-10-09 12:00:03 late"], "a")
+        return sink.lines, buffer.held
+
+    assert asyncio.run(run(True)) == ([("a", "2025-10-09 12:00:01 a"), ("b", "2025-10-09 12:00:02 b")], 0)
+    assert asyncio.run(run(False)) == ([], 0)
@@ -0,0 +1,181 @@
+"""tail ストリームの行読み込み・log_batch の ack ウィンドウ・購読者の切り離し"""
+import asyncio
+import socket
+
+import pytest
+
+from fastapi_app import tail_stream
+from fastapi_app.tail_stream import BatchEmitter, ChannelLineReader, TailStream
+
+
+class _Sio:
+    """emit を記録し、ack（callback）は呼び出し側で返す Socket.IO サーバーの代わり"""
+
+    def __init__(self, auto_ack=False):
+        self.sent = []
+        self.callbacks = []
+        self.auto_ack = auto_ack
+
+    async def emit(self, event, data=None, to=None, callback=None):
+        self.sent.append((event, data, to))
+        if callback is not None:
+            if self.auto_ack:
+                callback()
+            else:
+                self.callbacks.append(callback)
+
+    def ack(self):
+        self.callbacks.pop(0)()
+
+
+class _Channel:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv_stderr_ready(self):
+        return False
+
+    def recv(self, size):
+        if self.chunks:
+            return self.chunks.pop(0)
+        if self.closed:
+            return b""
+        raise socket.timeout()
+
+    def close(self):
+        self.closed = True
+
+
+class _Stdout:
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class _SSH:
+    def __init__(self, chunks):
+        self.channel = _Channel(chunks)
+        self.commands = []
+        self.closed = False
+
+    def exec_command(self, command):
+        self.commands.append(command)
+        return None, _Stdout(self.channel), None
+
+    def close(self):
+        self.closed = True
+
+
+def test_emitter_batches_by_line_count_and_interval():
+    async def run():
+        sio = _Sio(auto_ack=True)
+        emitter = BatchEmitter(sio, "sid1", "genesis", interval_ms=50, max_lines=2)
+        await emitter.add(["a", "b", "c"], seqs=[1, 2, 3])
+        immediate = [data["lines"] for _, data, _ in sio.sent]
+        await asyncio.sleep(0.15)
+        return immediate, sio.sent
+
+    immediate, sent = asyncio.run(run())
+
+    assert immediate == [["a", "b"]]
+    assert [data["lines"] for _, data, _ in sent] == [["a", "b"], ["c"]]
+    assert [data["first_line_number"] for _, data, _ in sent] == [1, 3]
+    assert sent[-1][1]["last_seq"] == 3
+    assert all(event == "log_batch" and to == "sid1" for event, _, to in sent)
+
+
+def test_emitter_waits_for_ack_window(monkeypatch):
+    monkeypatch.setattr(tail_stream, "MAX_INFLIGHT_BATCHES", 2)
+
+    async def run():
+        sio = _Sio()
+        emitter = BatchEmitter(sio, "sid1", "genesis", interval_ms=10000, max_lines=1)
+        await emitter.add(["1"])
+        await emitter.add(["2"])
+        blocked = asyncio.create_task(emitter.add(["3"]))
+        await asyncio.sleep(0.05)
+        sent_before_ack = len(sio.sent)
+        inflight = emitter.inflight
+        sio.ack()
+        await asyncio.wait_for(blocked, 1)
+        return sent_before_ack, inflight, len(sio.sent), emitter.inflight
+
+    assert asyncio.run(run()) == (2, 2, 3, 2)
+
+
+def test_emitter_resets_window_on_ack_timeout(monkeypatch):
+    monkeypatch.setattr(tail_stream, "MAX_INFLIGHT_BATCHES", 1)
+    monkeypatch.setattr(tail_stream, "ACK_TIMEOUT", 0.05)
+
+    async def run():
+        sio = _Sio()
+        emitter = BatchEmitter(sio, "sid1", "genesis", interval_ms=10000, max_lines=1)
+        await emitter.add(["1"])
+        await asyncio.wait_for(emitter.add(["2"]), 1)
+        return len(sio.sent), emitter.inflight
+
+    assert asyncio.run(run()) == (2, 1)
+
+
+def test_reader_splits_lines_and_caps_long_lines(monkeypatch):
+    monkeypatch.setattr(tail_stream, "MAX_LINE_BYTES", 100)
+    chunks = [b"a\nb", b"x" * 80, b"x" * 80, b"y" * 500, b"zz\nc\r\n", b"d" * 150 + b"\ne\n", b"tail"]
+
+    async def run():
+        channel = _Channel(chunks)
+        channel.closed = True
+        lines = []
+        async for batch in ChannelLineReader(channel).start():
+            lines.extend(batch)
+        return lines
+
+    lines = asyncio.run(run())
+
+    assert lines[0] == "a"
+    assert lines[1] == "b" + "x" * 99 + tail_stream.TRUNCATED_MARK
+    assert lines[2] == "c"
+    assert lines[3] == "d" * 100 + tail_stream.TRUNCATED_MARK
+    assert lines[4:] == ["e", "tail"]
+
+
+def test_stream_drops_failing_subscriber_and_reports_it():
+    async def run():
+        ssh = _SSH([b"line 1\nline 2\n"])
+        dropped = []
+        received = []
+        stream = TailStream("10.0.0.1", "/home/nutanix/data/logs/my log.out",
+                            on_dropped=lambda s, sid, error: dropped.append((sid, str(error))))
+
+        async def good(first_seq, lines):
+            received.append((first_seq, lines))
+
+        async def bad(first_seq, lines):
+            raise RuntimeError("emit failed")
+
+        stream.subscribe("good", good)
+        stream.subscribe("bad", bad)
+        await stream.start(ssh)
+        await asyncio.sleep(0.1)
+        subscribers = list(stream.subscribers)
+        await stream.close()
+        return ssh, dropped, received, subscribers, stream
+
+    ssh, dropped, received, subscribers, stream = asyncio.run(run())
+
+    assert ssh.commands == ["tail -n %d -F '/home/nutanix/data/logs/my log.out'" % tail_stream.HISTORY_LINES]
+    assert received == [(1, ["line 1", "line 2"])]
+    assert dropped == [("bad", "emit failed")]
+    assert subscribers == ["good"]
+    assert stream.closed and ssh.closed
+
+
+@pytest.mark.parametrize("after_seq, expected", [(None, (1, ["l1", "l2", "l3"], 0)), (2, (3, ["l3"], 0))])
+def test_subscribe_resumes_from_retained_lines(after_seq, expected):
+    stream = TailStream("10.0.0.1", "/tmp/a.log")
+    stream.seq = 3
+    stream.retained.extend([(1, "l1"), (2, "l2"), (3, "l3")])
+
+    assert stream.subscribe("sid", None, after_seq=after_seq) == expected
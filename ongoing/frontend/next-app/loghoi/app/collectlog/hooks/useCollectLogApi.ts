@@ -1,5 +1,6 @@
 'use client'
 import { useState, useCallback } from 'react'
+import io from 'socket.io-client'
 import { getBackendUrl } from '../../../lib/getBackendUrl'
 import { useApiCall } from '../../../hooks/useApiError'
 import { APIError, validateRequiredFields } from '../../../lib/errorHandler'
@@ -65,39 +66,66 @@ export const useCollectLogApi = () => {
       const jobId = jobResponse.job_id
       console.log('ログ収集ジョブ開始:', jobId)
       
-      // ジョブ完了をポーリング（最大5分、1秒ごと）
-      const maxAttempts = 300  // 5分 = 300 * 1秒
-      for (let i = 0; i < maxAttempts; i++) {
-        await new Promise(resolve => setTimeout(resolve, 1000)) // 1秒待機
-        
-        const statusResponse = await executeApiCall(
-          () => fetch(`${getBackendUrl()}/api/col/job/${jobId}`),
-          'getJobStatus',
-          { jobId }
-        )
-        
-        // executeApiCallは result.data を返すので、statusResponseは既にジョブオブジェクト
-        if (statusResponse?.status === 'completed') {
-          console.log('ログ収集完了:', jobId)
-          console.log('完了時刻:', new Date().toISOString())
-          // 完了時は即座にreturn（executeApiCallの処理を完了させてから）
-          return { message: 'finished collect log' }
-        } else if (statusResponse?.status === 'failed') {
-          throw new Error(`ログ収集失敗: ${statusResponse.error}`)
-        }
-        
-        // 進捗情報をログ出力とコールバック
-        const progress = statusResponse?.progress
+      // 進捗は Socket.IO の collect_progress で受信し、ポーリングは接続できない場合の保険として低頻度で行う
+      const socket = io(`${getBackendUrl()}/`, {
+        transports: ['websocket'],
+        upgrade: true,
+        rememberUpgrade: false,
+        timeout: 20000,
+        forceNew: true,
+      })
+      let job: any = { status: jobResponse.status }
+      let settle: ((job: any) => void) | null = null
+      const finished = new Promise<any>(resolve => { settle = resolve })
+      const applyUpdate = (update: any) => {
+        if (!update) return
+        job = { ...job, ...update }
+        const progress = job.progress
         if (progress) {
-          console.log(`ジョブステータス: ${statusResponse?.status} (${i + 1}/${maxAttempts})`, 
+          console.log(`ジョブステータス: ${job.status}`,
                       `stage: ${progress.stage}, progress: ${progress.current}/${progress.total}, message: ${progress.message}`)
-          // 進捗コールバックを呼び出す
-          if (onProgress) {
+          if (onProgress && update.progress) {
             onProgress(progress)
           }
-        } else {
-          console.log(`ジョブステータス: ${statusResponse?.status} (${i + 1}/${maxAttempts})`)
         }
+        if (job.status === 'completed' || job.status === 'failed') {
+          settle?.(job)
+        }
+      }
+      socket.on('connect', () => socket.emit('subscribe_job', { job_id: jobId }))
+      socket.on('collect_progress', (payload: any) => {
+        if (payload?.job_id === jobId) applyUpdate(payload)
+      })
+
+      try {
+        // 最大5分待機（Socket.IO 未接続時は1秒、接続中は5秒ごとにポーリング）
+        const deadline = Date.now() + 5 * 60 * 1000
+        while (Date.now() < deadline) {
+          const interval = socket.connected ? 5000 : 1000
+          const done = await Promise.race([
+            finished,
+            new Promise(resolve => setTimeout(() => resolve(null), interval)),
+          ])
+          if (!done) {
+            const statusResponse = await executeApiCall(
+              () => fetch(`${getBackendUrl()}/api/col/job/${jobId}`),
+              'getJobStatus',
+              { jobId }
+            )
+            applyUpdate(statusResponse)
+          }
+
+          if (job.status === 'completed') {
+            console.log('ログ収集完了:', jobId)
+            console.log('完了時刻:', new Date().toISOString())
+            return { message: 'finished collect log' }
+          } else if (job.status === 'failed') {
+            throw new Error(`ログ収集失敗: ${job.error}`)
+          }
+        }
+      } finally {
+        socket.emit('unsubscribe_job', { job_id: jobId })
+        socket.disconnect()
       }
       
       throw new Error('ログ収集がタイムアウトしました')
@@ -198,7 +226,13 @@ export const useCollectLogApi = () => {
         if (r.empty) return `EMPTY_FILE:${r.message}`
       }
 
-      const content = typeof result === 'string' ? result : (typeof (result as any).data === 'string' ? (result as any).data : '')
+      // 大きなファイルは先頭ページのみ { range, content, truncated } で返る
+      const paged = typeof result === 'object' && result && typeof (result as any).content === 'string'
+      const content = typeof result === 'string'
+        ? result
+        : paged
+          ? (result as any).content
+          : (typeof (result as any).data === 'string' ? (result as any).data : '')
       const maxLength = 10000
       if (content.length > maxLength) {
         return content.substring(0, maxLength) + '\n\n... (ログが長すぎるため、最初の10000文字のみを表示しています)'
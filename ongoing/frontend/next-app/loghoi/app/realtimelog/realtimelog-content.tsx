@@ -49,6 +49,22 @@ const RealtimelogContent = () => {
     setFilter('')
   }
 
+  // サーバー側フィルタ（次回の tail -f 開始時に適用）
+  const [includePattern, setIncludePattern] = useState<string>('')
+  const [excludePattern, setExcludePattern] = useState<string>('')
+  const [minSeverity, setMinSeverity] = useState<string>('')
+  const serverFilter = useMemo(() => {
+    const severityLevels: dict = {
+      WARNING: ['WARNING', 'ERROR', 'CRITICAL'],
+      ERROR: ['ERROR', 'CRITICAL'],
+    }
+    return {
+      include: includePattern || undefined,
+      exclude: excludePattern || undefined,
+      severity: minSeverity ? severityLevels[minSeverity] : undefined,
+    }
+  }, [includePattern, excludePattern, minSeverity])
+
   const [tailPath, setTailPath] = useState<string>('/home/nutanix/data/logs/genesis.out')
   const [tailCecked, setTailChecked] = useState<string>('genesis')
   const logListRef = useRef<HTMLDivElement>(null)
@@ -59,6 +75,12 @@ const RealtimelogContent = () => {
     // スクロール位置を保持するため、何もしない
   }, [])
 
+  // 選択中のログと一緒に tail するログ（1つのSSH接続でまとめて受信し、行ごとにログ名を表示）
+  const [extraTails, setExtraTails] = useState<string[]>([])
+  const toggleExtraTail = useCallback((name: string) => {
+    setExtraTails((prev) => (prev.includes(name) ? prev.filter((n) => n !== name) : [...prev, name]))
+  }, [])
+
   // Tailするファイル一覧 from setting_realtimelog.json
   const TailList = useMemo(() => {
     return (
@@ -75,6 +97,14 @@ const RealtimelogContent = () => {
                 <div className='hover:bg-gray-200' key={idx}>
                   <label className='label justify-start cursor-pointer pl-0.5 p-0 text-sm'>
                     <input type='radio' value={val.name} onChange={() => handleTailLog(val.name, val.path)} checked={tailCecked === val.name} />
+                    <input
+                      type='checkbox'
+                      className='checkbox checkbox-xs ml-1'
+                      title='同時にtail'
+                      disabled={tailCecked === val.name}
+                      checked={tailCecked !== val.name && extraTails.includes(val.name)}
+                      onChange={() => toggleExtraTail(val.name)}
+                    />
                     <div className='pl-1'>{val.name}</div>
                   </label>
                 </div>
@@ -84,10 +114,21 @@ const RealtimelogContent = () => {
         </div>
       </>
     )
-  }, [tailCecked, handleTailLog])
+  }, [tailCecked, handleTailLog, extraTails, toggleExtraTail])
 
   // CVM list, and connect to paramiko with checked cvm
   const ClusterName = searchParams.get('cluster')
+
+  // 全CVMの選択中のログをまとめて tail（行頭の時刻順に並べ、各行に CVM IP を表示）
+  const [allCvms, setAllCvms] = useState<boolean>(false)
+  const tailSources = useMemo(() => {
+    if (allCvms && ClusterName) return { cluster_name: ClusterName }
+    const extras = LogFiles.filter((val) => val.name !== tailCecked && extraTails.includes(val.name))
+    if (extras.length === 0) return undefined
+    return {
+      log_paths: [{ log_path: tailPath, log_name: tailCecked }, ...extras.map((val) => ({ log_path: val.path, log_name: val.name }))],
+    }
+  }, [allCvms, ClusterName, extraTails, tailCecked, tailPath])
   const [isLoading, setLoading] = useState(true)
   const [data, setData] = useState<ResValues>()
   const [apiError, setApiError] = useState<string | null>(null)
@@ -246,6 +287,31 @@ const RealtimelogContent = () => {
           </button>
         </div>
       </div>
+      <div className='p-1 flex justify-center gap-2'>
+        <input
+          type='text'
+          value={includePattern}
+          className='input input-bordered input-sm w-[200px]'
+          placeholder='含む（正規表現）'
+          onChange={(e) => setIncludePattern(e.target.value)}
+        />
+        <input
+          type='text'
+          value={excludePattern}
+          className='input input-bordered input-sm w-[200px]'
+          placeholder='除外（正規表現）'
+          onChange={(e) => setExcludePattern(e.target.value)}
+        />
+        <select
+          className='select select-bordered select-sm'
+          value={minSeverity}
+          onChange={(e) => setMinSeverity(e.target.value)}
+        >
+          <option value=''>すべての重要度</option>
+          <option value='WARNING'>WARNING以上</option>
+          <option value='ERROR'>ERROR以上</option>
+        </select>
+      </div>
       <div className='p-1'>
         <div className='p-1 flex flex-nowrap justify-center items-start'>
           <div className='form-control flex basis-1/12 p-1 border '>
@@ -268,11 +334,23 @@ const RealtimelogContent = () => {
                   <p className='inline text-xl text-red-700 '>*</p>
                   <p className='inline text-xs text-red-700 '>Prism Leader</p>
                 </div>
+                <div className='pt-1'>
+                  <label className='label justify-start cursor-pointer p-0 text-xs'>
+                    <input
+                      type='checkbox'
+                      className='checkbox checkbox-xs'
+                      checked={allCvms}
+                      disabled={!ClusterName}
+                      onChange={(e) => setAllCvms(e.target.checked)}
+                    />
+                    <span className='pl-1'>全CVM（時刻順）</span>
+                  </label>
+                </div>
               </div>
             </div>
           </div>
           <div className='p-1 flex basis-11/12 flex-col'>
-            <RealtimeLogViewer cvmChecked={cvmChecked} tailName={tailCecked} tailPath={tailPath} filter={filter} />
+            <RealtimeLogViewer cvmChecked={cvmChecked} tailName={tailCecked} tailPath={tailPath} filter={filter} serverFilter={serverFilter} tailSources={tailSources} />
           </div>
         </div>
       </div>
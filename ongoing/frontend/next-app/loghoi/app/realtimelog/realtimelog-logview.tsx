@@ -1,14 +1,16 @@
 import React from 'react'
-import LogViewer from '../../components/shared/LogViewer'
+import LogViewer, { ServerFilter, TailSources } from '../../components/shared/LogViewer'
 
 type ChildProps = {
   cvmChecked: string
   tailName: string
   tailPath: string
   filter: string
+  serverFilter?: ServerFilter
+  tailSources?: TailSources
 }
 
-export default function RealtimeLogViewer({ cvmChecked, tailName, tailPath, filter }: ChildProps) {
+export default function RealtimeLogViewer({ cvmChecked, tailName, tailPath, filter, serverFilter, tailSources }: ChildProps) {
   return (
     <LogViewer
       variant="realtime"
@@ -16,6 +18,8 @@ export default function RealtimeLogViewer({ cvmChecked, tailName, tailPath, filt
       tailName={tailName}
       tailPath={tailPath}
       filter={filter}
+      serverFilter={serverFilter}
+      tailSources={tailSources}
     />
   )
 }
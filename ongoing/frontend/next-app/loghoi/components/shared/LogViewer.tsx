@@ -4,7 +4,7 @@ import io from 'socket.io-client'
 import { saveAs } from 'file-saver'
 import { usePathname, useSearchParams } from 'next/navigation'
 import { getBackendUrl } from '../../lib/getBackendUrl'
-import VirtualizedLogList from './VirtualizedLogList'
+import VirtualizedLogList, { renderHighlightedLine } from './VirtualizedLogList'
 
 // 共通の型定義
 export interface LogEntry {
@@ -12,6 +12,34 @@ export interface LogEntry {
   line: string
   timestamp?: string
   line_number?: number
+  // 送信が追いつかずスキップされた範囲（取得後に実際の行へ置き換える）
+  gap?: { from_line: number; to_line: number }
+  // サーバー側フィルタ（include）の一致位置 [開始, 終了]
+  matches?: number[][]
+}
+
+// サーバー側フィルタ（start_tail_f で送信し、一致した行だけを受信する）
+export interface ServerFilter {
+  include?: string
+  exclude?: string
+  severity?: string[]
+  ignore_case?: boolean
+}
+
+// 複数ログの同時 tail（行ごとに送信元のラベルが付いて届く）
+export interface TailSources {
+  log_paths?: { log_path: string; log_name: string }[]
+  cvm_ips?: string[]
+  // クラスタの全CVMで同じログを tail し、行頭の時刻順に並べ替えて受信する
+  cluster_name?: string
+  ordered?: boolean
+}
+
+// 再接続時の再開位置（複数ログの場合は送信元ラベルごと）
+interface ResumePoint {
+  stream_id?: string
+  seq?: number
+  sources?: { [label: string]: { stream_id: string; seq: number } }
 }
 
 export interface LogViewerProps {
@@ -43,6 +71,8 @@ export interface LogViewerProps {
   cvmChecked?: string
   tailName?: string
   tailPath?: string
+  serverFilter?: ServerFilter
+  tailSources?: TailSources
 }
 
 // 共通のダウンロード機能
@@ -92,7 +122,9 @@ const LogViewer: React.FC<LogViewerProps> = ({
   // realtimelog用
   cvmChecked,
   tailName,
-  tailPath
+  tailPath,
+  serverFilter,
+  tailSources
 }) => {
   const pathname = usePathname()
   const searchParams = useSearchParams()
@@ -107,6 +139,9 @@ const LogViewer: React.FC<LogViewerProps> = ({
   const [isConnecting, setIsConnecting] = useState(false)
   const [isDisconnecting, setIsDisconnecting] = useState(false)
   const [realtimeLogs, setRealtimeLogs] = useState<LogEntry[]>([])
+  // 再接続時の再開用（開始パラメータ、stream_id と最後に受信した seq）
+  const tailParamsRef = useRef<any>(null)
+  const resumeRef = useRef<ResumePoint | null>(null)
 
   // 表示するログを決定（メモ化）
   const displayLogs = useMemo(() => 
@@ -210,6 +245,7 @@ const LogViewer: React.FC<LogViewerProps> = ({
   const handleDisconnect = () => {
     if (variant !== 'realtime' || !socket) return
     
+    resumeRef.current = null
     socket.disconnect()
     setSocket(null)
     setIsActive(false)
@@ -217,6 +253,20 @@ const LogViewer: React.FC<LogViewerProps> = ({
     setIsDisconnecting(false)
   }
 
+  // start_tail_f のパラメータ（再接続時の再開にも使うため保持）
+  const startTailParams = () => {
+    const params = {
+      cvm_ip: cvmChecked,
+      log_path: tailPath,
+      log_name: tailName,
+      ...serverFilter,
+      ...tailSources
+    }
+    tailParamsRef.current = params
+    resumeRef.current = null
+    return params
+  }
+
   // tail -f開始（realtimelog用）
   const handleStartTailF = () => {
     if (variant !== 'realtime' || !socket || !socket.connected) return
@@ -226,17 +276,15 @@ const LogViewer: React.FC<LogViewerProps> = ({
       return
     }
     
-    socket.emit('start_tail_f', {
-      cvm_ip: cvmChecked,
-      log_path: tailPath,
-      log_name: tailName
-    })
+    socket.emit('start_tail_f', startTailParams())
   }
 
   // tail -f停止（realtimelog用）
   const handleStopTailF = () => {
     if (variant !== 'realtime' || !socket || !socket.connected) return
     
+    resumeRef.current = null
+    
     socket.emit('stop_tail_f', {})
     
     const modal = document.getElementById('my-modal') as HTMLInputElement
@@ -279,11 +327,7 @@ const LogViewer: React.FC<LogViewerProps> = ({
     newsocket.once('connect', () => {
       console.log('🔌 Socket.IO connected, starting tail -f...')
       try {
-        newsocket.emit('start_tail_f', {
-          cvm_ip: cvmChecked,
-          log_path: tailPath,
-          log_name: tailName
-        })
+        newsocket.emit('start_tail_f', startTailParams())
         setIsConnecting(false)
       } catch (e) {
         console.error('start_tail_f emit failed:', e)
@@ -324,6 +368,7 @@ const LogViewer: React.FC<LogViewerProps> = ({
     setIsDisconnecting(true)
     
     if (socket && socket.connected) {
+      resumeRef.current = null
       socket.emit('stop_tail_f', {})
       // tail_f_statusイベントで'stopped'を受信したら切断完了
     } else {
@@ -354,8 +399,91 @@ const LogViewer: React.FC<LogViewerProps> = ({
       })
     })
 
+    // 複数行をまとめた送信（バックエンドが一定間隔・一定行数ごとに送る）
+    socket.on('log_batch', (msg: any, ack?: () => void) => {
+      // 受信確認（未確認が溜まるとバックエンドは送信を待ち、溢れた分をスキップ範囲として退避する）
+      if (typeof ack === 'function') ack()
+      const lines: string[] = Array.isArray(msg.lines) ? msg.lines : []
+      if (lines.length === 0) return
+      const first = msg.first_line_number || 0
+      const resume = resumeRef.current
+      if (resume && typeof msg.last_seq === 'number' && msg.last_seq > (resume.seq || 0)) {
+        resume.seq = msg.last_seq
+      }
+      if (resume && resume.sources && msg.last_seqs) {
+        for (const [label, seq] of Object.entries<number>(msg.last_seqs)) {
+          const point = resume.sources[label]
+          if (point && seq > point.seq) point.seq = seq
+        }
+      }
+      const sources: string[] | undefined = Array.isArray(msg.sources) ? msg.sources : undefined
+      setRealtimeLogs((logs) => [
+        ...logs,
+        ...lines.map((line, i) => ({
+          name: (sources && sources[i]) || msg.name || tailName,
+          line,
+          timestamp: msg.timestamp,
+          line_number: first ? first + i : undefined,
+          matches: Array.isArray(msg.matches) ? msg.matches[i] : undefined,
+        })),
+      ])
+    })
+
+    // スキップ通知: 目印の行を入れ、退避された行を取得して置き換える
+    socket.on('log_gap', (msg: any, ack?: () => void) => {
+      if (typeof ack === 'function') ack()
+      const lost = msg.lost ? `、うち${msg.lost}行は破棄` : ''
+      setRealtimeLogs((logs) => [
+        ...logs,
+        {
+          name: msg.name || tailName,
+          line: `--- ${msg.skipped}行をスキップ（行 ${msg.from_line}〜${msg.to_line}${lost}）取得中... ---`,
+          gap: { from_line: msg.from_line, to_line: msg.to_line },
+        },
+      ])
+      socket.emit('fetch_log_range', { from_line: msg.from_line, to_line: msg.to_line })
+    })
+
+    socket.on('log_range', (msg: any) => {
+      if (msg.error || !Array.isArray(msg.lines)) return
+      setRealtimeLogs((logs) => {
+        const index = logs.findIndex((log) => log.gap && log.gap.from_line === msg.from_line)
+        if (index < 0) return logs
+        const marker = logs[index]
+        const fetched: LogEntry[] = msg.lines.map((item: any) => ({
+          name: item.source || msg.name || marker.name,
+          line: item.line,
+          line_number: item.line_number,
+          matches: item.matches,
+        }))
+        // 残りがある場合、目印は残りの範囲に更新する
+        const rest: LogEntry[] = msg.next_line && marker.gap
+          ? [{ ...marker, gap: { from_line: msg.next_line, to_line: marker.gap.to_line } }]
+          : []
+        return [...logs.slice(0, index), ...fetched, ...rest, ...logs.slice(index + 1)]
+      })
+      // 残りの範囲を続けて取得
+      if (msg.next_line && msg.requested_to_line) {
+        socket.emit('fetch_log_range', { from_line: msg.next_line, to_line: msg.requested_to_line })
+      }
+    })
+
     socket.on('tail_f_status', (data: any) => {
       if (data.status === 'started') {
+        const prev = resumeRef.current
+        if (data.stream_id) {
+          const seq = data.resumed && prev ? Math.max(prev.seq || 0, data.seq || 0) : data.seq || 0
+          resumeRef.current = { stream_id: data.stream_id, seq }
+        } else if (Array.isArray(data.sources)) {
+          const points: { [label: string]: { stream_id: string; seq: number } } = {}
+          for (const source of data.sources) {
+            if (!source.stream_id) continue
+            const before = data.resumed && prev && prev.sources ? prev.sources[source.label] : undefined
+            const seq = before && before.stream_id === source.stream_id ? Math.max(before.seq, source.seq || 0) : source.seq || 0
+            points[source.label] = { stream_id: source.stream_id, seq }
+          }
+          resumeRef.current = { sources: points }
+        }
         setIsActive(true)
         setIsDisconnecting(false)
       } else if (data.status === 'stopped') {
@@ -398,6 +526,10 @@ const LogViewer: React.FC<LogViewerProps> = ({
       setIsConnecting(false)
       
       // 接続時は自動開始しない（手動で開始ボタンを押すまで待機）
+      // ただし tail 中に切断された場合（自動再接続）は、同じストリームを前回の続きから再開する
+      if (resumeRef.current && tailParamsRef.current) {
+        socket.emit('start_tail_f', { ...tailParamsRef.current, resume: resumeRef.current })
+      }
     })
 
     socket.on('disconnect', () => {
@@ -415,6 +547,9 @@ const LogViewer: React.FC<LogViewerProps> = ({
       if (socket) {
         socket.off('message')
         socket.off('log')
+        socket.off('log_batch')
+        socket.off('log_gap')
+        socket.off('log_range')
         socket.off('tail_f_status')
         socket.off('connect')
         socket.off('disconnect')
@@ -432,6 +567,7 @@ const LogViewer: React.FC<LogViewerProps> = ({
         // 可能ならstopを先に通知
         if (socket && socket.connected) {
           try {
+            resumeRef.current = null
             socket.emit('stop_tail_f', {})
           } catch {}
         }
@@ -663,7 +799,7 @@ const LogViewer: React.FC<LogViewerProps> = ({
                         [{log.name}]
                       </span>
                       <span className='text-gray-300 flex-1 break-all'>
-                        {log.line}
+                        {renderHighlightedLine(log)}
                       </span>
                     </div>
                   )
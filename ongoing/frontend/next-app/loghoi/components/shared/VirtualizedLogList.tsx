@@ -2,6 +2,25 @@
 import React, { useMemo, useRef, useEffect, useState } from 'react'
 import { LogEntry } from './LogViewer'
 
+// サーバー側フィルタの一致位置（matches）をハイライトして行を描画
+export const renderHighlightedLine = (log: LogEntry): React.ReactNode => {
+  if (!log.matches || log.matches.length === 0) return log.line
+  const parts: React.ReactNode[] = []
+  let cursor = 0
+  log.matches.forEach(([start, end], i) => {
+    if (start < cursor || end <= start) return
+    if (start > cursor) parts.push(log.line.slice(cursor, start))
+    parts.push(
+      <mark key={i} className='bg-yellow-300 text-black'>
+        {log.line.slice(start, end)}
+      </mark>
+    )
+    cursor = end
+  })
+  if (cursor < log.line.length) parts.push(log.line.slice(cursor))
+  return parts
+}
+
 interface VirtualizedLogListProps {
   logs: LogEntry[]
   height: number
@@ -78,7 +97,7 @@ const VirtualizedLogList: React.FC<VirtualizedLogListProps> = ({
                 textOverflow: 'ellipsis'
               }}
             >
-              {log.line}
+              {renderHighlightedLine(log)}
             </div>
           ))}
         </div>